@@ -57,14 +57,13 @@ class OPCClientDatabase(CustomClient):
         super().start()
 
         # get_all_observed_nodes have to requested before subscription # TimeoutError()
-        all_observed_nodes = self.get_server_vars(self.OPCUA_DIR_NAME)
-        for var in all_observed_nodes:
-            opctag = var.get_browse_name().Name
+        catalog = self.get_node_catalog(self.OPCUA_DIR_NAME, refresh=True)
+        for opctag, var in catalog.items():
             nodeid_identifier = str(var.nodeid.Identifier)
             self.node_dict.update({nodeid_identifier: opctag})
 
         # make subscription
-        self.make_subscription(self.OPCUA_DIR_NAME, self.get_server_vars(self.OPCUA_DIR_NAME))
+        self.make_subscription(self.OPCUA_DIR_NAME, catalog.nodes)
 
         print(DateHelper.get_local_datetime(), self.__class__.__name__, " successful connected")
         
@@ -10,6 +10,8 @@ import datetime
 from dateutil import tz
 import pandas as pd
 
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
 
 class DateHelper(object):
 
@@ -37,6 +39,23 @@ class DateHelper(object):
         # ts.round('10ms')    # round to 10ms
         return ts
 
+    @staticmethod
+    def to_timestamp_ns(dt):
+        """
+        Return nanoseconds since epoch of datetime object *dt*; naive datetime objects are interpreted as UTC (like
+        SourceTimestamps of OPC-UA)
+        """
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        return (dt - EPOCH) // datetime.timedelta(microseconds=1) * 1000
+
+    @staticmethod
+    def from_timestamp_ns(timestamp_ns):
+        """
+        Return naive datetime object (UTC, like SourceTimestamps of OPC-UA) of nanoseconds since epoch *timestamp_ns*
+        """
+        return (EPOCH + datetime.timedelta(microseconds=timestamp_ns // 1000)).replace(tzinfo=None)
+
     @staticmethod
     def round_time(dt=None, time_precision=10, to='average'):
         """
@@ -0,0 +1,123 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+"""This is the deadline scheduler.
+
+This module paces a periodic loop by absolute deadlines (start + n * period) on the monotonic clock. The time the loop
+needs for its work does not shift the following ticks, hence the achieved rate equals the requested one as long as the
+work fits into the period. Deadlines, which already passed when the loop asks for its next tick, are skipped and counted
+as missed ticks instead of being executed in a burst.
+Waiting is done by Event.wait, thus neither the start delay nor the time between two ticks keeps a CPU core busy and a
+waiting loop can be stopped at once by setting the event.
+"""
+import math
+import time
+
+__version__ = '0.7'
+__author__ = 'Sebastian Krahmer'
+
+
+class DeadlineScheduler(object):
+    def __init__(self, period_ns):
+        """
+        :param period_ns (int): time between two ticks in ns
+        """
+        self.period_ns = int(period_ns)
+
+        self._start_ns = None
+        self._deadline_ns = None
+        self._last_tick_ns = None
+        self._clock_offset_ns = 0    # wall clock - monotonic clock
+        self.tick_deadline_ns = None    # deadline of the current tick (monotonic clock)
+
+        self.ticks = 0
+        self.missed_ticks = 0
+        self._lateness_sum_ns = 0
+        self._lateness_max_ns = 0
+        self._interval_sum_ns = 0
+        self._interval_sq_sum_ns = 0
+
+    def start(self, delay_ns=0, start_time_ns=None):
+        """Set the first deadline *delay_ns* from now and reset the statistics
+
+        :param start_time_ns (int): wall clock time (ns since epoch) of the first deadline instead of a delay;
+            schedulers of several processes tick synchronously and return the same tick times, if they share
+            *start_time_ns* and period
+        """
+        self._clock_offset_ns = time.time_ns() - time.monotonic_ns()
+        if start_time_ns is None:
+            self._start_ns = time.monotonic_ns() + int(delay_ns)
+        else:
+            self._start_ns = int(start_time_ns) - self._clock_offset_ns
+        self._deadline_ns = self._start_ns
+        self._last_tick_ns = None
+        self.tick_deadline_ns = None
+
+        self.ticks = 0
+        self.missed_ticks = 0
+        self._lateness_sum_ns = 0
+        self._lateness_max_ns = 0
+        self._interval_sum_ns = 0
+        self._interval_sq_sum_ns = 0
+
+    def wait_for_next_tick(self, stop_event):
+        """Sleep until the next deadline.
+
+        :param stop_event (threading.Event): event which interrupts waiting as soon as it is set
+        :returns: number of periods since the previous tick (1 + missed ticks), 0 if *stop_event* is set
+        """
+        if self._deadline_ns is None:
+            self.start()
+
+        now_ns = time.monotonic_ns()
+        missed = 0
+        if now_ns - self._deadline_ns >= self.period_ns:
+            missed = (now_ns - self._deadline_ns) // self.period_ns
+            self._deadline_ns += missed * self.period_ns
+            self.missed_ticks += missed
+
+        remaining_ns = self._deadline_ns - now_ns
+        if remaining_ns > 0:
+            stop_event.wait(remaining_ns / 10 ** 9)
+        if stop_event.is_set():
+            return 0
+
+        now_ns = time.monotonic_ns()
+        lateness_ns = max(now_ns - self._deadline_ns, 0)
+        self._lateness_sum_ns += lateness_ns
+        self._lateness_max_ns = max(self._lateness_max_ns, lateness_ns)
+        if self._last_tick_ns is not None:
+            interval_ns = now_ns - self._last_tick_ns
+            self._interval_sum_ns += interval_ns
+            self._interval_sq_sum_ns += interval_ns * interval_ns
+        self._last_tick_ns = now_ns
+
+        self.ticks += 1
+        self.tick_deadline_ns = self._deadline_ns
+        self._deadline_ns += self.period_ns
+        return 1 + missed
+
+    def get_tick_time_ns(self):
+        """Return deadline of the current tick as wall clock time (ns since epoch)
+        """
+        return self.tick_deadline_ns + self._clock_offset_ns
+
+    def get_stats(self):
+        """Return number of ticks and missed ticks, requested and achieved rate (in Hz), mean and maximum lateness of
+        ticks behind their deadline and jitter (standard deviation of the time between two ticks) in ms
+        """
+        elapsed_ns = (self._last_tick_ns - self._start_ns) if self.ticks > 1 else 0
+        intervals = self.ticks - 1
+        jitter_ns = 0.0
+        if intervals > 0:
+            mean_ns = self._interval_sum_ns / intervals
+            jitter_ns = math.sqrt(max(self._interval_sq_sum_ns / intervals - mean_ns * mean_ns, 0.0))
+        return {
+            'ticks': self.ticks,
+            'missed_ticks': self.missed_ticks,
+            'target_rate_hz': 10 ** 9 / self.period_ns,
+            'rate_hz': (self.ticks - 1) * 10 ** 9 / elapsed_ns if elapsed_ns > 0 else 0.0,
+            'lateness_mean_ms': self._lateness_sum_ns / self.ticks / 10 ** 6 if self.ticks > 0 else 0.0,
+            'lateness_max_ms': self._lateness_max_ns / 10 ** 6,
+            'jitter_ms': jitter_ns / 10 ** 6,
+        }
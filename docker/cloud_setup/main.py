@@ -59,6 +59,7 @@ if __name__ == "__main__":
     # os.environ.setdefault("CERTIFICATE_PATH_CLIENT_PRIVATE_KEY", "/cloud_setup/opc_ua/certificates/n5geh_opcua_client_private_key.pem")
     os.environ.setdefault("OPCUA_SERVER_DIR_NAME", "demo")
     os.environ.setdefault("TOPOLOGY_PATH", "/cloud_setup/data/topology/TopologyFile_demonstrator.json")
+    os.environ.setdefault("TOPOLOGY_CACHE_DIR", "/cloud_setup/data/topology/cache")
     os.environ.setdefault("DEVICE_PATH", "/cloud_setup/data/device_config/Setup_demonstrator.txt")
 
     os.environ.setdefault("THREE_PHASE_CALCULATION", "False")
@@ -0,0 +1,81 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+"""This is the node catalog of a folder at OPC-server.
+
+The catalog holds node, browse name and data type of all variables of one folder. It is built by one Browse request
+(the browse names are part of the returned references) and one Read request for the data types of all variables,
+instead of requesting the browse name of each variable separately. Nodes can be looked up by browse name or nodeid.
+"""
+from opcua import ua
+
+__version__ = '0.7'
+__author__ = 'Sebastian Krahmer'
+
+
+class NodeCatalog(object):
+    def __init__(self, folder_name, nodes, browse_names, data_types):
+        """
+        :param folder_name (str): name of folder at server
+        :param nodes ([Node]): variables of folder
+        :param browse_names ([str]): browse name of each variable
+        :param data_types ([VariantType]): data type of each variable (None if unknown)
+        """
+        self.folder_name = folder_name
+        self.nodes = nodes
+        self.browse_names = browse_names
+        self.data_types = data_types
+
+        self._index_of_browse_name = {browse_name: i for i, browse_name in enumerate(browse_names)}
+        self._index_of_nodeid = {node.nodeid: i for i, node in enumerate(nodes)}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, nodeid):
+        return nodeid in self._index_of_nodeid
+
+    def items(self):
+        """Return pairs of browse name and node
+        """
+        return zip(self.browse_names, self.nodes)
+
+    def get_node(self, browse_name):
+        index = self._index_of_browse_name.get(browse_name)
+        return None if index is None else self.nodes[index]
+
+    def get_browse_name(self, nodeid):
+        index = self._index_of_nodeid.get(nodeid)
+        return None if index is None else self.browse_names[index]
+
+    def get_data_type(self, nodeid):
+        index = self._index_of_nodeid.get(nodeid)
+        return None if index is None else self.data_types[index]
+
+    @classmethod
+    def browse(cls, client, folder, folder_name):
+        """Build catalog of all variables of *folder* by one Browse and one Read request
+
+        :param client (opcua.Client): connected client
+        :param folder (Node): folder at server
+        :param folder_name (str): name of folder at server
+        """
+        descriptions = folder.get_children_descriptions(refs=ua.ObjectIds.HasComponent,
+                                                        nodeclassmask=ua.NodeClass.Variable)
+        nodes = [client.get_node(description.NodeId) for description in descriptions]
+        browse_names = [description.BrowseName.Name for description in descriptions]
+
+        data_types = [None] * len(nodes)
+        if len(nodes) > 0:
+            params = ua.ReadParameters()
+            for node in nodes:
+                rv = ua.ReadValueId()
+                rv.NodeId = node.nodeid
+                rv.AttributeId = ua.AttributeIds.DataType
+                params.NodesToRead.append(rv)
+
+            for i, data_value in enumerate(client.uaclient.read(params)):
+                if data_value.StatusCode.is_good():
+                    data_types[i] = ua.datatype_to_varianttype(data_value.Value.Value)
+
+        return cls(folder_name, nodes, browse_names, data_types)
@@ -9,9 +9,12 @@ This class can register new vars at server by calling server method.
 This class can make subscriptions to OPC-nodes of a given list
 This class can set new values for OPC-nodes of a given list.
 """
+import functools
 import sys
 
 from helper.DateHelper import DateHelper
+from opc_ua.client.NodeCatalog import NodeCatalog
+from opc_ua.client.subscription import BatchSubscription, SubscriptionSettings
 from opcua import ua, Client
 # from opcua.ua import DataValue
 
@@ -53,6 +56,8 @@ def numbers_to_typestrings(arg):
 
 
 class CustomClient(object):
+    REGISTER_CHUNK_SIZE = 2000  # max number of variables registered by one call of ADD_OPC_TAGS
+
     def __init__(self, server_endpoint, namespace, enable_cert, client_cert_path, client_key_path, auth_name=None,
                  auth_password=None, debug_print=False, client_request_timeout=4):
 
@@ -73,6 +78,8 @@ class CustomClient(object):
 
         self.root = None
         self.idx = None
+        self.variant_types = dict()     # nodeid -> VariantType of each node written by set_vars
+        self.node_catalogs = dict()     # folder name -> NodeCatalog
 
     def start(self):
         try:
@@ -90,6 +97,8 @@ class CustomClient(object):
         self.root = self.client.get_root_node()
         uri = self.NAMESPACE
         self.idx = self.client.get_namespace_index(uri)
+        self.variant_types = dict()
+        self.node_catalogs = dict()
 
     def stop(self):
         try:
@@ -97,6 +106,27 @@ class CustomClient(object):
         except Exception as ex:
             print("Couldn't stop OPC Client because of: ", ex)
 
+    def reconnect(self):
+        """
+        Replace a broken connection by a new session of the same client object. The old session is not closed (the
+        server drops it after session timeout), thus there is no waiting for requests to a lost server. Cached node
+        catalogs are browsed again, a folder missing at the server is dropped from the cache (the server may have
+        been restarted and recreated its nodes). Subscriptions have to be made again by the caller.
+        """
+        if self.client.keepalive is not None:
+            self.client.keepalive.stop()
+        try:
+            self.client.disconnect_socket()
+        except Exception as ex:
+            print(DateHelper.get_local_datetime(), "Couldn't close socket of OPC Client because of: ", ex)
+
+        self.client.connect()
+        self.root = self.client.get_root_node()
+
+        for child in list(self.node_catalogs):
+            if self.get_node_catalog(child, refresh=True) is None:
+                del self.node_catalogs[child]
+
     def get_server_vars(self, child):
         # TODO raise TimeOutError when called after subscription was set up, (cf. ua_client.py: send_request)
         try:
@@ -107,6 +137,25 @@ class CustomClient(object):
             return None
         return obj.get_variables()
 
+    def get_node_catalog(self, child, refresh=False):
+        """
+        Return NodeCatalog (nodes, browse names and data types) of all variables in folder *child*. The catalog is
+        cached until variables are registered by this client, it is refreshed or the client is restarted.
+        :param child: name of folder at server
+        :param refresh: flag if catalog has to be browsed again
+        """
+        if refresh or child not in self.node_catalogs:
+            try:
+                folder = self.root.get_child(["0:Objects", ("{}:" + child).format(self.idx)])
+            except BadNoMatch:
+                return None
+            catalog = NodeCatalog.browse(self.client, folder, child)
+            for node, data_type in zip(catalog.nodes, catalog.data_types):
+                if isinstance(data_type, ua.VariantType):
+                    self.variant_types[node.nodeid] = data_type
+            self.node_catalogs[child] = catalog
+        return self.node_catalogs[child]
+
     def create_dir_on_server(self, child):
         # get object node
         objects_node = self.client.get_objects_node()
@@ -118,23 +167,52 @@ class CustomClient(object):
                 objects_node.call_method(method, child)
 
     def register_variables_to_server(self, child, file_path):
-        # get object node
-        objects_node = self.client.get_objects_node()
         # get tags of variables and register them serverside in folder "child"
         mtagfile = open(file_path, 'r')
         tags_pf_output = format_textfile(mtagfile.readlines())
         mtagfile.close()
 
-        # VARIANT A
-        for method in objects_node.get_methods():
-            # print(method.get_browse_name().Name)
-            if "ADD_OPC_TAG" in method.get_browse_name().Name:
-                for i in tags_pf_output:
-                    opctag, typ = i.split()
-                    opctag, typ = opctag.strip(), int(typ)
+        opctags = []
+        typestrings = []
+        for i in tags_pf_output:
+            opctag, typ = i.split()
+            opctags.append(opctag.strip())
+            typestrings.append(numbers_to_typestrings(int(typ)))
 
-                    # call method to register var
-                    objects_node.call_method(method, opctag, numbers_to_typestrings(typ), child)
+        self.register_opc_tags(child, opctags, typestrings)
+
+    def register_opc_tags(self, child, opctags, typestrings):
+        """
+        Register new variables serverside in folder *child*.
+        :param child: name of folder at server
+        :param opctags: list of names of the new variables
+        :param typestrings: list of types of the new variables ("Int16" or "Float")
+        """
+        # get object node
+        objects_node = self.client.get_objects_node()
+
+        # VARIANT A: register all vars by one call of bulk method
+        try:
+            method = objects_node.get_child("{}:ADD_OPC_TAGS".format(self.idx))
+        except BadNoMatch:
+            method = None
+        if method is not None:
+            # chunks keep each call within client_request_timeout
+            for i in range(0, len(opctags), self.REGISTER_CHUNK_SIZE):
+                objects_node.call_method(method,
+                                         ua.Variant(list(opctags[i:i + self.REGISTER_CHUNK_SIZE]), ua.VariantType.String),
+                                         ua.Variant(list(typestrings[i:i + self.REGISTER_CHUNK_SIZE]),
+                                                    ua.VariantType.String),
+                                         child)
+        else:
+            # fallback for servers without bulk method: call method for each var
+            for method in objects_node.get_methods():
+                # print(method.get_browse_name().Name)
+                if "ADD_OPC_TAG" in method.get_browse_name().Name:
+                    for opctag, typestring in zip(opctags, typestrings):
+                        # call method to register var
+                        objects_node.call_method(method, opctag, typestring, child)
+        self.node_catalogs.pop(child, None)
 
         # VARIANT B
         # for i in tags_pf_output:
@@ -151,71 +229,199 @@ class CustomClient(object):
         #     # dv.Value = ua.Variant(1,numbers_to_vartyps(typ))
         #     # mvar.set_value(dv)
 
-    @staticmethod
-    def set_vars(observed_nodes_list, ctrl_list, value_list):
+    def cache_variant_types(self, nodes):
+        """
+        Read the VariantType of all *nodes* which are not cached yet within one ReadRequest.
+        :param nodes: list of nodes/customVars
         """
-        Set new value for node.
+        nodeids = list({node.nodeid for node in nodes if node.nodeid not in self.variant_types})
+        if len(nodeids) == 0:
+            return
+
+        params = ua.ReadParameters()
+        for nodeid in nodeids:
+            rv = ua.ReadValueId()
+            rv.NodeId = nodeid
+            rv.AttributeId = ua.AttributeIds.Value
+            params.NodesToRead.append(rv)
+
+        for nodeid, data_value in zip(nodeids, self.client.uaclient.read(params)):
+            if data_value.StatusCode.is_good():
+                self.variant_types[nodeid] = data_value.Value.VariantType
+
+    def set_vars(self, observed_nodes_list, ctrl_list, value_list):
+        """
+        Set new value for node. All values are sent within one WriteRequest, the VariantType of each node is taken from
+        cache (cf. cache_variant_types).
         :param observed_nodes_list: list of nodes, the client subscribed to
         :param ctrl_list: list of nodes to update
         :param value_list: list of values to assign
         """
-        i = 0
-        for ctrl in ctrl_list:
-            for var in observed_nodes_list:
-                if var.nodeid == ctrl.nodeid:
-                    try:
-                        variant_type = var.get_data_value().Value.VariantType
-                        var.set_value(value_list[i], variant_type)
-                        break
-                    except Exception as ex:
-                        if type(ex).__name__ in TimeoutError.__name__:
-                            print(DateHelper.get_local_datetime(), 'TimeOutError ignored while set var in OPCClient')
-                            pass
-                        else:
-                            print(DateHelper.get_local_datetime(), ex)
-                            raise
-            i += 1
+        observed_nodeids = {var.nodeid for var in observed_nodes_list}
+        nodes = []
+        values = []
+        for ctrl, value in zip(ctrl_list, value_list):
+            if ctrl.nodeid in observed_nodeids:
+                nodes.append(ctrl)
+                values.append(value)
+        if len(nodes) == 0:
+            return
+
+        try:
+            self.write_values(nodes, values)
+        except Exception as ex:
+            if type(ex).__name__ in TimeoutError.__name__:
+                print(DateHelper.get_local_datetime(), 'TimeOutError ignored while set var in OPCClient')
+                pass
+            else:
+                print(DateHelper.get_local_datetime(), ex)
+                raise
+
+    def write_values(self, nodes, values, source_timestamp=None):
+        """
+        Write *values* to *nodes* within one WriteRequest. Unlike set_vars, the nodes are not checked and errors are
+        raised.
+        :param nodes: list of nodes/customVars
+        :param values: list of values (DataValues are written as they are)
+        :param source_timestamp: SourceTimestamp of all values, which are not passed as DataValue (None: not set)
+        """
+        self.cache_variant_types(nodes)
+
+        params = ua.WriteParameters()
+        for node, value in zip(nodes, values):
+            attr = ua.WriteValue()
+            attr.NodeId = node.nodeid
+            attr.AttributeId = ua.AttributeIds.Value
+            if isinstance(value, ua.DataValue):
+                attr.Value = value
+            else:
+                attr.Value = ua.DataValue(ua.Variant(value, self.variant_types.get(node.nodeid)))
+                attr.Value.SourceTimestamp = source_timestamp
+            params.NodesToWrite.append(attr)
+
+        for status_code in self.client.uaclient.write(params):
+            status_code.check()
 
     # region subscription
     def _subscribe(self, dir_name, sub_handler, subscription, subscription_handle, list_of_nodes_to_subscribe,
-                   already_subscribed_nodes, sub_interval):
+                   already_subscribed_nodes, sub_interval, settings=None, update_existing=False, deferred_removals=None):
         """
             Make a subscription for list of nodes and return handle for subscription
                 :param dir_name: subfolder, which contains the requested nodes
                 :param sub_handler: SubHandler which will call the update_data function
                 :param subscription: subscription object
-                :param subscription_handle: handle can used to unsubscribe
+                :param subscription_handle: handle can used to unsubscribe (list of monitored item ids of
+                    already_subscribed_nodes)
                 :param list_of_nodes_to_subscribe: list of nodes/customVars
                 :param already_subscribed_nodes: list of nodes which already within subscription
                 :param sub_interval: time interval the subscribed node is checked (in ms)
+                :param settings: SubscriptionSettings of subscription and monitored items (None: default settings with
+                    publishing interval sub_interval)
+                :param update_existing: if True, only the changed monitored items of *subscription* are created or
+                    deleted (settings and sub_handler of subscription are kept), otherwise *subscription* is replaced
+                :param deferred_removals: list the deletion of removed monitored items (or of the replaced
+                    subscription) is appended to as callable instead of being executed (None: delete at once)
 
                 :return subscription:
                 :return subscription_handle
                 :return subscribed_nodes
         """
-        if subscription is not None:
-            self._unsubscribe(subscription, subscription_handle)
-            already_subscribed_nodes = []
+        if settings is None:
+            settings = SubscriptionSettings(sub_interval)
 
-        all_server_nodes = self.get_server_vars(dir_name)
-
-        for node in all_server_nodes:
+        # only nodes which exist in dir_name at server are subscribed
+        catalog = self.get_node_catalog(dir_name)
+        requested_nodeids = []
+        if catalog is not None:
             for var in list_of_nodes_to_subscribe:
-                if node.nodeid == var.nodeid:
-                    already_subscribed_nodes.append(node)
+                if var.nodeid in catalog:
+                    requested_nodeids.append(var.nodeid)
+        requested_nodeids = list(dict.fromkeys(requested_nodeids))     # drop duplicates, keep order
+
+        if subscription is not None and update_existing:
+            return self._update_monitored_items(subscription, subscription_handle, already_subscribed_nodes,
+                                                requested_nodeids, settings, deferred_removals)
+
+        # make subscription, the old subscription is deleted afterwards, thus there is no gap in notifications
+        old_subscription, old_subscription_handle = subscription, subscription_handle
+        subscribed_nodes = [self.client.get_node(nodeid) for nodeid in requested_nodeids]
+        subscription = BatchSubscription(self.client.uaclient, settings.make_parameters(), sub_handler)
+        subscription_handle = subscription.create_monitored_items(
+            settings.make_monitored_item_requests(subscription, subscribed_nodes))
+        try:
+            self._check_monitored_items(subscribed_nodes, subscription_handle)
+        except ua.UaError:
+            self._unsubscribe(subscription, subscription_handle)
+            raise
+        self.cache_variant_types(subscribed_nodes)
 
-        # make subscription
-        subscription = self.client.create_subscription(sub_interval, sub_handler)
-        subscription_handle = subscription.subscribe_data_change(already_subscribed_nodes)
+        if old_subscription is not None:
+            removal = functools.partial(self._unsubscribe, old_subscription, old_subscription_handle)
+            if deferred_removals is None:
+                removal()
+            else:
+                deferred_removals.append(removal)
 
-        return subscription, subscription_handle, already_subscribed_nodes
+        return subscription, subscription_handle, subscribed_nodes
+
+    def _update_monitored_items(self, subscription, subscription_handle, subscribed_nodes, requested_nodeids,
+                                settings, deferred_removals=None):
+        """
+        Delete monitored items of nodes, which are not requested anymore, and create monitored items for requested nodes,
+        which are not subscribed yet. Monitored items of all other nodes are kept untouched. The deletion is appended to
+        *deferred_removals* as callable, if given.
+        :return subscription:
+        :return subscription_handle
+        :return subscribed_nodes
+        """
+        requested = set(requested_nodeids)
+        subscribed = {node.nodeid for node in subscribed_nodes}
+
+        kept_nodes = []
+        kept_handles = []
+        removed_handles = []
+        for node, handle in zip(subscribed_nodes, subscription_handle):
+            if node.nodeid in requested:
+                kept_nodes.append(node)
+                kept_handles.append(handle)
+            else:
+                removed_handles.append(handle)
+        added_nodes = [self.client.get_node(nodeid) for nodeid in requested_nodeids if nodeid not in subscribed]
+
+        # new items are created first, thus a moved measurement is not missed
+        added_handles = []
+        if len(added_nodes) > 0:
+            added_handles = subscription.create_monitored_items(
+                settings.make_monitored_item_requests(subscription, added_nodes))
+            self._check_monitored_items(added_nodes, added_handles)
+            self.cache_variant_types(added_nodes)
+        if len(removed_handles) > 0:
+            removal = functools.partial(subscription.delete_monitored_items, removed_handles)
+            if deferred_removals is None:
+                removal()
+            else:
+                deferred_removals.append(removal)
+
+        if self.DEBUG_MODE_PRINT:
+            print(DateHelper.get_local_datetime(), self.__class__.__name__, "monitored items added:", len(added_nodes),
+                  "removed:", len(removed_handles), "kept:", len(kept_nodes))
+
+        return subscription, kept_handles + added_handles, kept_nodes + added_nodes
 
-    # will raise TimeoutError() - why? --> use self.subscription.delete() instead
     @staticmethod
+    def _check_monitored_items(nodes, handles):
+        """
+        Raise UaError if a monitored item could not be created, create_monitored_items returns the StatusCode
+        instead of the handle of each failed item (e.g. BadNodeIdUnknown)
+        """
+        failed = [(node, handle) for node, handle in zip(nodes, handles) if isinstance(handle, ua.StatusCode)]
+        if len(failed) > 0:
+            node, status_code = failed[0]
+            raise ua.UaError("monitored items of {} nodes could not be created, e.g. {}: {}".format(
+                len(failed), node.nodeid.to_string(), status_code))
+
+    # unsubscribe() of monitored items will raise TimeoutError() - why? --> delete whole subscription instead
     def _unsubscribe(self, subscription, subscription_handle):
-        if subscription_handle is not None:
-            # self.stop()
-            # self.start()
-            # self.subscription.delete()
-            subscription.unsubscribe(subscription_handle)
+        if subscription is not None:
+            subscription.delete()
     # endregion
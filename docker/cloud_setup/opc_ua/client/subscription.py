@@ -3,6 +3,9 @@
 import os
 from distutils.util import strtobool
 
+from opcua import ua
+from opcua.common.subscription import Subscription
+
 __version__ = '0.5'
 __author__ = 'Sebastian Krahmer'
 
@@ -26,6 +29,17 @@ class SubHandler(object):
             # print("New data change event:", node, val, "@", data.monitored_item.Value.SourceTimestamp)
             # pass
 
+    def datachange_notifications(self, notifications):
+        """Called once for each publish response (cf. BatchSubscription) with all notifications of this response
+
+        :param notifications ([(Node, datetime, value)]): node, SourceTimestamp and value of each notification
+        """
+        if hasattr(self.mclass, "update_data_batch"):
+            self.mclass.update_data_batch(notifications)
+        else:
+            for node, datetime_source, val in notifications:
+                self.mclass.update_data(node, datetime_source, val)
+
     def event_notification(self, event):
         if self.DEBUG_MODE_PRINT:
             print("New Event: ", event)
@@ -37,3 +51,127 @@ class SubHandler(object):
             print("New Status: ", status)
         else:
             pass
+
+
+class BatchSubscription(Subscription):
+    """
+    Subscription which passes all data changes of a publish response by one call of
+    handler.datachange_notifications(notifications) instead of one call of handler.datachange_notification per value.
+    Handlers without datachange_notifications are called per value as usual.
+    """
+    def _call_datachange(self, datachange):
+        if not hasattr(self._handler, "datachange_notifications"):
+            return super()._call_datachange(datachange)
+
+        notifications = []
+        with self._lock:
+            for item in datachange.MonitoredItems:
+                data = self._monitoreditems_map.get(item.ClientHandle)
+                if data is None:
+                    self.logger.warning("Received a notification for unknown handle: %s", item.ClientHandle)
+                    self.has_unknown_handlers = True
+                    continue
+                notifications.append((data.node, item.Value.SourceTimestamp, item.Value.Value.Value))
+        try:
+            self._handler.datachange_notifications(notifications)
+        except Exception:
+            self.logger.exception("Exception calling data change handler")
+
+    def delete_monitored_items(self, handles):
+        """Delete all monitored items of *handles* (as returned by create_monitored_items) within one request. Unlike
+        unsubscribe(), the internal registration of each deleted item is removed.
+        """
+        handles = [handle for handle in handles if isinstance(handle, int)]    # failed items hold a StatusCode
+        if len(handles) == 0:
+            return
+        params = ua.DeleteMonitoredItemsParameters()
+        params.SubscriptionId = self.subscription_id
+        params.MonitoredItemIds = handles
+        results = self.server.delete_monitored_items(params)
+
+        deleted = {handle for handle, result in zip(handles, results) if result.is_good()}
+        with self._lock:
+            for client_handle, data in list(self._monitoreditems_map.items()):
+                if data.server_handle in deleted:
+                    del self._monitoreditems_map[client_handle]
+        for result in results:
+            result.check()
+
+
+class SubscriptionSettings(object):
+    """
+    Parameters of a subscription and its monitored items for one group of nodes.
+    The python-opcua server implements only absolute deadbands; percent deadbands need a server which provides the
+    EURange of the nodes.
+    """
+    DEADBAND_TYPES = {
+        'none': ua.DeadbandType.None_,
+        'absolute': ua.DeadbandType.Absolute,
+        'percent': ua.DeadbandType.Percent,
+    }
+
+    def __init__(self, publishing_interval=1, sampling_interval=None, queue_size=0, discard_oldest=True,
+                 deadband_type='none', deadband_value=0.0):
+        """
+        :param publishing_interval (float): interval the server sends notifications of the subscription (in ms)
+        :param sampling_interval (float): interval the server samples each node (in ms); None: publishing_interval
+        :param queue_size (int): number of values queued for each node between two notifications; 0 or 1: only the
+            newest value is sent
+        :param discard_oldest (bool): True if the oldest value is discarded by a full queue, False if the newest
+        :param deadband_type (str): 'none', 'absolute' or 'percent'
+        :param deadband_value (float): minimal change of value causing a notification (absolute or in % of EURange)
+        """
+        self.publishing_interval = publishing_interval
+        self.sampling_interval = publishing_interval if sampling_interval is None else sampling_interval
+        self.queue_size = queue_size
+        self.discard_oldest = discard_oldest
+        self.deadband_type = deadband_type.lower()
+        self.deadband_value = deadband_value
+
+        if self.deadband_type not in self.DEADBAND_TYPES:
+            raise ValueError("Unknown deadband type: " + deadband_type)
+
+    @classmethod
+    def from_env(cls, group, **defaults):
+        """Settings of node *group* from env vars SUBSCRIPTION_<group>_PUBLISHING_INTERVAL, _SAMPLING_INTERVAL,
+        _QUEUE_SIZE, _DISCARD_OLDEST, _DEADBAND_TYPE and _DEADBAND_VALUE; unset vars are taken from *defaults*
+        """
+        settings = cls(**defaults)
+        prefix = "SUBSCRIPTION_" + group + "_"
+        return cls(float(os.environ.get(prefix + "PUBLISHING_INTERVAL", settings.publishing_interval)),
+                   float(os.environ.get(prefix + "SAMPLING_INTERVAL", settings.sampling_interval)),
+                   int(os.environ.get(prefix + "QUEUE_SIZE", settings.queue_size)),
+                   bool(strtobool(os.environ.get(prefix + "DISCARD_OLDEST", str(settings.discard_oldest)))),
+                   os.environ.get(prefix + "DEADBAND_TYPE", settings.deadband_type),
+                   float(os.environ.get(prefix + "DEADBAND_VALUE", settings.deadband_value)))
+
+    def make_parameters(self):
+        params = ua.CreateSubscriptionParameters()
+        params.RequestedPublishingInterval = self.publishing_interval
+        params.RequestedLifetimeCount = 10000
+        params.RequestedMaxKeepAliveCount = 3000
+        params.MaxNotificationsPerPublish = 10000
+        params.PublishingEnabled = True
+        params.Priority = 0
+        return params
+
+    def make_filter(self):
+        if self.deadband_type == 'none':
+            return None
+        mfilter = ua.DataChangeFilter()
+        mfilter.Trigger = ua.DataChangeTrigger.StatusValue
+        mfilter.DeadbandType = self.DEADBAND_TYPES[self.deadband_type]
+        mfilter.DeadbandValue = self.deadband_value
+        return mfilter
+
+    def make_monitored_item_requests(self, subscription, nodes):
+        """Return a MonitoredItemCreateRequest with these settings for each node of *nodes* within *subscription*
+        """
+        mfilter = self.make_filter()
+        requests = []
+        for node in nodes:
+            request = subscription._make_monitored_item_request(node, ua.AttributeIds.Value, mfilter, self.queue_size)
+            request.RequestedParameters.SamplingInterval = self.sampling_interval
+            request.RequestedParameters.DiscardOldest = self.discard_oldest
+            requests.append(request)
+        return requests
@@ -99,6 +99,7 @@ class CustomServer(object):
         # get important nodes
         self.root = self.server.get_root_node()
         self.obj = self.server.get_objects_node()
+        self.folders = dict()   # name -> folder node within objects, the variables are assigned to
 
         self.init_methods()
 
@@ -137,6 +138,30 @@ class CustomServer(object):
 
         method_node = self.obj.add_method(self.idx, "ADD_OPC_TAG", self.register_opc_tag, [inarg1, inarg2, inarg3])
 
+        # method: ADD_OPC_TAGS
+        inarg1 = ua.Argument()
+        inarg1.Name = "opctags"
+        inarg1.DataType = ua.NodeId(ua.ObjectIds.String)  # String
+        inarg1.ValueRank = 1
+        inarg1.ArrayDimensions = [0]
+        inarg1.Description = ua.LocalizedText("Names of new OPC variables")
+
+        inarg2 = ua.Argument()
+        inarg2.Name = "variant_types"
+        inarg2.DataType = ua.NodeId(ua.ObjectIds.String)  # String
+        inarg2.ValueRank = 1
+        inarg2.ArrayDimensions = [0]
+        inarg2.Description = ua.LocalizedText("Type of each variable")
+
+        inarg3 = ua.Argument()
+        inarg3.Name = "parent_node"
+        inarg3.DataType = ua.NodeId(ua.ObjectIds.String)  # String
+        inarg3.ValueRank = -1
+        inarg3.ArrayDimensions = []
+        inarg3.Description = ua.LocalizedText("Type in the name of the parent node the new variables should assigned to")
+
+        method_node = self.obj.add_method(self.idx, "ADD_OPC_TAGS", self.register_opc_tags, [inarg1, inarg2, inarg3])
+
         # method: SET_PV_LIMIT
         inarg1 = ua.Argument()
         inarg1.Name = "active_power_setpoint"
@@ -177,17 +202,28 @@ class CustomServer(object):
         try:
             obj = self.root.get_child(["0:Objects", ("{}:" + dir_name).format(self.idx)])
             self.server.delete_nodes([obj], True)
+            self.folders.pop(dir_name, None)
         except BadNoMatch:
             print(DateHelper.get_local_datetime(), "There is no old folder with the name: " + dir_name)
 
         folder = self.obj.add_folder(self.idx, dir_name)
+        self.folders[dir_name] = folder
         print(DateHelper.get_local_datetime(), "Add subfolder: " + dir_name)
 
+    def get_folder(self, parent_node):
+        """Return folder node *parent_node* within objects (cached after first lookup)
+        """
+        folder = self.folders.get(parent_node)
+        if folder is None:
+            folder = self.root.get_child(["0:Objects", ("{}:" + parent_node).format(self.idx)])
+            self.folders[parent_node] = folder
+        return folder
+
     @uamethod
     def register_opc_tag(self, parent, opctag, variant_type="Float", parent_node=""):
         # Object "parent_node":
         try:
-            obj = self.root.get_child(["0:Objects", ("{}:" + parent_node).format(self.idx)])
+            obj = self.get_folder(parent_node)
         except BadNoMatch:
             print(DateHelper.get_local_datetime(),
                   "register_opc_tag(): OPCUA_server_dir the variables should be assigned to, doesn't exists.")
@@ -199,6 +235,56 @@ class CustomServer(object):
         print(DateHelper.get_local_datetime(),
               "Add variable: " + opctag + " of type " + variant_type + " @node " + parent_node)
 
+    @uamethod
+    def register_opc_tags(self, parent, opctags, variant_types, parent_node=""):
+        """Add a writable variable for each opctag and type to *parent_node* by one AddNodes call
+        """
+        try:
+            obj = self.get_folder(parent_node)
+        except BadNoMatch:
+            print(DateHelper.get_local_datetime(),
+                  "register_opc_tags(): OPCUA_server_dir the variables should be assigned to, doesn't exists.")
+            raise
+
+        items = []
+        for opctag, variant_type in zip(opctags, variant_types):
+            var = ua.Variant(0, strings_to_vartyps(variant_type))
+
+            attrs = ua.VariableAttributes()
+            attrs.Description = ua.LocalizedText(opctag.strip())
+            attrs.DisplayName = ua.LocalizedText(opctag.strip())
+            attrs.DataType = ua.NodeId(var.VariantType.value)
+            attrs.Value = var
+            attrs.ValueRank = ua.ValueRank.Scalar
+            attrs.WriteMask = 0
+            attrs.UserWriteMask = 0
+            attrs.Historizing = False
+            attrs.AccessLevel = ua.AccessLevel.CurrentRead.mask | ua.AccessLevel.CurrentWrite.mask
+            attrs.UserAccessLevel = ua.AccessLevel.CurrentRead.mask | ua.AccessLevel.CurrentWrite.mask
+
+            item = ua.AddNodesItem()
+            item.RequestedNewNodeId = ua.NodeId(namespaceidx=self.idx)   # null identifier: generated by server
+            item.BrowseName = ua.QualifiedName(opctag.strip(), self.idx)
+            item.NodeClass = ua.NodeClass.Variable
+            item.ParentNodeId = obj.nodeid
+            item.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HasComponent)
+            item.TypeDefinition = ua.NodeId(ua.ObjectIds.BaseDataVariableType)
+            item.NodeAttributes = attrs
+            items.append(item)
+
+        # one AddNodes call with all checks of the server (parent and nodeid) like Node.add_variable of each tag
+        results = self.server.iserver.isession.add_nodes(items)
+        failed = [result for result in results if not result.StatusCode.is_good()]
+        if len(failed) > 0:
+            # remove the variables which were added, thus no partly filled folder is left
+            self.server.delete_nodes([self.server.get_node(result.AddedNodeId) for result in results
+                                      if result.StatusCode.is_good()])
+            raise ua.UaError("register_opc_tags(): " + str(len(failed)) + " variables could not be added, e.g. " +
+                             str(failed[0].StatusCode))
+
+        print(DateHelper.get_local_datetime(),
+              "Add " + str(len(items)) + " variables @node " + parent_node)
+
     @uamethod
     def set_pv_active_power_setpoint(self, parent, setpoint, parent_node=""):
         try:
@@ -0,0 +1,62 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+"""This is the command worker of the control plane.
+
+Control actions (e.g. topology update, run/stop of DiffCore) are requested by status flags, which arrive on the
+subscription thread of the opc client. These actions need network requests themselves, hence they are queued and
+executed one after another by this worker thread. So the subscription thread never blocks on a control action.
+"""
+import queue
+from threading import Thread, Lock
+
+from helper.DateHelper import DateHelper
+
+__version__ = '0.7'
+__author__ = 'Sebastian Krahmer'
+
+
+class CommandWorker(Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+
+        self._commands = queue.Queue()
+        self._pending = set()   # names of queued commands which have to be coalesced
+        self._lock = Lock()
+        self._terminated = False
+
+    def submit(self, name, func, *args, coalesce=False):
+        """Queue call of *func* with *args*
+
+        :param name (str): name of command, used for logging and coalescing
+        :param coalesce (bool): if True, the command is dropped while a command with the same name is still queued
+        :returns: True if command was queued, False if it was coalesced
+        """
+        if coalesce:
+            with self._lock:
+                if name in self._pending:
+                    return False
+                self._pending.add(name)
+        self._commands.put((name, func, args, coalesce))
+        return True
+
+    def stop(self):
+        self._terminated = True
+        self._commands.put(None)    # release a waiting worker
+
+    def run(self):
+        while not self._terminated:
+            command = self._commands.get()
+            if command is None:
+                continue
+
+            name, func, args, coalesce = command
+            if coalesce:
+                with self._lock:
+                    self._pending.discard(name)
+            try:
+                func(*args)
+            except Exception as ex:
+                print(DateHelper.get_local_datetime(), self.__class__.__name__, "command " + name + " failed:", ex)
+
+        print(DateHelper.get_local_datetime(), self.__class__.__name__, " stopped")
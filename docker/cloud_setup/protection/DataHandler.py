@@ -4,40 +4,40 @@
 """This is the Data handler.
 
 This module collects all incoming data from monitored items, which is relevant in term of the chosen topology file.
-After collecting at least one data point from each Meas device, the "FaultAssessment" DiffCore is called.
+After collecting at least one data point from each Meas device, the "FaultAssessment" DiffCore waiting for new data is
+notified.
     Methods:
 
 """
 import os
-from threading import Lock
+from threading import Lock, Condition
 
-import pandas as pd
 import time
 from distutils.util import strtobool
-from protection import LocalData
+from protection.MeasRingBuffer import MeasRingBuffer
+from protection.LatencyStats import LatencyStats
 from helper.DateHelper import DateHelper
 
 __version__ = '0.7'
 __author__ = 'Sebastian Krahmer'
 
-LocalData.mFaultStateCounter_ph1 = 0
-LocalData.mFaultStateCounter_ph2 = 0
-LocalData.mFaultStateCounter_ph3 = 0
-
 
 class DataResultWrapper:
-    def __init__(self, ctrl, misc, df_ph1, df_ph2, df_ph3):
+    def __init__(self, ctrl, misc, meas_topology, snapshot):
         """
         :param:
                 ctrl_nodes ([CustomVar]): list of all controllable OPC vars
                 misc_nodes ([CustomVar]): list of protection relevant status flag OPC vars
-                dataframe_phx (dataframe): dataframe for each phase containing all measured values for (several) timestamps
+                meas_topology (MeasTopology): incidence matrix of subgrids x measurement points
+                snapshot (MeasSnapshot): read-only snapshot containing all measured values for (several) timestamps
+
+        Neither the lists nor the snapshot are copied: node lists and topology are only replaced but never modified by
+        set_topology() and snapshots are read-only.
                 """
-        self.ctrl_nodes_list = ctrl.copy()
-        self.misc_nodes_list = misc.copy()
-        self.df_ph1 = df_ph1.copy()
-        self.df_ph2 = df_ph2.copy()
-        self.df_ph3 = df_ph3.copy()
+        self.ctrl_nodes_list = ctrl
+        self.misc_nodes_list = misc
+        self.meas_topology = meas_topology
+        self.snapshot = snapshot
 
 
 class DataHandler(object):
@@ -47,71 +47,94 @@ class DataHandler(object):
         """
         self.DEBUG_MODE_PRINT = bool(strtobool(os.environ.get("DEBUG_MODE_PRINT", "False")))
         self.TIMESTAMP_PRECISION = int(os.environ.get("TIMESTAMP_PRECISION"))
-        self.THREE_PHASE_CALCULATION = bool(strtobool(os.environ.get("THREE_PHASE_CALCULATION", "False")))
 
         self.__lock = Lock()
+        self.__new_data = Condition(self.__lock)    # notified as soon as a complete time slot exists
+        self.__interrupted = False
 
         self.opc_client = opc_client
 
-        self.slack_ph1 = None
-        self.slack_ph2 = None
-        self.slack_ph3 = None
-        self.Iph1_nodes_list = []  # CustomVars related to I-measurement in phase 1 (will used only for Diff-Sum); (PF: RES-Variable, read only)
-        self.Iph2_nodes_list = []
-        self.Iph3_nodes_list = []
+        self.meas_topology = None  # MeasTopology of I-measurement nodes (will used only for Diff-Sum); (PF: RES-Variable, read only)
         self.ctrl_nodes_list = []  # CustomVars related to actuators (will used only for feedback-control); (PF: CTRL-Variable, control only)
         self.misc_nodes_list = []  # CustomVars not directly related to grid protection (mostly status vars and vars providing additional infos); (PF: PF intern simulation vars)
 
-        self.df_ph1 = pd.DataFrame()          # dataframe for phase 1 to pass to fault_assessment
-        self.df_ph2 = pd.DataFrame()
-        self.df_ph3 = pd.DataFrame()
+        self.buffer_limit = 100     # number of time slots kept
 
-        self.clear_meas_data_flag = False
-        self.buffer_limit = 100
+        self.meas_buffer = MeasRingBuffer([], self.buffer_limit)   # ring buffer of all measurement points to pass to fault_assessment
 
-    def set_topology(self, slack_ph1, slack_ph2, slack_ph3, i_ph1_nodes_list, i_ph2_nodes_list, i_ph3_nodes_list,
-                     ctrl_nodes_list, misc_nodes_list):
-        self.slack_ph1 = slack_ph1
-        self.slack_ph2 = slack_ph2
-        self.slack_ph3 = slack_ph3
-        self.Iph1_nodes_list = i_ph1_nodes_list
-        self.Iph2_nodes_list = i_ph2_nodes_list
-        self.Iph3_nodes_list = i_ph3_nodes_list
-        self.ctrl_nodes_list = ctrl_nodes_list
-        self.misc_nodes_list = misc_nodes_list
+        self.node_index = dict()    # nodeid -> column index of each I-measurement node
+
+        self.latency_stats = LatencyStats()     # shared with DiffCore
+
+    def set_topology(self, meas_topology, ctrl_nodes_list, misc_nodes_list):
+        with self.__lock:
+            self.meas_topology = meas_topology
+            self.ctrl_nodes_list = ctrl_nodes_list
+            self.misc_nodes_list = misc_nodes_list
+
+            # reallocate ring buffer with one column per measurement point, buffered values of kept nodes are taken over
+            self.meas_buffer = MeasRingBuffer.from_buffer(self.meas_buffer,
+                                                          [var.opctag for var in meas_topology.meas_nodes_list],
+                                                          self.buffer_limit)
+            self.node_index = meas_topology.node_index
+            if self.meas_buffer.has_complete_slot():
+                self.__new_data.notify_all()
 
     def update_data(self, node, datetime_source, val):
-        # pause DiffCore Thread to not rw DataFrame which is in Update process
+        received_ns = time.time_ns()
+        # TODO necessary for real meas devices with fixed timestamp?
+        ts = DateHelper.round_time(datetime_source, self.TIMESTAMP_PRECISION)
+
+        # pause DiffCore Thread to not rw buffer which is in Update process
         with self.__lock:
-            self.check_for_unused_meas_data()
-            if self.clear_meas_data_flag:
-                self.clear_meas_data()
+            column = self.node_index.get(node.nodeid)
+            if column is None:   # node is not used for DiffCore
+                return
+
             start = time.time_ns()
-            # otherwise update data used for DiffCore
-            for var in (self.Iph1_nodes_list + self.Iph2_nodes_list + self.Iph3_nodes_list):
-                if var.nodeid == node.nodeid:
-
-                    # TODO necessary for real meas devices with fixed timestamp?
-                    ts = DateHelper.round_time(datetime_source, self.TIMESTAMP_PRECISION)
-
-                    if self.slack_ph1 is not None and var.opctag == self.slack_ph1.opctag or \
-                            self.slack_ph2 is not None and var.opctag == self.slack_ph2.opctag or \
-                            self.slack_ph3 is not None and var.opctag == self.slack_ph3.opctag:
-                        val = -val  # IMPORTANT: slack counts in negative manner
-
-                    if var.phase == 1:
-                        self.df_ph1.loc[ts, var.opctag] = val
-                        self.print_dataframe(self.df_ph1)
-                    elif var.phase == 2:
-                        self.df_ph2.loc[ts, var.opctag] = val
-                        self.print_dataframe(self.df_ph2)
-                    elif var.phase == 3:
-                        self.df_ph3.loc[ts, var.opctag] = val
-                        self.print_dataframe(self.df_ph3)
-
-                    end = time.time_ns()
-                    self.print_process_time(start, end)
-                    break
+            self.latency_stats.record('ingest', received_ns - DateHelper.to_timestamp_ns(datetime_source))
+            if self.meas_buffer.insert(ts, column, val):
+                self.latency_stats.record('slot_completion', time.time_ns() - DateHelper.to_timestamp_ns(ts))
+                self.__new_data.notify_all()    # wake up DiffCore
+            self.print_dataframe(self.meas_buffer)
+
+            end = time.time_ns()
+            self.print_process_time(start, end)
+
+    def update_data_batch(self, notifications):
+        """Store all notifications of one publish response taking the lock only once.
+
+        :param notifications ([(Node, datetime, value)]): node, SourceTimestamp and value of each notification
+        """
+        received_ns = time.time_ns()
+        timestamps = [DateHelper.round_time(datetime_source, self.TIMESTAMP_PRECISION)
+                      for node, datetime_source, val in notifications]
+
+        with self.__lock:
+            start = time.time_ns()
+            relevant = []
+            columns = []
+            for i, (node, datetime_source, val) in enumerate(notifications):
+                column = self.node_index.get(node.nodeid)
+                if column is not None:   # otherwise node is not used for DiffCore
+                    relevant.append(i)
+                    columns.append(column)
+            if len(relevant) == 0:
+                return
+
+            self.latency_stats.record_many('ingest', [received_ns - DateHelper.to_timestamp_ns(notifications[i][1])
+                                                      for i in relevant])
+            completed = self.meas_buffer.insert_many([timestamps[i] for i in relevant], columns,
+                                                     [notifications[i][2] for i in relevant])
+            if len(completed) > 0:
+                completed_ns = time.time_ns()
+                self.latency_stats.record_many('slot_completion', [completed_ns - DateHelper.to_timestamp_ns(ts)
+                                                                   for ts in completed])
+                self.__new_data.notify_all()    # wake up DiffCore
+            self.print_dataframe(self.meas_buffer)
+
+            end = time.time_ns()
+            self.print_process_time(start, end)
 
     def get_newest_data(self):
         """
@@ -121,60 +144,48 @@ class DataHandler(object):
         """
         # pause mainthread which wants to call update_data()
         with self.__lock:
-            if self.check_if_all_rows_have_an_entry():
-                df_ph1, df_ph2, df_ph3 = self.remove_nans_from_dataframe()
-
-                self.clear_meas_data_flag = True
+            return self._pop_newest_data()
 
-                return DataResultWrapper(self.ctrl_nodes_list, self.misc_nodes_list, df_ph1, df_ph2, df_ph3)
-            else:
-                self.check_for_unused_meas_data()
-                return None
+    def wait_for_newest_data(self, timeout=None):
+        """Block until a complete time slot exists, *timeout* (in s) expired or interrupt_waiting() was called.
+            :returns:
+                DataResultWrapper
+                None: if data is not complete yet
+        """
+        with self.__new_data:
+            self.__new_data.wait_for(lambda: self.__interrupted or self.check_if_all_rows_have_an_entry(), timeout)
+            self.__interrupted = False
+            return self._pop_newest_data()
 
-    # drops all rows where not all columns filled with values != NaN and check if length is
-    def check_if_all_rows_have_an_entry(self):
-        res = False
-        if self.THREE_PHASE_CALCULATION:
-            df_ph1 = self.df_ph1.dropna()
-            df_ph2 = self.df_ph2.dropna()
-            df_ph3 = self.df_ph3.dropna()
-            if len(df_ph1.columns) == len(self.Iph1_nodes_list) and len(df_ph1.index) >= 1 \
-                    and len(df_ph2.columns) == len(self.Iph2_nodes_list) and len(df_ph2.index) >= 1 \
-                    and len(df_ph3.columns) == len(self.Iph3_nodes_list) and len(df_ph3.index) >= 1:
-                res = True
-        else:
-            df_ph1 = self.df_ph1.dropna()
-            if len(df_ph1.columns) == len(self.Iph1_nodes_list) and len(df_ph1.index) >= 1:
-                res = True
-        return res
-
-    def remove_nans_from_dataframe(self):
-        # drops all rows where not all columns filled with values != NaN
-        if self.THREE_PHASE_CALCULATION:
-            self.df_ph1.dropna(inplace=True)
-            self.df_ph2.dropna(inplace=True)
-            self.df_ph3.dropna(inplace=True)
+    def interrupt_waiting(self):
+        """Release a thread blocked within wait_for_newest_data(), e.g. when DiffCore is paused.
+        """
+        with self.__new_data:
+            self.__interrupted = True
+            self.__new_data.notify_all()
+
+    def _pop_newest_data(self):
+        if self.check_if_all_rows_have_an_entry():
+            return DataResultWrapper(self.ctrl_nodes_list, self.misc_nodes_list, self.meas_topology,
+                                     self.meas_buffer.pop_complete_snapshot())
         else:
-            self.df_ph1.dropna(inplace=True)
+            return None
 
-        return self.df_ph1, self.df_ph1, self.df_ph1
+    # check if at least one time slot has an entry for each node (fill counters are updated while inserting)
+    def check_if_all_rows_have_an_entry(self):
+        return self.meas_buffer.has_complete_slot()
 
-    def check_for_unused_meas_data(self):
-        if len(self.df_ph1.index) > self.buffer_limit or len(self.df_ph2.index) > self.buffer_limit or \
-                len(self.df_ph3.index) > self.buffer_limit:
-            self.clear_meas_data_flag = True
+    def get_latency_stats(self):
+        return self.latency_stats.get_stats()
 
     def clear_meas_data(self):
-        self.df_ph1 = pd.DataFrame()
-        self.df_ph2 = pd.DataFrame()
-        self.df_ph3 = pd.DataFrame()
-
-        self.clear_meas_data_flag = False
+        with self.__lock:
+            self.meas_buffer.clear()
 
-    def print_dataframe(self, dataframe):
+    def print_dataframe(self, buffer):
         if self.DEBUG_MODE_PRINT:
             pass
-            # print(dataframe)
+            # print(buffer.to_dataframe(buffer.occupied_slots()))
 
     def print_process_time(self, start, end):
         if self.DEBUG_MODE_PRINT:
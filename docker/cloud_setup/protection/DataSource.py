@@ -5,21 +5,71 @@
 This module defines class for different types of InputData.
 """
 
+import hashlib
 import json
+import os
 # import csv
 # import tkinter as tk
 # from tkinter import filedialog
+from typing import NamedTuple
+
+import numpy as np
 from opcua import ua
 from dataclasses import dataclass
 
-__version__ = '0.5'
+__version__ = '0.7'
 __author__ = 'Sebastian Krahmer'
 
+# roles of topology nodes, named like the node groups of the subscriptions
+ROLE_I_MEAS = 'I_MEAS'          # I-measurement node, part of the incidence matrix
+ROLE_OTHER_MEAS = 'OTHER_MEAS'  # other measurement node (RES)
+ROLE_CTRL = 'CTRL'              # actuator node (CTRL)
+ROLE_STATUS = 'STATUS'          # status flag or other node not related to a device
+
+
+def phase_of_opctag(opctag):
+    """Return phase (1, 2 or 3) of node *opctag* or -1 if the node is not related to a phase
+    """
+    if 'PH1' in opctag:
+        return 1
+    elif 'PH2' in opctag:
+        return 2
+    elif 'PH3' in opctag:
+        return 3
+    return -1
+
+
+def role_of_opctag(opctag):
+    if "RES" in opctag:
+        return ROLE_I_MEAS if "_I_" in opctag else ROLE_OTHER_MEAS
+    elif "CTRL" in opctag:
+        return ROLE_CTRL
+    return ROLE_STATUS
+
+
+class TopologyEntry(NamedTuple):
+    opctag: str
+    browsename: str
+    poc: int        # index of POC (subgrid) within TopologyFile
+    role: str
+    phase: int = -1
+    sign: int = 1   # sign within current sum of POC, the slack counts negative
+
 
 class TopologyData(object):
-    def __init__(self, *argv):
+    CACHE_VERSION = 1   # has to be increased if TopologyEntry or the classification changes
+
+    def __init__(self, *argv, cache_dir=None):
+        """
+        :param argv: path of TopologyFile
+        :param cache_dir (str): directory of compiled TopologyFiles (None: no cache), the file name is the SHA-256 hash
+            of the TopologyFile content; the entries are stored as JSON, thus a cache file can not run code
+        """
         self.dict_POC = dict()
+        self.pocs = []      # one dict per POC (subgrid) of the TopologyFile
+        self.entries = []   # TopologyEntry of each node of each POC in order of TopologyFile
         self.grid_id = None
+        self.cache_dir = cache_dir
         if argv.__len__() == 0:
             self.path = None
             quit()
@@ -51,18 +101,104 @@ class TopologyData(object):
     #         self.dict_POC = dict(zip(opctags, browsename))
 
     def import_jsonfile(self):
-        with open(self.path) as jsonfile:
-            data = json.load(jsonfile)
-            self.grid_id = data["Grid-ID"]
-
-            # get OPCTags within the TopologyFile
-            opctags = []
-            browsename = []
-            for poc in data["POCs"]:
-                for key, value in poc.items():
-                    opctags.append(key)
-                    browsename.append(value)
-            self.dict_POC = dict(zip(opctags, browsename))
+        with open(self.path, 'rb') as jsonfile:
+            content = jsonfile.read()
+
+        cache_path = None
+        if self.cache_dir:
+            cache_path = os.path.join(self.cache_dir, hashlib.sha256(content).hexdigest() + '.json')
+            if self._load_compiled(cache_path):
+                return
+
+        data = json.loads(content)
+        self.grid_id = data["Grid-ID"]
+        self.entries = self.compile_pocs(data["POCs"])
+        self._index_entries()
+
+        if cache_path is not None:
+            self._save_compiled(cache_path)
+
+    @staticmethod
+    def compile_pocs(pocs):
+        """Classify each node of *pocs* (role, phase and sign) once
+
+        :param pocs ([dict]): opctag -> browsename of each POC of TopologyFile
+        :returns: [TopologyEntry]
+        """
+        entries = []
+        for poc_index, poc in enumerate(pocs):
+            for opctag, browsename in poc.items():
+                sign = -1 if "slack" in browsename.lower() else 1   # IMPORTANT: slack counts in negative manner
+                entries.append(TopologyEntry(opctag, browsename, poc_index, role_of_opctag(opctag),
+                                             phase_of_opctag(opctag), sign))
+        return entries
+
+    def _index_entries(self):
+        self.pocs = []
+        self.dict_POC = dict()
+        for entry in self.entries:
+            while len(self.pocs) <= entry.poc:
+                self.pocs.append(dict())
+            self.pocs[entry.poc][entry.opctag] = entry.browsename
+            self.dict_POC[entry.opctag] = entry.browsename
+
+        # one entry per opctag (first occurrence) for each role
+        self._entries_of_role = {ROLE_I_MEAS: [], ROLE_OTHER_MEAS: [], ROLE_CTRL: [], ROLE_STATUS: []}
+        known = set()
+        for entry in self.entries:
+            if entry.opctag not in known:
+                known.add(entry.opctag)
+                self._entries_of_role[entry.role].append(entry)
+
+    def _load_compiled(self, cache_path):
+        """Take over grid id and entries of cache file *cache_path*, returns False if the file is missing, of another
+        CACHE_VERSION or not readable (the topology is compiled again then)
+        """
+        try:
+            with open(cache_path, 'r') as cache_file:
+                cache = json.load(cache_file)
+            if cache["version"] != self.CACHE_VERSION:
+                return False
+            grid_id = cache["grid_id"]
+            entries = [TopologyEntry(str(opctag), str(browsename), int(poc), str(role), int(phase), int(sign))
+                       for opctag, browsename, poc, role, phase, sign in cache["entries"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+        self.grid_id = grid_id
+        self.entries = entries
+        self._index_entries()
+        return True
+
+    def _save_compiled(self, cache_path):
+        cache = {"version": self.CACHE_VERSION, "grid_id": self.grid_id,
+                 "entries": [list(entry) for entry in self.entries]}
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = cache_path + '.tmp'
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(cache, cache_file)
+            os.replace(tmp_path, cache_path)
+        except OSError as ex:
+            print("Couldn't cache compiled topology because of: ", ex)
+
+    def get_entries(self, role):
+        """Return one TopologyEntry per opctag of all nodes with *role* in order of TopologyFile
+        """
+        return self._entries_of_role[role]
+
+    def resolve(self, catalog):
+        """Match all nodes of topology with the variables at opc server
+
+        :param catalog (NodeCatalog): variables of folder at opc server
+        :returns: dict opctag -> CustomVar of each node, which is registered at opc server
+        """
+        server_vars = dict()
+        for opctag in self.dict_POC:
+            node = catalog.get_node(opctag)
+            if node is not None:
+                server_vars[opctag] = CustomVar(opctag, node.nodeid, phase_of_opctag(opctag))
+        return server_vars
 
     def get_opctags(self):
         return self.dict_POC.keys()
@@ -76,6 +212,93 @@ class TopologyData(object):
     def get_numberofpoc(self):
         return self.dict_POC.__len__
 
+    def get_pocs(self):
+        return self.pocs
+
+
+class MeasTopology(object):
+    def __init__(self, meas_nodes_list, subgrid_names, subgrid_phases, entries, subgrid_ctrl_nodes):
+        """Sparse signed incidence matrix of subgrids (rows) x measurement points (columns).
+
+        :param meas_nodes_list ([CustomVar]): I-measurement points, each one is represented by a column
+        :param subgrid_names ([str]): name of each subgrid, each one is represented by a row
+        :param subgrid_phases ([int]): phase of each subgrid
+        :param entries ([(int, int, int)]): nonzero elements (row, column, sign) of the incidence matrix;
+            each subgrid needs at least one element
+        :param subgrid_ctrl_nodes ([[CustomVar]]): controllable nodes to curtail, if the subgrid is faulty
+        """
+        entries = sorted(entries)
+
+        self.meas_nodes_list = meas_nodes_list
+        self.subgrid_names = subgrid_names
+        self.subgrid_phases = np.array(subgrid_phases, dtype=int)
+        self.subgrid_ctrl_nodes = subgrid_ctrl_nodes
+        self.node_index = {var.nodeid: column for column, var in enumerate(meas_nodes_list)}
+
+        # CSR representation: elements sorted by row, row_starts points to the first element of each row
+        rows = np.array([row for row, column, sign in entries], dtype=int)
+        self._columns = np.array([column for row, column, sign in entries], dtype=int)
+        self._signs = np.array([sign for row, column, sign in entries], dtype=float)
+        self._row_starts = np.searchsorted(rows, np.arange(len(subgrid_names)))
+
+    def __len__(self):
+        return len(self.subgrid_names)
+
+    def balances(self, values):
+        """Sparse matrix product of the incidence matrix with the measured currents of several time slots.
+
+        :param values (ndarray): currents as array of slots x measurement points
+        :returns: current sum as array of subgrids x slots
+        """
+        if len(self) == 0:
+            return np.zeros((0, len(values)))
+        contributions = values[:, self._columns] * self._signs
+        return np.add.reduceat(contributions, self._row_starts, axis=1).T
+
+    @classmethod
+    def from_topology(cls, topo_data, server_vars, phases):
+        """Compile *topo_data* into an incidence matrix. Each POC of the TopologyFile is a subgrid for each of the
+        given *phases*, the POC's I-measurement nodes of a phase are its columns and its slack counts negative.
+
+        :param topo_data (TopologyData): topology
+        :param server_vars (dict): opctag -> CustomVar of each node registered at opc server (cf. TopologyData.resolve)
+        :param phases ([int]): phases to evaluate
+        """
+        # I-measurement entries of each POC and phase and ctrl nodes of each POC, which are registered at opc server
+        meas_entries_of_poc = [{phase: [] for phase in phases} for _ in topo_data.get_pocs()]
+        ctrl_nodes_of_poc = [[] for _ in topo_data.get_pocs()]
+        for entry in topo_data.entries:
+            if entry.role == ROLE_I_MEAS:
+                meas_entries = meas_entries_of_poc[entry.poc].get(entry.phase)
+                if meas_entries is not None and entry.opctag in server_vars:
+                    meas_entries.append(entry)
+            elif entry.role == ROLE_CTRL and entry.opctag in server_vars:
+                ctrl_nodes_of_poc[entry.poc].append(server_vars[entry.opctag])
+
+        meas_nodes_list = []
+        column_of_opctag = dict()
+        subgrid_names = []
+        subgrid_phases = []
+        subgrid_ctrl_nodes = []
+        entries = []
+        for poc_index, meas_entries_of_phase in enumerate(meas_entries_of_poc):
+            for phase in phases:
+                row_entries = []
+                for entry in meas_entries_of_phase[phase]:
+                    if entry.opctag not in column_of_opctag:
+                        column_of_opctag[entry.opctag] = len(meas_nodes_list)
+                        meas_nodes_list.append(server_vars[entry.opctag])
+                    row_entries.append((column_of_opctag[entry.opctag], entry.sign))
+
+                if row_entries:
+                    row = len(subgrid_names)
+                    subgrid_names.append("{}_POC{}_PH{}".format(topo_data.grid_id, poc_index + 1, phase))
+                    subgrid_phases.append(phase)
+                    subgrid_ctrl_nodes.append(ctrl_nodes_of_poc[poc_index])
+                    entries.extend((row, column, sign) for column, sign in row_entries)
+
+        return cls(meas_nodes_list, subgrid_names, subgrid_phases, entries, subgrid_ctrl_nodes)
+
 
 @dataclass
 class CustomVar:
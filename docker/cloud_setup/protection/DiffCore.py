@@ -4,25 +4,64 @@
 
 """This is the Differential protection Algorithm Core module.
 
-    This module checks for a dataframe (which contains for all relevant nodes at least one value)
-    if sum of currents within the subgrid is zero.
+    This module waits for a snapshot (which contains for all relevant nodes at least one value) and checks
+    if sum of currents within each subgrid is zero. All subgrids are evaluated at once by a sparse matrix product of
+    their signed incidence matrix with the measured currents.
 
     If there is an deviation greater than an epsilon, that ctrl_nodes gets new values via OPC-client.
 """
+import concurrent.futures
 import os
 import time
 from distutils.util import strtobool
-from threading import Thread
+from threading import Thread, Event
+
+import numpy as np
+from opcua import ua
 
 from helper.DateHelper import DateHelper
-from protection import LocalData
 
 __version__ = '0.7'
 __author__ = 'Sebastian Krahmer'
 
+# errors of a lost or broken connection to the server, the core backs off while the opc client reconnects
+CONNECTION_ERRORS = (OSError, concurrent.futures.TimeoutError, ua.UaError)
+
+
+def evaluate_balances(meas_topology, values, eps_abs):
+    """Evaluate Kirchhoff's current law for all subgrids and time slots at once.
+
+    :param meas_topology (MeasTopology): incidence matrix of subgrids x measurement points
+    :param values (ndarray): currents as array of slots x measurement points
+    :param eps_abs (float): permissible absolute deviation of current sum to zero
+    :returns:
+        balances (ndarray): current sum as array of subgrids x slots
+        faulty (ndarray): bool array of subgrids x slots, True if the balance exceeds eps_abs
+    """
+    balances = meas_topology.balances(values)
+    return balances, np.abs(balances) >= eps_abs
+
+
+def update_fault_state_counters(counters, faulty, max_faulty_states):
+    """Increase counter of each faulty subgrid, decrease counter of each valid subgrid, both within
+    [0, max_faulty_states]
+    """
+    return np.clip(counters + np.where(faulty, 1, -1), 0, max_faulty_states)
 
-def sums(row):
-    return row.sum()
+
+def advance_fault_state_counters(counters, faulty, max_faulty_states):
+    """Update counters slot by slot in the given order of *faulty* (bool array of subgrids x slots)
+
+    :returns:
+        counters (ndarray): counter of each subgrid after the last slot
+        trip_slots (ndarray): index of the first faulty slot whose counter reached max_faulty_states for each subgrid;
+            -1 if subgrid did not trip
+    """
+    trip_slots = np.full(len(counters), -1)
+    for slot, faulty_of_slot in enumerate(faulty.T):
+        counters = update_fault_state_counters(counters, faulty_of_slot, max_faulty_states)
+        trip_slots[(trip_slots < 0) & faulty_of_slot & (counters >= max_faulty_states)] = slot
+    return counters, trip_slots
 
 
 class DiffCore(Thread):
@@ -36,14 +75,18 @@ class DiffCore(Thread):
                 data_handler (DataHandler): instance of DataHandler (Bufferclass for incoming data of monitored items)
                 nominal_current (int): nominal current of biggest cable close to MV/LV transformer in A
                 eps (float): permissible deviation of current sum to zero in x/100%
-                number_of_faulty_dates_to_failure (int): number of allowed consecutive faulty states within one phase
+                number_of_faulty_dates_to_failure (int): number of allowed consecutive faulty states within one subgrid
         """
         self.DEBUG_MODE_PRINT = bool(strtobool(os.environ.get("DEBUG_MODE_PRINT", "False")))
         self.NOMINAL_CURRENT = int(os.environ.get("NOMINAL_CURRENT", nominal_current))
         self.CURRENT_EPS = float(os.environ.get("CURRENT_EPS", eps))
         self.MAX_FAULTY_STATES = int(os.environ.get("MAX_FAULTY_STATES", number_of_faulty_states_to_failure))
-        # three_phase_mode: True if calculation should be for all three phases, False if only single phase
-        self.THREE_PHASE_CALCULATION = bool(strtobool(os.environ.get("THREE_PHASE_CALCULATION", "False")))
+        # batch_evaluation: True if all complete timestamps since last evaluation are evaluated, False if only newest
+        self.BATCH_EVALUATION = bool(strtobool(os.environ.get("BATCH_EVALUATION", "True")))
+        # maximal waiting time in s after a failed evaluation, the waiting time doubles with each failure in a row
+        self.MAX_ERROR_BACKOFF = float(os.environ.get("DIFF_CORE_MAX_ERROR_BACKOFF", "5"))
+        # number of unexpected errors in a row (i.e. no connection errors) after which the core pauses itself
+        self.MAX_EVALUATION_ERRORS = int(os.environ.get("DIFF_CORE_MAX_EVALUATION_ERRORS", "10"))
 
         self.opc_client = opc_client
         self.data_handler = data_handler
@@ -52,140 +95,186 @@ class DiffCore(Thread):
         self.ctrl_nodes_list = []
         self.misc_nodes_list = []
 
-        self.df_ph1 = None
-        self.df_ph2 = None
-        self.df_ph3 = None
+        self.meas_topology = None
+        self.fault_state_counters = np.zeros(0, dtype=int)    # one counter for each subgrid of meas_topology
+        self.balances = None    # current sum of last evaluation as array of subgrids x slots
+
+        self.latency_stats = data_handler.latency_stats
 
-        self._is_running = False
+        self.consecutive_errors = 0         # failed evaluations in a row
+        self.consecutive_evaluation_errors = 0      # unexpected errors in a row, cf. MAX_EVALUATION_ERRORS
+
+        self._is_running = Event()
+        self._interrupt = Event()   # set to interrupt the backoff after a failed evaluation
+        self._terminated = False
         self.print_work_status('init')
 
     def run(self):
-        self._is_running = True
+        self._is_running.set()
         self.set_status_online_grid_protection(1)
         self.print_work_status('started')
-        while True:
-            while self.is_running():
+        while not self._terminated:
+            self._is_running.wait()     # a paused core is blocked here
+            if self._terminated:
+                break
+            try:
                 self.check_for_new_data()
-                time.sleep(0.005)
-            time.sleep(1)
+            except CONNECTION_ERRORS as ex:
+                # e.g. lost connection while setting ctrl nodes, the core keeps running while opc client reconnects
+                print(DateHelper.get_local_datetime(), self.__class__.__name__, 'evaluation failed:', ex)
+                self.back_off()
+            except Exception as ex:
+                # e.g. a programming error, which would fail again with each evaluation
+                self.consecutive_evaluation_errors += 1
+                print(DateHelper.get_local_datetime(), self.__class__.__name__, 'unexpected error in evaluation',
+                      '({} in a row):'.format(self.consecutive_evaluation_errors), repr(ex))
+                if self.consecutive_evaluation_errors >= self.MAX_EVALUATION_ERRORS:
+                    self.pause_after_errors()
+                else:
+                    self.back_off()
+            else:
+                self.consecutive_errors = 0
+                self.consecutive_evaluation_errors = 0
+        self.print_work_status('stopped')
+
+    def back_off(self):
+        """Wait after a failed evaluation, 0.1 s doubled with each failure in a row up to MAX_ERROR_BACKOFF
+        """
+        self.consecutive_errors += 1
+        self._interrupt.wait(min(0.1 * 2 ** (self.consecutive_errors - 1), self.MAX_ERROR_BACKOFF))
+
+    def pause_after_errors(self):
+        print(DateHelper.get_local_datetime(), self.__class__.__name__, 'pause after',
+              self.consecutive_evaluation_errors, 'unexpected errors in a row')
+        try:
+            self.pause()
+        except Exception as ex:
+            # the core is paused anyway, only the status node could not be written
+            print(DateHelper.get_local_datetime(), self.__class__.__name__, 'could not set status:', ex)
+
+    def stop(self):
+        self._terminated = True
+        self._is_running.set()      # release a paused core
+        self._interrupt.set()
+        self.data_handler.interrupt_waiting()
 
     def pause(self):
-        self._is_running = False
+        self._is_running.clear()
+        self.data_handler.interrupt_waiting()
         self.set_status_online_grid_protection(0)
         self.print_work_status('paused')
 
     def resume(self):
-        self._is_running = True
+        self.consecutive_errors = 0
+        self.consecutive_evaluation_errors = 0
+        self._is_running.set()
         self.set_status_online_grid_protection(1)
         self.print_work_status('resumed')
 
     def is_running(self):
-        return self._is_running
+        return self._is_running.is_set()
 
     def check_for_new_data(self):
-        res = self.data_handler.get_newest_data()
-
-        if res is not None:
-            self.ctrl_nodes_list = res.ctrl_nodes_list
-            self.misc_nodes_list = res.misc_nodes_list
-            self.df_ph1 = res.df_ph1
-            self.df_ph2 = res.df_ph2
-            self.df_ph3 = res.df_ph3
-
-            if self.THREE_PHASE_CALCULATION and (self.df_ph1 is None or self.df_ph2 is None or self.df_ph3 is None)\
-                    or not self.THREE_PHASE_CALCULATION and self.df_ph1 is None:
-                pass
-            else:
-                self.evaluate_balance_of_current()
+        # woken up by DataHandler as soon as the last node of a time slot has reported
+        res = self.data_handler.wait_for_newest_data()
 
-    # evaluate the balance (of current) for the closest timestamp
-    def evaluate_balance_of_current(self):
-        self.df_ph1['sum'] = self.df_ph1.apply(func=sums, axis=1)
+        if res is not None and self.is_running():
+            self.evaluate_data(res)
 
-        if self.THREE_PHASE_CALCULATION:
-            self.df_ph2['sum'] = self.df_ph2.apply(func=sums, axis=1)
-            self.df_ph3['sum'] = self.df_ph3.apply(func=sums, axis=1)
+    def evaluate_data(self, res):
+        """Evaluate the complete time slots of *res* (all of them if BATCH_EVALUATION, otherwise only the newest one)
 
-        result_code = "VALID"
+        :param res (DataResultWrapper): result of DataHandler
+        :returns: number of evaluated time slots
+        """
+        self.ctrl_nodes_list = res.ctrl_nodes_list
+        self.misc_nodes_list = res.misc_nodes_list
+
+        if res.meas_topology is not self.meas_topology:
+            # topology was swapped, keep fault state of subgrids which are part of both topologies
+            self.remap_fault_state_counters(self.meas_topology, res.meas_topology)
+            self.meas_topology = res.meas_topology
+        snapshot = res.snapshot
+        order = self.order_by_timestamp(snapshot)
+        if not self.BATCH_EVALUATION:
+            order = order[-1:]      # newest timestamp only, ring buffer order may differ after wrap-around
+        self.evaluate_balance_of_current(snapshot.values[order], [snapshot.timestamps[slot] for slot in order],
+                                         snapshot.completed_ns[order])
+        return len(order)
 
-        try:
-            if self.THREE_PHASE_CALCULATION:
-                if abs(self.df_ph1.iloc[-1][
-                           'sum']) >= self.eps_abs:  # if sum of closest timestamp is bigger than threshold
-                    result_code = "INVALID"
-                    self.evaluate_historical_balances_of_current(1)  # otherwise check if in past sum=0 was violated as well
-                else:
-                    self.decrease_fault_state_counter(1)
+    @staticmethod
+    def order_by_timestamp(snapshot):
+        """Return indices of all slots of *snapshot* ordered by timestamp
+        """
+        return sorted(range(len(snapshot)), key=snapshot.timestamps.__getitem__)
 
-                if abs(self.df_ph2.iloc[-1]['sum']) >= self.eps_abs and result_code == "VALID":
-                    result_code = "INVALID"
-                    self.evaluate_historical_balances_of_current(2)
-                else:
-                    self.decrease_fault_state_counter(2)
+    # evaluate the balance (of current) for each given timestamp
+    def evaluate_balance_of_current(self, values, timestamps=None, completed_ns=None):
+        """
+        :param values (ndarray): currents as array of slots x measurement points (ordered by timestamp)
+        :param timestamps ([datetime]): timestamp of each slot, used for latency statistics only
+        :param completed_ns (ndarray): time each slot was completed (ns since epoch), used for latency statistics only
+        """
+        self.balances, faulty = evaluate_balances(self.meas_topology, values, self.eps_abs)
 
-                if abs(self.df_ph3.iloc[-1]['sum']) >= self.eps_abs and result_code == "VALID":
-                    result_code = "INVALID"
-                    self.evaluate_historical_balances_of_current(3)
-                else:
-                    self.decrease_fault_state_counter(3)
-            else:
-                if abs(self.df_ph1.iloc[-1]['sum']) >= self.eps_abs:
-                    result_code = "INVALID"
-                    self.evaluate_historical_balances_of_current(1)
-                else:
-                    self.decrease_fault_state_counter(1)
-
-            self.send_fault_state_counter_to_server()
-
-            self.print_current_result(result_code)
-        except IndexError as ex:
-            print('evaluate_balance_of_current()')
-            print(ex)
-
-    # check the recent balances (of current) of selected phase
-    def evaluate_historical_balances_of_current(self, faulty_phase):
-        if faulty_phase == 1:
-            self.increase_fault_state_counter(faulty_phase)
-            # if within the last stored timestamps (size of MAX_ARCHIVES) are at least MAX_FAULTY_STATES
-            if LocalData.mFaultStateCounter_ph1 >= self.MAX_FAULTY_STATES:
-                self.set_power_infeed_limit(0)
-
-        elif faulty_phase == 2:
-            self.increase_fault_state_counter(faulty_phase)
-            # if within the last stored timestamps (size of MAX_ARCHIVES) are at least MAX_FAULTY_STATES
-            if LocalData.mFaultStateCounter_ph2 >= self.MAX_FAULTY_STATES:
-                self.set_power_infeed_limit(0)
-
-        elif faulty_phase == 3:
-            self.increase_fault_state_counter(faulty_phase)
-            # if within the last stored timestamps (size of MAX_ARCHIVES) are at least MAX_FAULTY_STATES
-            if LocalData.mFaultStateCounter_ph3 >= self.MAX_FAULTY_STATES:
-                self.set_power_infeed_limit(0)
+        counters, trip_slots = advance_fault_state_counters(self.get_fault_state_counters(len(self.meas_topology)),
+                                                            faulty, self.MAX_FAULTY_STATES)
+        self.set_fault_state_counters(counters)
+
+        evaluated_ns = time.time_ns()
+        if completed_ns is not None:
+            self.latency_stats.record_many('evaluation', evaluated_ns - completed_ns)
+
+        # if a faulty subgrid reached MAX_FAULTY_STATES, curtail the ctrl nodes of this subgrid
+        tripped = np.flatnonzero(trip_slots >= 0)
+        if len(tripped) > 0:
+            self.set_power_infeed_limit(0, self.get_ctrl_nodes_of_subgrids(tripped))
+
+            written_ns = time.time_ns()
+            self.latency_stats.record('actuation', written_ns - evaluated_ns)
+            if timestamps is not None:
+                first_trip_slot = trip_slots[tripped].min()
+                self.latency_stats.record('trip', written_ns - DateHelper.to_timestamp_ns(timestamps[first_trip_slot]))
+
+        self.send_fault_state_counter_to_server()
+
+        self.print_current_result("INVALID" if faulty[:, -1].any() else "VALID")
+
+    def get_ctrl_nodes_of_subgrids(self, subgrids):
+        ctrl_nodes = dict()
+        for subgrid in subgrids:
+            for ctrl in self.meas_topology.subgrid_ctrl_nodes[subgrid]:
+                ctrl_nodes[ctrl.opctag] = ctrl
+        return list(ctrl_nodes.values())
 
     def send_fault_state_counter_to_server(self):
+        """Send for each phase the highest fault state counter of all subgrids of this phase
+        """
+        counters = self.get_fault_state_counters(len(self.meas_topology))
+
         nodes = []
         values = []
         for misc in self.misc_nodes_list:
-            if "FEHLER_COUNTER" and "PH1" in misc.opctag:
-                nodes.append(misc)
-                values.append(LocalData.mFaultStateCounter_ph1)
-            elif "FEHLER_COUNTER" and "PH2" in misc.opctag:
-                nodes.append(misc)
-                values.append(LocalData.mFaultStateCounter_ph2)
-            elif "FEHLER_COUNTER" and "PH3" in misc.opctag:
-                nodes.append(misc)
-                values.append(LocalData.mFaultStateCounter_ph3)
+            if "FEHLER_COUNTER" in misc.opctag:
+                of_phase = self.meas_topology.subgrid_phases == misc.phase
+                if of_phase.any():
+                    nodes.append(misc)
+                    values.append(int(counters[of_phase].max()))
 
         self.opc_client.set_vars(nodes, values)
 
-    def set_power_infeed_limit(self, upper_limit):
+    def set_power_infeed_limit(self, upper_limit, ctrl_nodes_list=None):
+        """Set *upper_limit* for all LIMIT_CTRL nodes within *ctrl_nodes_list* (default: all ctrl nodes)
+        """
         # check the actual state of CTRLs
         # self.update_ctrl_states()
+        if ctrl_nodes_list is None:
+            ctrl_nodes_list = self.ctrl_nodes_list
 
         nodes = []
         values = []
         # update the state of CTRLs
-        for ctrl in self.ctrl_nodes_list:
+        for ctrl in ctrl_nodes_list:
             if "LIMIT_CTRL" in ctrl.opctag:
                 nodes.append(ctrl)
                 values.append(upper_limit)  # decrease power infeed to 0%
@@ -200,7 +289,8 @@ class DiffCore(Thread):
         # execute set_vars()
         self.opc_client.set_vars(nodes, values)
 
-        print(DateHelper.get_local_datetime(), self.__class__.__name__, "All CTRL devices are set to power feedin = 0.")
+        print(DateHelper.get_local_datetime(), self.__class__.__name__, "CTRL devices", [node.opctag for node in nodes],
+              "are set to power feedin =", upper_limit)
 
     def set_status_online_grid_protection(self, status_value):
         """Set a value for node RUN_ONLINE_GRID_PROTECTION
@@ -216,22 +306,26 @@ class DiffCore(Thread):
         print(DateHelper.get_local_datetime(), self.__class__.__name__, "updated status of Online Grid Protection.")
 
 
-    @staticmethod
-    def decrease_fault_state_counter(faulty_phase):
-        if faulty_phase == 1 and LocalData.mFaultStateCounter_ph1 > 0:
-            LocalData.mFaultStateCounter_ph1 -= 1
-        elif faulty_phase == 2 and LocalData.mFaultStateCounter_ph2 > 0:
-            LocalData.mFaultStateCounter_ph2 -= 1
-        elif faulty_phase == 3 and LocalData.mFaultStateCounter_ph3 > 0:
-            LocalData.mFaultStateCounter_ph3 -= 1
-
-    def increase_fault_state_counter(self, faulty_phase):
-        if faulty_phase == 1 and LocalData.mFaultStateCounter_ph1 < self.MAX_FAULTY_STATES:
-            LocalData.mFaultStateCounter_ph1 += 1
-        elif faulty_phase == 2 and LocalData.mFaultStateCounter_ph2 < self.MAX_FAULTY_STATES:
-            LocalData.mFaultStateCounter_ph2 += 1
-        elif faulty_phase == 3 and LocalData.mFaultStateCounter_ph3 < self.MAX_FAULTY_STATES:
-            LocalData.mFaultStateCounter_ph3 += 1
+    def get_fault_state_counters(self, number_of_subgrids):
+        """Return fault state counter of each subgrid; counters are reset if the number of subgrids changed
+        """
+        if len(self.fault_state_counters) != number_of_subgrids:
+            self.fault_state_counters = np.zeros(number_of_subgrids, dtype=int)
+        return self.fault_state_counters
+
+    def set_fault_state_counters(self, counters):
+        self.fault_state_counters = counters
+
+    def remap_fault_state_counters(self, old_meas_topology, new_meas_topology):
+        """Assign fault state counters of *old_meas_topology* to the subgrids of *new_meas_topology* with the same name;
+        counters of new subgrids start at zero
+        """
+        counters = np.zeros(len(new_meas_topology), dtype=int)
+        if old_meas_topology is not None and len(self.fault_state_counters) == len(old_meas_topology):
+            counter_of_subgrid = dict(zip(old_meas_topology.subgrid_names, self.fault_state_counters))
+            for i, name in enumerate(new_meas_topology.subgrid_names):
+                counters[i] = counter_of_subgrid.get(name, 0)
+        self.fault_state_counters = counters
 
     # def update_ctrl_states(self):
     #     ctrls = []
@@ -248,14 +342,11 @@ class DiffCore(Thread):
 
     def print_current_result(self, result_code):
         if self.DEBUG_MODE_PRINT:
-            if self.THREE_PHASE_CALCULATION:
-                print(result_code, ': '
-                      , str(format(self.df_ph1.iloc[-1]['sum'], '.2f')) + '(' + str(LocalData.mFaultStateCounter_ph1) + ')' + ', '
-                      , str(format(self.df_ph2.iloc[-1]['sum'], '.2f')) + '(' + str(LocalData.mFaultStateCounter_ph2) + ')' + ', '
-                      , str(format(self.df_ph3.iloc[-1]['sum'], '.2f')) + '(' + str(LocalData.mFaultStateCounter_ph3) + ')' + ";" + '\n')
-            else:
-                print(result_code, ': '
-                      , str(format(self.df_ph1.iloc[-1]['sum'], '.2f')) + '(' + str(LocalData.mFaultStateCounter_ph1) + ')' + ";" + '\n')
+            counters = self.get_fault_state_counters(len(self.meas_topology))
+            print(result_code, ': ', ', '.join(name + ' ' + format(balance, '.2f') + '(' + str(counter) + ')'
+                                                for name, balance, counter in zip(self.meas_topology.subgrid_names,
+                                                                                  self.balances[:, -1], counters))
+                  + ";" + '\n')
 
     def print_work_status(self, work_status):
         print(DateHelper.get_local_datetime(), self.__class__.__name__, work_status)
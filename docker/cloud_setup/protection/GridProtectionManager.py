@@ -16,9 +16,14 @@ import time
 from distutils.util import strtobool
 from cloud_setup.protection.DataSource import TopologyData
 from cloud_setup.protection.DataSource import CustomVar
+from cloud_setup.protection.DataSource import MeasTopology
+from cloud_setup.protection.DataSource import ROLE_OTHER_MEAS, ROLE_CTRL, ROLE_STATUS, phase_of_opctag
 from cloud_setup.protection.DiffCore import DiffCore
+from protection.CommandWorker import CommandWorker
 from protection.DataHandler import DataHandler
+from protection.LatencyStats import LatencyStats
 from protection.OPCClient_DataHandler import OPCClientDataHandler
+from opc_ua.client.subscription import SubscriptionSettings
 from helper.DateHelper import DateHelper
 
 __version__ = '0.7'
@@ -34,6 +39,18 @@ class GridProtectionManager(object):
         self.SERVER_ENDPOINT = os.environ.get("SERVER_ENDPOINT")
         self.DEBUG_MODE_PRINT = bool(strtobool(os.environ.get("DEBUG_MODE_PRINT", "False")))
         self.DEVICE_PATH = os.environ.get("DEVICE_PATH")
+        # three_phase_mode: True if calculation should be for all three phases, False if only single phase
+        self.THREE_PHASE_CALCULATION = bool(strtobool(os.environ.get("THREE_PHASE_CALCULATION", "False")))
+        # publish latency statistics as variables in dir_name at opc server
+        self.PUBLISH_LATENCY_STATS = bool(strtobool(os.environ.get("PUBLISH_LATENCY_STATS", "False")))
+
+        # subscription settings of each node group, cf. SubscriptionSettings.from_env
+        self.subscription_settings = {
+            'I_MEAS': SubscriptionSettings.from_env('I_MEAS', publishing_interval=1, sampling_interval=0, queue_size=10),
+            'OTHER_MEAS': SubscriptionSettings.from_env('OTHER_MEAS', publishing_interval=1000),
+            'CTRL': SubscriptionSettings.from_env('CTRL', publishing_interval=500),
+            'STATUS': SubscriptionSettings.from_env('STATUS', publishing_interval=500),
+        }
 
         self.client_username = client_username
         self.client_pw = client_pw
@@ -41,21 +58,21 @@ class GridProtectionManager(object):
         self.opc_client = None
 
         self.topo_path = os.path.dirname(os.getcwd()) + topology_path
+        # directory of compiled topology files (keyed by hash of file content); empty: no cache
+        topology_cache_dir = os.environ.get("TOPOLOGY_CACHE_DIR", "")
+        self.topo_cache_dir = os.path.dirname(os.getcwd()) + topology_cache_dir if topology_cache_dir else None
         self.topo_data = None
         self.server_dir_name = dir_name
 
-        self.slack_ph1 = None
-        self.slack_ph2 = None
-        self.slack_ph3 = None
-        self.Iph1_nodes_list = []   # CustomVars related to I-measurement in phase 1 (will used only for Diff-Sum); (PF: RES-Variable, read only)
-        self.Iph2_nodes_list = []
-        self.Iph3_nodes_list = []
+        self.meas_topology = None   # MeasTopology of CustomVars related to I-measurement (will used only for Diff-Sum); (PF: RES-Variable, read only)
         self.ctrl_nodes_list = []   # CustomVars related to actuators (will used only for feedback-control); (PF: CTRL-Variable, control only)
         self.other_meas_nodes_list = []     # CustomVars that are sensors and NOT related to I-measurement; (PF: RES-Variable which contain not to I-measurement)
         self.misc_nodes_list = []   # CustomVars related to status information of grid protection; (PF: PF intern simulation vars)
+        self.latency_stats_nodes = dict()   # opctag -> CustomVar of published latency statistics
 
         self.DataHandler = None
         self.mDiffCore = None
+        self.command_worker = CommandWorker()     # executes control actions requested by status flags
 
         self._terminated = False
 
@@ -70,6 +87,7 @@ class GridProtectionManager(object):
         self.opc_client.stop()
 
     def _finalize(self):
+        self.command_worker.stop()
         self._del_OPCUA()
 
     def terminate(self):
@@ -78,11 +96,16 @@ class GridProtectionManager(object):
     def start(self):
         """Start routine to setup GridProtectionManager
         """
+        self.command_worker.start()
         while not self._terminated:
             try:
                 # start opc client
                 self._init_OPCUA()
 
+                # stop DiffCore of previous run
+                if self.mDiffCore is not None:
+                    self.mDiffCore.stop()
+
                 # Init DataHandler
                 self.DataHandler = DataHandler(self.opc_client)
 
@@ -92,6 +115,8 @@ class GridProtectionManager(object):
 
                 # Registration of vars at server
                 self.register_devices(self.server_dir_name, os.path.dirname(os.getcwd()) + self.DEVICE_PATH)
+                if self.PUBLISH_LATENCY_STATS:
+                    self.register_latency_stats(self.server_dir_name)
 
                 # Set status nodes used for monitoring and topology/device updates
                 self.set_status_flags(self.topo_path, [], self.server_dir_name)
@@ -115,11 +140,15 @@ class GridProtectionManager(object):
                 while not self._terminated:
                     try:
                         browse_name = self.opc_client.client.get_server_node().get_browse_name()
+                        if self.PUBLISH_LATENCY_STATS:
+                            self.publish_latency_stats()
                         time.sleep(1)
                     except Exception as ex:
                         print(DateHelper.get_local_datetime(), self.__class__.__name__, 'lost connection to server:')
                         print(ex)
-                        break
+                        # restart everything only if session and subscriptions can't be restored
+                        if not self.reconnect():
+                            break
 
             except Exception as ex:
                 print(ex)
@@ -129,6 +158,22 @@ class GridProtectionManager(object):
                     time.sleep(1)
         self._finalize()
 
+    def reconnect(self):
+        """Restore session and subscriptions of opc client. DataHandler (including buffered data) and DiffCore
+        (including fault state counters) keep running.
+
+        :returns: True if reconnected, False if a full restart is necessary (e.g. server lost or recreated its nodes,
+            a monitored item could not be created)
+        """
+        try:
+            self.opc_client.reconnect()
+        except Exception as ex:
+            print(DateHelper.get_local_datetime(), self.__class__.__name__, 'fast reconnect failed:', ex)
+            return False
+
+        print(DateHelper.get_local_datetime(), self.__class__.__name__, ' reconnected to server')
+        return True
+
     def register_devices(self, dir_name, device_config_path):
         """Register device representation specified in *device_config_path* as node on *dir_name* at opc server
         """
@@ -139,66 +184,97 @@ class GridProtectionManager(object):
         print(DateHelper.get_local_datetime(), self.__class__.__name__,
               " successful register devices from file:" + device_config_path)
 
+    @staticmethod
+    def latency_stats_opctag(stage, key):
+        return "PROTECTION_LATENCY_" + stage.upper() + "_" + key.upper()
+
+    def register_latency_stats(self, dir_name):
+        """Register a Float variable for count, median, 99% quantile and maximum of each latency stage on *dir_name*
+        at opc server
+        """
+        opctags = [self.latency_stats_opctag(stage, key) for stage in LatencyStats.STAGES
+                   for key in ('count', 'p50_ms', 'p99_ms', 'max_ms')]
+        self.opc_client.register_opc_tags(dir_name, opctags, ["Float"] * len(opctags))
+
+        self.latency_stats_nodes = dict()
+        for var in self.get_customized_server_vars(dir_name):
+            if var.opctag in opctags:
+                self.latency_stats_nodes[var.opctag] = var
+        self.opc_client.set_published_nodes([self.opc_client.client.get_node(var.nodeid)
+                                             for var in self.latency_stats_nodes.values()])
+
+        print(DateHelper.get_local_datetime(), self.__class__.__name__, " successful register latency statistics")
+
+    def get_latency_stats(self):
+        """Return latency statistics of each stage from SourceTimestamp to write of LIMIT_CTRL (cf. LatencyStats)
+        """
+        return self.DataHandler.get_latency_stats()
+
+    def publish_latency_stats(self):
+        nodes = []
+        values = []
+        for stage, summary in self.get_latency_stats().items():
+            for key, value in summary.items():
+                var = self.latency_stats_nodes.get(self.latency_stats_opctag(stage, key))
+                if var is not None:
+                    nodes.append(var)
+                    values.append(float(value))
+        self.opc_client.set_vars(nodes, values)
+
     def set_meas_topology(self, path, list_of_nodes_to_reset, dir_name):
         """Match topology specified in *path* used for grid protection with all available nodes on *dir_name* at opc
         server
 
-        This results in defining slack nodes for subgrids as well as mapping each node to information about the
-        representing phase. After all node are sorted in local lists the opc client is requested to make a subscription
-        for each node of interest at the opc server.
+        This results in compiling a signed incidence matrix of subgrids (each POC of the topology for each evaluated
+        phase) x I-measurement nodes, where the slack of a subgrid counts negative. All other nodes are sorted in local
+        lists. Afterwards the opc client is requested to make a subscription for each node of interest at the opc
+        server.
+
+        The new topology is built aside while DiffCore keeps evaluating the current one. DataHandler switches to the
+        new topology at once as soon as the new nodes are subscribed; the nodes of the old topology are unsubscribed
+        only afterwards, thus its time slots keep completing until the switch.
         """
-        # get at server registered vars allocated as CustomVar
-        server_vars = self.get_customized_server_vars(dir_name)
-
-        # get new topology
-        self._clear_topo_meas()
-        self.topo_data = TopologyData(path)
-
-        # cluster topology nodes into lists (current, ctrl and misc) and assign the appropriate CustomVar
-        for topo_opctag, topo_browsename in self.topo_data.get_itempairs():
-            for var in server_vars:
-                if var.opctag == topo_opctag:
-                    if "_I_" in topo_opctag and "RES" in topo_opctag:
-
-                        # separate nodes into groups for each phase
-                        if "PH1" in topo_opctag:
-                            self.Iph1_nodes_list.append(var)
-                            if "slack" in topo_browsename.lower():  # find slack node for each phase and
-                                self.slack_ph1 = var                # assign the appropriate CustomVar
-                        elif "PH2" in topo_opctag:
-                            self.Iph2_nodes_list.append(var)
-                            if "slack" in topo_browsename.lower():
-                                self.slack_ph2 = var
-                        elif "PH3" in topo_opctag:
-                            self.Iph3_nodes_list.append(var)
-                            if "slack" in topo_browsename.lower():
-                                self.slack_ph3 = var
-                    elif "_I_" not in topo_opctag and "RES" in topo_opctag:
-                        self.other_meas_nodes_list.append(var)
-                    elif "CTRL" in topo_opctag:
-                        self.ctrl_nodes_list.append(var)
-                    break
+        # get new topology and match its nodes with the at server registered vars (allocated as CustomVar)
+        topo_data = self.load_topology(path)
+        server_vars = topo_data.resolve(self.opc_client.get_node_catalog(dir_name))
+
+        # compile incidence matrix of subgrids x I-measurement nodes
+        phases = [1, 2, 3] if self.THREE_PHASE_CALCULATION else [1]
+        meas_topology = MeasTopology.from_topology(topo_data, server_vars, phases)
+
+        # remaining topology nodes (other meas and ctrl) are already classified by topo_data
+        other_meas_nodes_list = [server_vars[entry.opctag] for entry in topo_data.get_entries(ROLE_OTHER_MEAS)
+                                 if entry.opctag in server_vars]
+        ctrl_nodes_list = [server_vars[entry.opctag] for entry in topo_data.get_entries(ROLE_CTRL)
+                           if entry.opctag in server_vars]
         print(DateHelper.get_local_datetime(), self.__class__.__name__,
-              " successful updated meas topology from file:" + path)
-
-        # update topology of DataHandler
-        self.DataHandler.set_topology(self.slack_ph1, self.slack_ph2, self.slack_ph3, self.Iph1_nodes_list,
-                                      self.Iph2_nodes_list, self.Iph3_nodes_list, self.ctrl_nodes_list,
-                                      self.misc_nodes_list)
+              " successful updated meas topology from file:" + path + " (" + str(len(meas_topology)) +
+              " subgrids, " + str(len(meas_topology.meas_nodes_list)) + " I-measurement nodes)")
+
+        # update OPC-client: the new nodes are subscribed first, the removed ones after the switch
+        try:
+            self._update_subscription_opc_client(self.DataHandler, meas_topology.meas_nodes_list, 'I_MEAS', True)
+            self._update_subscription_opc_client(self.DataHandler, other_meas_nodes_list, 'OTHER_MEAS', True)
+            self._update_subscription_opc_client(self.DataHandler, ctrl_nodes_list, 'CTRL', True)
+
+            # switch to new topology
+            self.topo_data = topo_data
+            self.meas_topology = meas_topology
+            self.other_meas_nodes_list = other_meas_nodes_list
+            self.ctrl_nodes_list = ctrl_nodes_list
+            self.DataHandler.set_topology(meas_topology, ctrl_nodes_list, self.misc_nodes_list)
+        finally:
+            self.opc_client.remove_deferred()
 
-        # update OPC-client: delete old subscription and start new subscription
-        self._update_subscription_opc_client(self.DataHandler, self.Iph1_nodes_list + self.Iph2_nodes_list +
-                                             self.Iph3_nodes_list + self.other_meas_nodes_list + self.ctrl_nodes_list,
-                                             False)
         # reset flags
         self.reset_flags(list_of_nodes_to_reset, dir_name)
 
     def update_topology(self, path, list_of_nodes_to_reset, dir_name):
-        """Update used grid topology by stopping DiffCore and calling set_meas_topology() and starting DiffCore again
+        """Update used grid topology by calling set_status_flags() and set_meas_topology(). DiffCore keeps running, it
+        evaluates the old topology until DataHandler switched to the new one.
         """
-        # stop DiffCore if running
-        if self.mDiffCore.is_running():
-            self.mDiffCore.pause()
+        # browse server again, new devices may have registered their nodes since last update
+        self.opc_client.get_node_catalog(dir_name, refresh=True)
 
         # Set status nodes used monitoring and topology/device updates
         self.set_status_flags(self.topo_path, [], self.server_dir_name)
@@ -206,104 +282,82 @@ class GridProtectionManager(object):
         # set new topology
         self.set_meas_topology(path, list_of_nodes_to_reset, dir_name)
 
-        # start DiffCore
-        if not self.mDiffCore.is_running():
-            self.mDiffCore.resume()
-
     def set_status_flags(self, path, list_of_nodes_to_reset, dir_name):
         """Get status_nodes from topology file specified by *path* and map they with nodes on *dir_name* at opc server.
         In a next step make subscription for status nodes.
         """
-        # get at server registered vars allocated as CustomVar
-        server_vars = self.get_customized_server_vars(dir_name)
+        # get new topology and match its nodes with the at server registered vars (allocated as CustomVar)
+        topo_data = self.load_topology(path)
+        server_vars = topo_data.resolve(self.opc_client.get_node_catalog(dir_name))
 
-        # get new topology
-        self._clear_topo_status_flags()
-        self.topo_data = TopologyData(path)
-
-        # cluster topology nodes into lists (here searching only for misc) and assign the appropriate CustomVar
-        for topo_opctag, topo_browsename in self.topo_data.get_itempairs():
-            for var in server_vars:
-                if var.opctag == topo_opctag:
-                    if "RES" not in topo_opctag and "CTRL" not in topo_opctag:
-                        self.misc_nodes_list.append(var)
-                    break
+        # status nodes (here searching only for misc) are already classified by topo_data
+        misc_nodes_list = [server_vars[entry.opctag] for entry in topo_data.get_entries(ROLE_STATUS)
+                           if entry.opctag in server_vars]
+        self.topo_data = topo_data
+        self.misc_nodes_list = misc_nodes_list
 
         print(DateHelper.get_local_datetime(), self.__class__.__name__,
               " successful updated status flags from file:" + path)
 
         # update OPC-client: delete old subscription and start new subscription
-        self._update_subscription_opc_client(self, self.misc_nodes_list, True, 500)
+        self._update_subscription_opc_client(self, self.misc_nodes_list, 'STATUS')
 
         self.reset_flags(list_of_nodes_to_reset, dir_name)
 
     def reset_flags(self, list_of_flags_to_reset, dir_name):
         """Reset the value of each node in the provided *list_of_flags_to_reset* on *dir_name* at opc sever to 0.
         """
+        catalog = self.opc_client.get_node_catalog(dir_name)
         nodes = []
         values = []
-        for var in self.opc_client.get_server_vars(dir_name):
-            for node in list_of_flags_to_reset:
-                if var.nodeid == node.nodeid:
-                    nodes.append(var)
-                    values.append(0)
-                    break
+        for node in list_of_flags_to_reset:
+            if node.nodeid in catalog:
+                nodes.append(node)
+                values.append(0)
 
         self.opc_client.set_vars(nodes, values)
 
     def get_customized_server_vars(self, dir_name):
         """Get server nodes and convert them into CustomVar to store opctag, nodeid and phase information together.
         """
-        all_observed_nodes = self.opc_client.get_server_vars(dir_name)
-        mvars = []
-        for var in all_observed_nodes:
-            opctag = var.get_browse_name().Name
-            if 'PH1' in opctag:
-                mvars.append(CustomVar(opctag, var.nodeid, 1))
-            elif 'PH2' in opctag:
-                mvars.append(CustomVar(opctag, var.nodeid, 2))
-            elif 'PH3' in opctag:
-                mvars.append(CustomVar(opctag, var.nodeid, 3))
-            else:
-                mvars.append(CustomVar(opctag, var.nodeid))
-        return mvars
-
-    def _update_subscription_opc_client(self, notification_target_class, list_of_nodes, are_status_nodes=False, sub_interval=1):
-        self.opc_client.make_subscription(notification_target_class, self.server_dir_name, list_of_nodes, are_status_nodes, sub_interval)
-
-    def _clear_topo_meas(self):
-        self.slack_ph1 = None
-        self.slack_ph2 = None
-        self.slack_ph3 = None
-        self.Iph1_nodes_list = []
-        self.Iph2_nodes_list = []
-        self.Iph3_nodes_list = []
-        self.ctrl_nodes_list = []
-        self.other_meas_nodes_list = []
-
-    def _clear_topo_status_flags(self):
-        self.misc_nodes_list = []
+        catalog = self.opc_client.get_node_catalog(dir_name)
+        return [CustomVar(opctag, var.nodeid, phase_of_opctag(opctag)) for opctag, var in catalog.items()]
+
+    def load_topology(self, path):
+        """Return TopologyData of file *path*, the compiled topology is cached in TOPOLOGY_CACHE_DIR
+        """
+        return TopologyData(path, cache_dir=self.topo_cache_dir)
+
+    def _update_subscription_opc_client(self, notification_target_class, list_of_nodes, group, defer_removal=False):
+        self.opc_client.make_subscription(notification_target_class, self.server_dir_name, list_of_nodes, group,
+                                          self.subscription_settings[group], defer_removal)
 
     def update_data(self, node, datetime_source, val):
         """Function called from outside (by subscription class) when the state of an so-called update_node has changed.
+        Control actions are only queued, they are executed by command_worker to not block the subscription thread.
         """
         # check for Update Request topology
         for var in self.misc_nodes_list:
             if var.nodeid == node.nodeid and "UPDATE_REQUEST_TOPOLOGY" in var.opctag:
                 if val == 1:
-                    self.update_topology(self.topo_path, [var], self.server_dir_name)
-                    return
+                    self.command_worker.submit("update_topology", self.update_topology, self.topo_path, [var],
+                                               self.server_dir_name, coalesce=True)
+                return
             elif var.nodeid == node.nodeid and "RUN_ONLINE_GRID_PROTECTION" in var.opctag:
-                if val == 1:
-                    # run DiffCore if is not running
-                    if not self.mDiffCore.is_running():
-                        self.mDiffCore.resume()
-                    return
-                else:
-                    # stop DiffCore if is running
-                    if self.mDiffCore.is_running():
-                        self.mDiffCore.pause()
-                    return
+                self.command_worker.submit("run_online_grid_protection", self.run_online_grid_protection, val == 1)
+                return
+
+    def run_online_grid_protection(self, run):
+        """Resume DiffCore if *run*, otherwise pause DiffCore
+        """
+        if run:
+            # run DiffCore if is not running
+            if not self.mDiffCore.is_running():
+                self.mDiffCore.resume()
+        else:
+            # stop DiffCore if is running
+            if self.mDiffCore.is_running():
+                self.mDiffCore.pause()
 
     def set_start_value_for_ctrl_node(self, start_value, key_phrase):
         """Set a *start_value* for a node specified as controllable by *key_phrase*
@@ -0,0 +1,121 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+"""This is the latency statistics module.
+
+This module records the latency of each processing stage of the grid protection in histograms:
+    ingest:             SourceTimestamp of a sample -> sample arrived at DataHandler.update_data
+    slot_completion:    (rounded) timestamp of a time slot -> last node of this slot arrived
+    evaluation:         time slot completed -> evaluation of DiffCore finished
+    actuation:          evaluation finished -> LIMIT_CTRL written by set_vars
+    trip:               (rounded) timestamp of the time slot which caused a trip -> LIMIT_CTRL written by set_vars
+
+Each histogram is written by a single thread only (ingest and slot_completion by the subscription thread, all others by
+DiffCore), hence recording needs no lock. The writer increments a sequence counter before and after each update, a
+reader copies bucket counts, sum and maximum and retries until the counter was even and unchanged meanwhile (seqlock),
+thus count, mean and quantiles of a summary always belong to the same records.
+"""
+import bisect
+import time
+
+import numpy as np
+
+__version__ = '0.7'
+__author__ = 'Sebastian Krahmer'
+
+
+class LatencyHistogram(object):
+    def __init__(self, max_latency_us=10 ** 8, buckets_per_decade=20):
+        """
+        :param max_latency_us (int): upper edge of the highest regular bucket in µs; larger latencies are counted by an
+            overflow bucket
+        :param buckets_per_decade (int): number of logarithmic buckets between 10^n and 10^(n+1) µs
+        """
+        number_of_edges = int(np.log10(max_latency_us) * buckets_per_decade) + 1
+        self._edges_us = list(np.logspace(0, np.log10(max_latency_us), number_of_edges))
+        self._counts = np.zeros(len(self._edges_us) + 1, dtype=np.int64)
+        self._sum_us = 0.0
+        self._max_us = 0.0
+        self._sequence = 0  # odd while the writer updates counts, sum and maximum
+
+    def record(self, latency_ns):
+        self._sequence += 1
+        self._record(latency_ns)
+        self._sequence += 1
+
+    def record_many(self, latencies_ns):
+        self._sequence += 1
+        for latency_ns in latencies_ns:
+            self._record(latency_ns)
+        self._sequence += 1
+
+    def _record(self, latency_ns):
+        latency_us = max(latency_ns / 1000, 0)
+        self._counts[bisect.bisect_left(self._edges_us, latency_us)] += 1
+        self._sum_us += latency_us
+        if latency_us > self._max_us:
+            self._max_us = latency_us
+
+    def reset(self):
+        self._sequence += 1
+        self._counts.fill(0)
+        self._sum_us = 0.0
+        self._max_us = 0.0
+        self._sequence += 1
+
+    def summary(self):
+        """Return number of records, mean, quantiles and maximum of latency (in ms)
+        """
+        counts, sum_us, max_us = self._snapshot()
+        number = int(counts.sum())
+        return {
+            'count': number,
+            'mean_ms': sum_us / number / 1000 if number > 0 else 0.0,
+            'p50_ms': self._quantile_us(counts, max_us, 0.5) / 1000,
+            'p99_ms': self._quantile_us(counts, max_us, 0.99) / 1000,
+            'max_ms': max_us / 1000,
+        }
+
+    def _snapshot(self):
+        """Return copy of bucket counts, sum and maximum of the same records
+        """
+        while True:
+            sequence = self._sequence
+            if sequence % 2 == 0:
+                counts, sum_us, max_us = self._counts.copy(), self._sum_us, self._max_us
+                if self._sequence == sequence:
+                    return counts, sum_us, max_us
+            time.sleep(0)   # let the writer finish its update
+
+    def _quantile_us(self, counts, max_us, q):
+        """Upper bucket edge of quantile *q* (the overflow bucket returns the maximum)
+        """
+        number = counts.sum()
+        if number == 0:
+            return 0.0
+        bucket = int(np.searchsorted(np.cumsum(counts), q * number))
+        if bucket >= len(self._edges_us):
+            return max_us
+        return min(self._edges_us[bucket], max_us)
+
+
+class LatencyStats(object):
+    STAGES = ('ingest', 'slot_completion', 'evaluation', 'actuation', 'trip')
+
+    def __init__(self):
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+
+    def record(self, stage, latency_ns):
+        self.histograms[stage].record(latency_ns)
+
+    def record_many(self, stage, latencies_ns):
+        self.histograms[stage].record_many(latencies_ns)
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def get_stats(self):
+        """Return summary of each stage, e.g. {'ingest': {'count': 10, 'mean_ms': 1.2, ...}, ...}
+        """
+        return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
@@ -1,13 +0,0 @@
-#  Copyright (c) 2019.
-#  Author: Sebastian Krahmer
-
-"""This is a settings file.
-
-This module stores some global used variables.
-"""
-
-
-mFaultStateCounter_ph1 = 0
-mFaultStateCounter_ph2 = 0
-mFaultStateCounter_ph3 = 0
-mFaultStateCounter_phn = 0
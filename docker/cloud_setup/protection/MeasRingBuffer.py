@@ -0,0 +1,323 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+"""This is the measurement ring buffer.
+
+This module provides a preallocated buffer of time slots x measurement nodes backed by a NumPy array.
+Each time slot holds the values of all nodes for one (rounded) timestamp. A new timestamp occupies the next free slot;
+if all slots are occupied, only the oldest slot is evicted. Hence the cost to store a sample is independent of the
+number of buffered timestamps and nodes. An evicted slot which is complete but was not handed over yet is moved to a
+pending list, thus a burst of more timestamps than slots loses no complete slot (up to the pending capacity).
+A fill counter per slot tracks how many nodes already reported, so a slot is marked complete as soon as its last node
+reports and checking for complete slots needs neither a scan nor a copy of the values.
+Complete slots are handed over as read-only MeasSnapshot. Snapshots alternate between two preallocated arrays (double
+buffering), thus taking a snapshot only gathers the new complete slots and ingestion can go on while a snapshot is
+evaluated.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+__version__ = '0.7'
+__author__ = 'Sebastian Krahmer'
+
+
+class MeasSnapshot(object):
+    def __init__(self, columns, timestamps, values, version, completed_ns=None):
+        """
+        :param columns ([str]): opctags of the measurement nodes
+        :param timestamps ([datetime]): timestamp of each slot
+        :param values (ndarray): read-only array of time slots x nodes
+        :param version (int): consecutive number of snapshot
+        :param completed_ns (ndarray): time (ns since epoch) each slot was completed
+        """
+        self.columns = columns
+        self.timestamps = timestamps
+        self.values = values
+        self.version = version
+        self.completed_ns = completed_ns
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def to_dataframe(self):
+        return pd.DataFrame(self.values, index=self.timestamps, columns=self.columns, copy=False)
+
+
+class MeasRingBuffer(object):
+    def __init__(self, columns, capacity=100, pending_capacity=None):
+        """
+        :param columns ([str]): opctags of the measurement nodes, each node is stored within its own column
+        :param capacity (int): number of time slots, which are kept before the oldest slot is evicted
+        :param pending_capacity (int): number of evicted complete slots, which are kept until the next snapshot
+            (default: 10 * capacity); beyond that the oldest pending slot is dropped
+        """
+        self.columns = list(columns)
+        self.capacity = capacity
+
+        self._column_index = {column: i for i, column in enumerate(self.columns)}
+        self._values = np.full((capacity, len(self.columns)), np.nan)
+        self._timestamps = [None] * capacity
+        self._slot_of_timestamp = dict()
+        self._fill = np.zeros(capacity, dtype=int)          # number of nodes which reported within each slot
+        self._complete = np.zeros(capacity, dtype=bool)     # True if each node reported within slot
+        self._completed_ns = np.zeros(capacity, dtype=np.int64)     # time the slot was completed (ns since epoch)
+        self._n_complete = 0
+        self._oldest = 0    # ring position of the oldest occupied slot
+        self._size = 0      # number of occupied slots
+
+        # complete slots evicted before they were handed over by a snapshot (oldest first)
+        self.pending_capacity = 10 * capacity if pending_capacity is None else pending_capacity
+        self._pending_timestamps = []
+        self._pending_values = []
+        self._pending_completed_ns = []
+        self.dropped_slots = 0      # number of complete slots dropped because pending list was full
+
+        # double buffer for snapshots: a snapshot stays valid until the second next snapshot is taken
+        self._snapshot_values = [np.empty((capacity, len(self.columns))), np.empty((capacity, len(self.columns)))]
+        self._version = 0
+
+    def __len__(self):
+        return self._size
+
+    @classmethod
+    def from_buffer(cls, buffer, columns, capacity=None):
+        """Return new buffer with *columns*, which takes over the occupied slots of *buffer*. Values of columns known by
+        both buffers are kept, thus slots which are partially filled keep their entries when the topology changes.
+
+        :param buffer (MeasRingBuffer): previous buffer
+        :param columns ([str]): opctags of the measurement nodes of new buffer
+        :param capacity (int): number of time slots of new buffer (default: capacity of *buffer*)
+        """
+        new_buffer = cls(columns, buffer.capacity if capacity is None else capacity, buffer.pending_capacity)
+        if len(new_buffer.columns) == 0:
+            return new_buffer
+
+        common = [column for column in new_buffer.columns if column in buffer._column_index]
+        new_columns = np.array([new_buffer._column_index[column] for column in common], dtype=int)
+        old_columns = np.array([buffer._column_index[column] for column in common], dtype=int)
+
+        # pending slots are kept if they are still complete with the new columns
+        for timestamp, row, completed_ns in zip(buffer._pending_timestamps, buffer._pending_values,
+                                                buffer._pending_completed_ns):
+            new_row = np.full(len(new_buffer.columns), np.nan)
+            new_row[new_columns] = row[old_columns]
+            if not np.isnan(new_row).any():
+                new_buffer._add_pending(timestamp, new_row, completed_ns)
+
+        now_ns = time.time_ns()
+        for old_slot in buffer.occupied_slots()[-new_buffer.capacity:]:
+            slot = new_buffer._allocate_slot(buffer._timestamps[old_slot])
+            new_buffer._values[slot, new_columns] = buffer._values[old_slot, old_columns]
+            new_buffer._fill[slot] = np.count_nonzero(~np.isnan(new_buffer._values[slot]))
+            if new_buffer._fill[slot] == len(new_buffer.columns):
+                new_buffer._complete[slot] = True
+                new_buffer._completed_ns[slot] = buffer._completed_ns[old_slot] if buffer._complete[old_slot] \
+                    else now_ns
+                new_buffer._n_complete += 1
+        return new_buffer
+
+    def column_index(self, column):
+        return self._column_index[column]
+
+    def insert(self, timestamp, column, val):
+        """Store *val* of node in *column* (index) for *timestamp*. A slot is allocated for unknown timestamps.
+
+        :returns: True if this value completed the slot, otherwise False
+        """
+        val = float('nan') if val is None else float(val)     # e.g. a node without value reports None
+        if np.isnan(val):   # NaN marks a missing value, hence it does not count as entry
+            return False
+
+        slot = self._slot_of_timestamp.get(timestamp)
+        if slot is None:
+            slot = self._allocate_slot(timestamp)
+
+        is_new_entry = np.isnan(self._values[slot, column])
+        self._values[slot, column] = val
+        if is_new_entry:
+            self._fill[slot] += 1
+            if self._fill[slot] == len(self.columns):
+                self._complete[slot] = True
+                self._completed_ns[slot] = time.time_ns()
+                self._n_complete += 1
+                return True
+        return False
+
+    def insert_many(self, timestamps, columns, values):
+        """Store all *values* of nodes in *columns* (indices) for *timestamps* at once. Slots are allocated for unknown
+        timestamps, the result equals storing each value by insert.
+
+        :returns: timestamps of slots completed by these values
+        """
+        values = np.asarray(values, dtype=float)
+        columns = np.asarray(columns, dtype=int)
+        is_value = ~np.isnan(values)    # NaN marks a missing value, hence it does not count as entry
+
+        # the values are stored in segments, which need no more new slots than are free: no slot is evicted while a
+        # segment is stored, thus a slot completed by one value of a segment is not evicted by a later one of it
+        completed = []
+        start = 0
+        while start < len(values):
+            free = self.capacity - self._size
+            new_timestamps = set()
+            end = start
+            while end < len(values):
+                timestamp = timestamps[end]
+                if is_value[end] and timestamp not in self._slot_of_timestamp and timestamp not in new_timestamps:
+                    if len(new_timestamps) == free:
+                        break
+                    new_timestamps.add(timestamp)
+                end += 1
+            if end == start:
+                self._evict_oldest()    # like insert, the next new timestamp evicts the oldest slot
+                continue
+            completed.extend(self._insert_segment(timestamps[start:end], columns[start:end], values[start:end],
+                                                  is_value[start:end]))
+            start = end
+        return completed
+
+    def _insert_segment(self, timestamps, columns, values, is_value):
+        """Store values like insert_many, but all new timestamps fit into free slots
+        """
+        # allocate unknown timestamps in order of arrival
+        for timestamp, has_value in zip(timestamps, is_value):
+            if has_value and timestamp not in self._slot_of_timestamp:
+                self._allocate_slot(timestamp)
+
+        slots = np.array([self._slot_of_timestamp.get(timestamp, -1) for timestamp in timestamps], dtype=int)
+        valid = (slots >= 0) & is_value
+        slots, columns, values = slots[valid], columns[valid], values[valid]
+        if len(values) == 0:
+            return []
+
+        # keep only the last value of each slot and column
+        keys = slots * len(self.columns) + columns
+        _, last = np.unique(keys[::-1], return_index=True)
+        last = len(keys) - 1 - last
+        slots, columns, values = slots[last], columns[last], values[last]
+
+        is_new_entry = np.isnan(self._values[slots, columns])
+        self._values[slots, columns] = values
+        np.add.at(self._fill, slots[is_new_entry], 1)
+
+        touched = np.unique(slots[is_new_entry])
+        completed = touched[(self._fill[touched] == len(self.columns)) & ~self._complete[touched]]
+        self._complete[completed] = True
+        self._completed_ns[completed] = time.time_ns()
+        self._n_complete += len(completed)
+        return [self._timestamps[slot] for slot in completed]
+
+    def has_complete_slot(self):
+        return self._n_complete > 0 or len(self._pending_timestamps) > 0
+
+    def occupied_slots(self):
+        """Return ring positions of all occupied slots ordered from oldest to newest.
+        """
+        return (self._oldest + np.arange(self._size)) % self.capacity
+
+    def complete_slots(self):
+        """Return ring positions of all slots, which contain a value for each node (ordered from oldest to newest).
+        """
+        slots = self.occupied_slots()
+        return slots[self._complete[slots]]
+
+    def evict_until(self, slot):
+        """Evict all slots from the oldest one up to and including *slot*.
+        """
+        while self._size > 0:
+            evicted = self._oldest
+            self._evict_oldest(keep_complete=False)
+            if evicted == slot:
+                break
+
+    def pop_complete_snapshot(self):
+        """Return all pending and complete slots as read-only MeasSnapshot and evict them (and all older slots) from
+        buffer.
+
+        Only the complete slots are gathered into the inactive snapshot array, the history is neither copied nor
+        allocated again. A snapshot with more slots than capacity (after a burst) gets an array of its own.
+        """
+        slots = self.complete_slots()
+        n_pending = len(self._pending_timestamps)
+        self._version += 1
+
+        if n_pending + len(slots) <= self.capacity:
+            values = self._snapshot_values[self._version % 2][:n_pending + len(slots)]
+        else:
+            values = np.empty((n_pending + len(slots), len(self.columns)))
+        if n_pending > 0:
+            values[:n_pending] = self._pending_values
+        np.take(self._values, slots, axis=0, out=values[n_pending:])
+        values.flags.writeable = False
+        snapshot = MeasSnapshot(self.columns, self._pending_timestamps + [self._timestamps[slot] for slot in slots],
+                                values, self._version,
+                                np.concatenate([np.array(self._pending_completed_ns, dtype=np.int64),
+                                                self._completed_ns[slots]]))
+
+        self._clear_pending()
+        if len(slots) > 0:
+            self.evict_until(slots[-1])
+        return snapshot
+
+    def to_dataframe(self, slots):
+        """Return the given *slots* as dataframe with timestamps as index and opctags as columns.
+        """
+        return pd.DataFrame(self._values[slots], index=[self._timestamps[slot] for slot in slots],
+                            columns=self.columns)
+
+    def clear(self):
+        self._values.fill(np.nan)
+        self._timestamps = [None] * self.capacity
+        self._slot_of_timestamp = dict()
+        self._fill.fill(0)
+        self._complete.fill(False)
+        self._n_complete = 0
+        self._oldest = 0
+        self._size = 0
+        self._clear_pending()
+
+    def _allocate_slot(self, timestamp):
+        if self._size == self.capacity:
+            self._evict_oldest()
+
+        slot = (self._oldest + self._size) % self.capacity
+        self._values[slot].fill(np.nan)
+        self._fill[slot] = 0
+        self._timestamps[slot] = timestamp
+        self._slot_of_timestamp[timestamp] = slot
+        self._size += 1
+        return slot
+
+    def _evict_oldest(self, keep_complete=True):
+        """Evict the oldest slot; if *keep_complete*, a complete slot is moved to the pending list
+        """
+        if self._complete[self._oldest]:
+            if keep_complete:
+                self._add_pending(self._timestamps[self._oldest], self._values[self._oldest].copy(),
+                                  self._completed_ns[self._oldest])
+            self._complete[self._oldest] = False
+            self._n_complete -= 1
+        del self._slot_of_timestamp[self._timestamps[self._oldest]]
+        self._timestamps[self._oldest] = None
+        self._oldest = (self._oldest + 1) % self.capacity
+        self._size -= 1
+
+    def _add_pending(self, timestamp, row, completed_ns):
+        if self.pending_capacity <= 0:
+            self.dropped_slots += 1
+            return
+        if len(self._pending_timestamps) >= self.pending_capacity:
+            del self._pending_timestamps[0]
+            del self._pending_values[0]
+            del self._pending_completed_ns[0]
+            self.dropped_slots += 1
+        self._pending_timestamps.append(timestamp)
+        self._pending_values.append(row)
+        self._pending_completed_ns.append(completed_ns)
+
+    def _clear_pending(self):
+        self._pending_timestamps = []
+        self._pending_values = []
+        self._pending_completed_ns = []
@@ -68,13 +68,16 @@ class OPCClientDataHandler(CustomClient):
                          self.CERTIFICATE_PATH_CLIENT_PRIVATE_KEY, auth_name, auth_password, self.DEBUG_MODE_PRINT)
 
         # custom
-        self.subscribed_status_nodes = []
-        self.subscription_status_nodes = None
-        self.subscription_handle_status_nodes = None
+        # subscription of each node group (e.g. 'I_MEAS', 'STATUS') as tuple (subscription, handle, subscribed nodes)
+        self.subscriptions = dict()
 
-        self.subscribed_meas_nodes = []
-        self.subscription_meas_nodes = None
-        self.subscription_handle_meas_nodes = None
+        self.published_nodes = []   # nodes which are written but not subscribed, e.g. latency statistics
+
+        # arguments of last make_subscription of each node group, used to subscribe again after reconnect
+        self.subscription_requests = dict()
+
+        # deletions of monitored items and subscriptions, which were deferred by make_subscription
+        self.deferred_removals = []
 
         print(DateHelper.get_local_datetime(), self.__class__.__name__, " successful init")
 
@@ -88,30 +91,81 @@ class OPCClientDataHandler(CustomClient):
 
         print(DateHelper.get_local_datetime(), self.__class__.__name__, " successful disconnected")
 
+    def reconnect(self):
+        """Open a new session and subscribe again all nodes of the last subscriptions with the same target objects
+
+        Raises UaError if a folder or a subscribed node is missing at the server or is not the same variable anymore
+        (e.g. the server was restarted and recreated its nodes), thus the caller has to set up everything again.
+        """
+        super().reconnect()
+
+        # subscriptions of the old session are lost
+        old_subscriptions = self.subscriptions
+        self.subscriptions = dict()
+        self.deferred_removals = []
+
+        for group, request in list(self.subscription_requests.items()):
+            target_object, dir_name, list_of_nodes_to_subscribe, settings = request
+            catalog = self.get_node_catalog(dir_name)
+            if catalog is None:
+                raise ua.UaError("folder " + dir_name + " of " + group + " is missing at server")
+            subscribed_nodeids = {node.nodeid for node in old_subscriptions.get(group, (None, None, []))[2]}
+            for var in list_of_nodes_to_subscribe:
+                if var.nodeid in subscribed_nodeids and catalog.get_browse_name(var.nodeid) != var.opctag:
+                    raise ua.UaError("node " + var.opctag + " (" + var.nodeid.to_string() + ") of " + group +
+                                     " is missing at server")
+            self.make_subscription(target_object, dir_name, list_of_nodes_to_subscribe, group, settings)
+
+        print(DateHelper.get_local_datetime(), self.__class__.__name__, " successful reconnected")
+
     # region subscription
-    def make_subscription(self, target_object, dir_name, list_of_nodes_to_subscribe, are_status_nodes=False,
-                          sub_interval=1):
+    def make_subscription(self, target_object, dir_name, list_of_nodes_to_subscribe, group, settings,
+                          defer_removal=False):
         """
-        Make a subscription for list of nodes and set some properties.
+        Make a subscription for list of nodes of one node group. A previous subscription of this group with the same
+        target object and settings is updated by the changed nodes only, otherwise it is replaced.
         :param target_object: object the datachange_notification of subscription is sent to
         :param dir_name: subfolder, which contains the requested nodes
         :param list_of_nodes_to_subscribe: list of nodes/customVars
-        :param are_status_nodes: flag if requested subscription is only for status flags
-        :param sub_interval: time interval the subscribed node is checked (in ms)
+        :param group: name of node group, e.g. 'I_MEAS', 'OTHER_MEAS', 'CTRL' or 'STATUS'
+        :param settings: SubscriptionSettings (publishing interval, queue size, deadband, ...) of this group
+        :param defer_removal: if True, monitored items of nodes which are not requested anymore (or the replaced
+            subscription) are kept until remove_deferred() is called, e.g. after the receiver switched to the new nodes
         """
         sub_handler = SubHandler(target_object)
+        # an existing subscription of this group is only updated by the changed nodes, if target and settings are kept
+        previous_request = self.subscription_requests.get(group)
+        update_existing = previous_request is not None and previous_request[0] is target_object \
+            and previous_request[1] == dir_name and previous_request[3] is settings
+        self.subscription_requests[group] = (target_object, dir_name, list_of_nodes_to_subscribe, settings)
+
+        subscription, subscription_handle, subscribed_nodes = self.subscriptions.get(group, (None, None, []))
+        self.subscriptions[group] = self._subscribe(dir_name, sub_handler, subscription, subscription_handle,
+                                                    list_of_nodes_to_subscribe, subscribed_nodes,
+                                                    settings.publishing_interval, settings, update_existing,
+                                                    self.deferred_removals if defer_removal else None)
+
+        print(DateHelper.get_local_datetime(), self.__class__.__name__, " successful updates subscription of " + group)
+
+    def remove_deferred(self):
+        """Delete all monitored items and subscriptions, whose removal was deferred by make_subscription
+        """
+        deferred_removals, self.deferred_removals = self.deferred_removals, []
+        for removal in deferred_removals:
+            removal()
 
-        if are_status_nodes is True:
-            self.subscription_status_nodes, self.subscription_handle_status_nodes, self.subscribed_status_nodes = \
-                self._subscribe(dir_name, sub_handler, self.subscription_status_nodes, self.subscription_handle_status_nodes,
-                                list_of_nodes_to_subscribe, self.subscribed_status_nodes, sub_interval)
-        else:
-            self.subscription_meas_nodes, self.subscription_handle_meas_nodes, self.subscribed_meas_nodes = \
-                self._subscribe(dir_name, sub_handler, self.subscription_meas_nodes, self.subscription_handle_meas_nodes,
-                                list_of_nodes_to_subscribe, self.subscribed_meas_nodes, sub_interval)
-
-        print(DateHelper.get_local_datetime(), self.__class__.__name__, " successful updates subscription")
+    def get_subscribed_nodes(self):
+        """Return subscribed nodes of all groups
+        """
+        nodes = []
+        for subscription, subscription_handle, subscribed_nodes in self.subscriptions.values():
+            nodes.extend(subscribed_nodes)
+        return nodes
     # endregion
 
+    def set_published_nodes(self, published_nodes):
+        self.published_nodes = published_nodes
+        self.cache_variant_types(published_nodes)
+
     def set_vars(self, ctrl_list, value_list):
-        super().set_vars(self.subscribed_meas_nodes + self.subscribed_status_nodes, ctrl_list, value_list)
+        super().set_vars(self.get_subscribed_nodes() + self.published_nodes, ctrl_list, value_list)
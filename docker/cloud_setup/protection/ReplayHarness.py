@@ -0,0 +1,203 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+"""This is the offline replay harness of the grid protection.
+
+This module feeds recorded samples into DataHandler and drives the evaluation of DiffCore synchronously, as fast as
+possible and without OPC-server. Thus threshold settings can be validated on long recordings and the throughput of
+DataHandler and DiffCore can be measured without network.
+
+Input files (CSV with header):
+    records:    nodeid, source_timestamp, value of each sample in order of arrival; nodeid in string notation of
+                OPC-UA (e.g. "ns=2;i=17"), source_timestamp as ISO 8601 string (UTC) or integer ns since epoch
+    catalog:    nodeid, browse_name of each variable of the folder at OPC-server the records were taken from
+
+All set_vars calls of DiffCore are captured by ReplayClient instead of being written to an OPC-server.
+"""
+import os
+import time
+from distutils.util import strtobool
+
+import pandas as pd
+from opcua import Node, ua
+
+from helper.DateHelper import DateHelper
+from opc_ua.client.NodeCatalog import NodeCatalog
+from protection.DataHandler import DataHandler
+from protection.DataSource import TopologyData, MeasTopology
+from protection.DataSource import ROLE_CTRL, ROLE_STATUS, role_of_opctag
+from protection.DiffCore import DiffCore
+
+__version__ = '0.7'
+__author__ = 'Sebastian Krahmer'
+
+
+class ReplayClient(object):
+    def __init__(self):
+        """Stand-in for OPCClient_DataHandler, which captures the set_vars calls of DiffCore
+        """
+        self.replay_time = None     # timestamp of the newest evaluated time slot, assigned by ReplayHarness
+        self.calls = 0              # number of set_vars calls with at least one node
+        self.values = dict()        # opctag -> last value set
+        self.actuations = []        # (replay time, opctags, values) of each set_vars call with ctrl nodes
+
+    def set_vars(self, nodes, values):
+        if len(nodes) == 0:
+            return
+        self.calls += 1
+        opctags = [node.opctag for node in nodes]
+        self.values.update(zip(opctags, values))
+        if any(role_of_opctag(opctag) == ROLE_CTRL for opctag in opctags):
+            self.actuations.append((self.replay_time, opctags, list(values)))
+
+
+class ReplayHarness(object):
+    CHUNK_SIZE = 100000     # number of records read from file at once
+
+    def __init__(self, topology_path, catalog_path, folder_name="replay", batch_size=0):
+        """
+        :param topology_path (str): path of TopologyFile.json
+        :param catalog_path (str): path of catalog file (cf. module docstring)
+        :param folder_name (str): name of folder at OPC-server, used for logging only
+        :param batch_size (int): number of records passed to DataHandler at once, like notifications of one publish
+            response (default of REPLAY_BATCH_SIZE, 0: number of I-measurement nodes)
+        """
+        self.DEBUG_MODE_PRINT = bool(strtobool(os.environ.get("DEBUG_MODE_PRINT", "False")))
+        self.THREE_PHASE_CALCULATION = bool(strtobool(os.environ.get("THREE_PHASE_CALCULATION", "False")))
+        self.BATCH_SIZE = int(os.environ.get("REPLAY_BATCH_SIZE", batch_size))
+
+        self.opc_client = ReplayClient()
+        self.DataHandler = DataHandler(self.opc_client)
+        self.mDiffCore = DiffCore(self.opc_client, self.DataHandler)
+
+        self.catalog = self.load_catalog(catalog_path, folder_name)
+        self.node_of_nodeid = {node.nodeid.to_string(): node for node in self.catalog.nodes}
+
+        # same classification of topology nodes as GridProtectionManager.set_meas_topology and set_status_flags
+        topo_data = TopologyData(topology_path)
+        server_vars = topo_data.resolve(self.catalog)
+        phases = [1, 2, 3] if self.THREE_PHASE_CALCULATION else [1]
+        self.meas_topology = MeasTopology.from_topology(topo_data, server_vars, phases)
+        ctrl_nodes_list = [server_vars[entry.opctag] for entry in topo_data.get_entries(ROLE_CTRL)
+                           if entry.opctag in server_vars]
+        misc_nodes_list = [server_vars[entry.opctag] for entry in topo_data.get_entries(ROLE_STATUS)
+                           if entry.opctag in server_vars]
+        self.DataHandler.set_topology(self.meas_topology, ctrl_nodes_list, misc_nodes_list)
+
+        if self.BATCH_SIZE <= 0:
+            self.BATCH_SIZE = max(len(self.meas_topology.meas_nodes_list), 1)
+
+        self.records = 0
+        self.ignored_records = 0    # records of nodes missing in catalog
+        self.evaluations = 0
+        self.evaluated_slots = 0
+        self.duration = 0.0     # in s
+
+        print(DateHelper.get_local_datetime(), self.__class__.__name__, " successful init (" +
+              str(len(self.meas_topology)) + " subgrids, " + str(len(self.meas_topology.meas_nodes_list)) +
+              " I-measurement nodes)")
+
+    @staticmethod
+    def load_catalog(path, folder_name):
+        """Return NodeCatalog of the nodes listed in catalog file *path*
+        """
+        table = pd.read_csv(path, dtype=str)
+        nodes = [Node(None, ua.NodeId.from_string(nodeid)) for nodeid in table['nodeid']]
+        return NodeCatalog(folder_name, nodes, list(table['browse_name']), [None] * len(nodes))
+
+    def read_records(self, path):
+        """Yield the records of file *path* chunk by chunk as list of (Node, datetime, value)
+        """
+        for chunk in pd.read_csv(path, dtype={'nodeid': str, 'value': float}, chunksize=self.CHUNK_SIZE):
+            source_timestamps = chunk['source_timestamp']
+            if pd.api.types.is_integer_dtype(source_timestamps):
+                source_timestamps = pd.to_datetime(source_timestamps, unit='ns')
+            else:
+                # isoformat() omits the fraction at full seconds, the mixed precision breaks the format inferred from
+                # the first timestamp, thus each timestamp without fraction gets one (format='ISO8601' needs pandas 2)
+                source_timestamps = source_timestamps.str.replace(r'([T ]\d{2}:\d{2}:\d{2})(?![.\d])', r'\1.0',
+                                                                  regex=True)
+                # naive UTC datetime like SourceTimestamps of OPC-UA
+                source_timestamps = pd.to_datetime(source_timestamps, utc=True).dt.tz_convert(None)
+
+            notifications = []
+            for nodeid, datetime_source, val in zip(chunk['nodeid'], source_timestamps.dt.to_pydatetime(),
+                                                    chunk['value']):
+                node = self.node_of_nodeid.get(nodeid)
+                if node is None:
+                    self.ignored_records += 1
+                else:
+                    notifications.append((node, datetime_source, val))
+            yield notifications
+
+    def run(self, records_path):
+        """Feed all records of *records_path* into DataHandler and evaluate each complete time slot by DiffCore
+
+        :returns: statistics of replay (cf. get_stats)
+        """
+        start = time.perf_counter()
+        for notifications in self.read_records(records_path):
+            for i in range(0, len(notifications), self.BATCH_SIZE):
+                batch = notifications[i:i + self.BATCH_SIZE]
+                self.DataHandler.update_data_batch(batch)
+                self.records += len(batch)
+                self.evaluate()
+        self.duration = time.perf_counter() - start
+
+        stats = self.get_stats()
+        print(DateHelper.get_local_datetime(), self.__class__.__name__,
+              "replayed {} records in {:.2f} s ({:.0f} records/s), {} evaluations of {} time slots ({:.0f} slots/s), "
+              "{} actuations".format(stats['records'], stats['duration_s'], stats['records_per_s'],
+                                     stats['evaluations'], stats['evaluated_slots'], stats['slots_per_s'],
+                                     stats['actuations']))
+        return stats
+
+    def evaluate(self):
+        """Evaluate all complete time slots at once, like DiffCore woken up by DataHandler
+        """
+        res = self.DataHandler.get_newest_data()
+        if res is not None:
+            self.opc_client.replay_time = max(res.snapshot.timestamps)
+            self.evaluated_slots += self.mDiffCore.evaluate_data(res)
+            self.evaluations += 1
+
+    def get_stats(self):
+        """Return number of records, evaluations, evaluated time slots and actuations, duration (in s) and throughput
+        of the last replay; evaluation and actuation latency are measured by DiffCore (cf. LatencyStats)
+        """
+        duration = self.duration
+        latency_stats = self.DataHandler.get_latency_stats()
+        return {
+            'records': self.records,
+            'ignored_records': self.ignored_records,
+            'evaluations': self.evaluations,
+            'evaluated_slots': self.evaluated_slots,
+            'actuations': len(self.opc_client.actuations),
+            'duration_s': duration,
+            'records_per_s': self.records / duration if duration > 0 else 0.0,
+            'slots_per_s': self.evaluated_slots / duration if duration > 0 else 0.0,
+            'evaluation': latency_stats['evaluation'],
+            'actuation': latency_stats['actuation'],
+        }
+
+
+if __name__ == "__main__":
+    ##################
+    # if using local (means not in Docker)
+    # os.environ.setdefault("DEBUG_MODE_PRINT", "False")
+    # os.environ.setdefault("THREE_PHASE_CALCULATION", "False")
+    # os.environ.setdefault("TIMESTAMP_PRECISION", "10")   # in ms
+    # os.environ.setdefault("MAX_FAULTY_STATES", "5")
+    # os.environ.setdefault("NOMINAL_CURRENT", "2")
+    # os.environ.setdefault("CURRENT_EPS", "0.05")
+    # os.environ.setdefault("TOPOLOGY_PATH", "/data/topology/TopologyFile_demonstrator.json")
+    # os.environ.setdefault("REPLAY_CATALOG_PATH", "/data/replay/catalog.csv")
+    # os.environ.setdefault("REPLAY_RECORDS_PATH", "/data/replay/records.csv")
+    # os.environ.setdefault("REPLAY_BATCH_SIZE", "0")
+    ##################
+
+    mReplayHarness = ReplayHarness(os.path.dirname(os.getcwd()) + os.environ.get("TOPOLOGY_PATH"),
+                                   os.path.dirname(os.getcwd()) + os.environ.get("REPLAY_CATALOG_PATH"))
+    mReplayHarness.run(os.path.dirname(os.getcwd()) + os.environ.get("REPLAY_RECORDS_PATH"))
+    for replay_time, opctags, values in mReplayHarness.opc_client.actuations:
+        print(replay_time, opctags, values)
@@ -86,6 +86,7 @@ setup(
         'pytz>=2019.3',
         'pyyaml>=5.3',
         'pandas>=1.0.1',
+        'numpy>=1.17',
         # 'opcua>=0.98.13',
         # 'opcua==0.98.3' # for powerfactory maybe better alternative
     ],
@@ -0,0 +1,214 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+"""This is the fleet mode of the device simulator.
+
+The simulated measurement nodes are sharded across a pool of worker processes. Each worker runs its own OPC-client
+session and VarUpdater for its shard, hence the simulation is not limited to one core by the GIL. All workers share
+the first deadline and period of their DeadlineScheduler, thus they tick synchronously and send the same
+SourceTimestamps. The slack of each shard is scaled to the number of all simulated nodes, so the current sum of the
+whole fleet stays balanced.
+Each worker reports its statistics periodically to the DeviceFleet, which prints the aggregated throughput.
+"""
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from distutils.util import strtobool
+
+from helper.DateHelper import DateHelper
+from sim_device.OPCClient_SimulatedDevice import OPCClientSimulatedDevice
+from sim_device.SimulatedDeviceManager import create_var_updater
+
+sys.path.insert(0, "..")
+
+__version__ = '0.7'
+__author__ = 'Sebastian Krahmer'
+
+
+def run_fleet_worker(worker_id, server_endpoint, nodeids, browse_names, number_of_vars, start_time_ns, report_period,
+                     stats_queue, stop_event):
+    """Update the nodes of one shard until *stop_event* is set (entry point of a worker process). Like DeviceManager,
+    the worker restarts its OPC-client and VarUpdater if the connection fails or the updater aborted.
+
+    :param worker_id (int): number of worker
+    :param nodeids ([str]): nodeid (string notation) of each node of shard
+    :param browse_names ([str]): browse name of each node of shard
+    :param number_of_vars (int): number of nodes of all shards
+    :param start_time_ns (int): wall clock time (ns since epoch) of the first deadline of all workers, a restarted
+        updater joins the current tick of the fleet
+    :param report_period (float): time between two reports of statistics in s
+    :param stats_queue (multiprocessing.Queue): queue the statistics are sent to
+    :param stop_event (multiprocessing.Event): event to stop the worker
+    """
+    # values written and write errors of the updaters of previous runs, thus the reports are cumulative
+    written_before = 0
+    errors_before = 0
+
+    while not stop_event.is_set():
+        opc_client = None
+        vup = None
+        try:
+            opc_client = OPCClientSimulatedDevice("n5geh_opcua_client2", "n5geh2020", server_endpoint)
+            opc_client.start()
+            nodes = [opc_client.client.get_node(nodeid) for nodeid in nodeids]
+            opc_client.set_full_node_list(nodes)
+
+            vup = create_var_updater(nodes, opc_client, 0, browse_names=browse_names, number_of_vars=number_of_vars,
+                                     start_time_ns=start_time_ns)
+            vup.start()
+
+            while not stop_event.wait(report_period) and vup.is_alive():
+                stats_queue.put((worker_id, len(nodes), written_before + vup.values_written,
+                                 errors_before + vup.write_errors, vup.get_scheduler_stats()))
+            # final report, e.g. of a finished scenario
+            stats_queue.put((worker_id, len(nodes), written_before + vup.values_written,
+                             errors_before + vup.write_errors, vup.get_scheduler_stats()))
+            if not vup.aborted:
+                break
+        except Exception as ex:
+            print(DateHelper.get_local_datetime(), "fleet worker", worker_id, ex)
+        finally:
+            if vup is not None:
+                vup.stop()
+                if vup.is_alive():
+                    vup.join()
+                written_before += vup.values_written
+                errors_before += vup.write_errors
+            if opc_client is not None:
+                opc_client.stop()
+
+        if not stop_event.is_set():
+            print(DateHelper.get_local_datetime(), "Restart fleet worker", worker_id)
+            stop_event.wait(1)
+
+
+class DeviceFleet(object):
+    def __init__(self, meas_device_tag="RES", number_of_workers=None, start_threshold=5000,
+                 server_endpoint="opc.tcp://0.0.0.0:4840/OPCUA/python_server/"):
+        """
+        :param meas_device_tag (str): tag of the simulated nodes
+        :param number_of_workers (int): number of worker processes (default of SIM_DEVICE_WORKERS)
+        :param start_threshold (int): delay of the first update in ms (default of AUTO_VAR_UPDATER_START_THRESHOLD)
+        """
+        self.SERVER_ENDPOINT = os.environ.get("SERVER_ENDPOINT", server_endpoint)
+        self.DEBUG_MODE_PRINT = bool(strtobool(os.environ.get("DEBUG_MODE_PRINT", "False")))
+        self.NUMBER_OF_WORKERS = int(os.environ.get("SIM_DEVICE_WORKERS", number_of_workers or os.cpu_count()))
+        self.REPORT_PERIOD = float(os.environ.get("SIM_DEVICE_REPORT_PERIOD", "10"))     # in s
+        self.START_THRESHOLD = int(os.environ.get("AUTO_VAR_UPDATER_START_THRESHOLD", start_threshold)) * 1000 * 1000   # conversion into ns
+        self.OPCUA_DIR_NAME = os.environ.get("OPCUA_SERVER_DIR_NAME")
+
+        self.meas_device_tag = meas_device_tag
+        self.workers = []
+        self.worker_stats = dict()  # worker id -> last report (number of nodes, values written, write errors, stats)
+
+        # spawn instead of fork: worker processes must not inherit threads or sockets of an opc client
+        self._context = multiprocessing.get_context("spawn")
+        self._stats_queue = self._context.Queue()
+        self._stop_event = self._context.Event()
+        self._terminated = False
+
+        print(DateHelper.get_local_datetime(), self.__class__.__name__, " successful init")
+
+    def terminate(self):
+        self._terminated = True
+        self._stop_event.set()
+
+    def get_shards(self):
+        """Browse the simulated nodes once and split them into one shard per worker
+
+        :returns: list of (nodeids, browse_names) of each shard
+        """
+        opc_client = OPCClientSimulatedDevice("n5geh_opcua_client2", "n5geh2020", self.SERVER_ENDPOINT)
+        opc_client.start()
+        try:
+            nodeids = []
+            browse_names = []
+            for browse_name, var in opc_client.get_node_catalog(self.OPCUA_DIR_NAME, refresh=True).items():
+                if self.meas_device_tag in browse_name:
+                    nodeids.append(var.nodeid.to_string())
+                    browse_names.append(browse_name)
+        finally:
+            opc_client.stop()
+
+        number_of_shards = max(min(self.NUMBER_OF_WORKERS, len(nodeids)), 1)
+        return [(nodeids[i::number_of_shards], browse_names[i::number_of_shards]) for i in range(number_of_shards)]
+
+    def start(self):
+        shards = self.get_shards()
+        number_of_vars = sum(len(nodeids) for nodeids, browse_names in shards)
+        start_time_ns = time.time_ns() + self.START_THRESHOLD
+
+        for worker_id, (nodeids, browse_names) in enumerate(shards):
+            worker = self._context.Process(target=run_fleet_worker, daemon=True,
+                                           args=(worker_id, self.SERVER_ENDPOINT, nodeids, browse_names,
+                                                 number_of_vars, start_time_ns, self.REPORT_PERIOD, self._stats_queue,
+                                                 self._stop_event))
+            worker.start()
+            self.workers.append(worker)
+        print(DateHelper.get_local_datetime(), self.__class__.__name__, " started", len(self.workers), "workers for",
+              number_of_vars, "nodes")
+
+        try:
+            self.collect_stats()
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stop_event.set()
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        print(DateHelper.get_local_datetime(), self.__class__.__name__, " stopped")
+
+    def collect_stats(self):
+        """Receive reports of all workers and print the aggregated throughput once per report period until all workers
+        stopped
+        """
+        last_values_written = 0
+        last_report = time.monotonic()
+        while not self._terminated and any(worker.is_alive() for worker in self.workers):
+            try:
+                worker_id, *report = self._stats_queue.get(timeout=self.REPORT_PERIOD)
+                self.worker_stats[worker_id] = report
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            if now - last_report >= self.REPORT_PERIOD:
+                stats = self.get_stats()
+                print(DateHelper.get_local_datetime(), self.__class__.__name__,
+                      "workers {}/{}, {:.0f} values/s, rate {:.1f}-{:.1f} Hz, missed ticks {}, write errors {}, max "
+                      "jitter {:.2f} ms".format(stats['workers_alive'], len(self.workers),
+                                                (stats['values_written'] - last_values_written) / (now - last_report),
+                                                stats['rate_min_hz'], stats['rate_max_hz'], stats['missed_ticks'],
+                                                stats['write_errors'], stats['jitter_max_ms']))
+                last_values_written = stats['values_written']
+                last_report = now
+
+        # reports sent by the workers before they stopped
+        while True:
+            try:
+                worker_id, *report = self._stats_queue.get_nowait()
+                self.worker_stats[worker_id] = report
+            except queue.Empty:
+                break
+
+    def get_stats(self):
+        """Return statistics aggregated over the last report of each worker
+        """
+        reports = list(self.worker_stats.values())
+        rates = [scheduler_stats['rate_hz'] for nodes, written, errors, scheduler_stats in reports]
+        return {
+            'workers_alive': sum(worker.is_alive() for worker in self.workers),
+            'nodes': sum(nodes for nodes, written, errors, scheduler_stats in reports),
+            'values_written': sum(written for nodes, written, errors, scheduler_stats in reports),
+            'write_errors': sum(errors for nodes, written, errors, scheduler_stats in reports),
+            'missed_ticks': sum(scheduler_stats['missed_ticks'] for nodes, written, errors, scheduler_stats in reports),
+            'rate_min_hz': min(rates, default=0.0),
+            'rate_max_hz': max(rates, default=0.0),
+            'jitter_max_ms': max((scheduler_stats['jitter_ms'] for nodes, written, errors, scheduler_stats in reports),
+                                 default=0.0),
+        }
@@ -49,6 +49,7 @@ class OPCClientSimulatedDevice(CustomClient):
 
     def set_full_node_list(self, full_node_list):
         self.full_node_list = full_node_list
+        self.cache_variant_types(full_node_list)
 
     def set_vars(self, ctrl_list, value_list):
         super().set_vars(self.full_node_list, ctrl_list, value_list)
@@ -0,0 +1,89 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+"""This is the scenario file of the device simulator.
+
+A scenario is a directory with a recorded or scripted time series of each simulated node:
+- scenario.json: version, time span between two steps (period_ms) and browse name of each column
+- values.npy: 2D array of values (one row per time step, one column per node)
+
+The time steps are equidistant, a scenario has no timestamp column. Recordings with irregular timestamps have to be
+resampled to period_ms, otherwise their timing is not replayed faithfully.
+
+The values are memory-mapped, hence a scenario is not loaded into memory at once, playback reads only the row of the
+current step, and all processes of a fleet share the pages of one file.
+"""
+import json
+import os
+
+import numpy as np
+
+__version__ = '0.7'
+__author__ = 'Sebastian Krahmer'
+
+
+class Scenario(object):
+    VERSION = 1
+    META_FILE = "scenario.json"
+    VALUES_FILE = "values.npy"
+
+    def __init__(self, path):
+        """
+        :param path (str): directory of scenario
+        """
+        self.path = path
+
+        with open(os.path.join(path, self.META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get("version") != self.VERSION:
+            raise ValueError("unsupported scenario version {} of {}".format(meta.get("version"), path))
+
+        self.period_ns = int(round(float(meta["period_ms"]) * 1000 * 1000))
+        self.columns = list(meta["columns"])
+        self.values = np.load(os.path.join(path, self.VALUES_FILE), mmap_mode='r')
+
+        if self.period_ns <= 0:
+            raise ValueError("period of scenario {} must be positive".format(path))
+        if self.values.ndim != 2 or self.values.shape[1] != len(self.columns):
+            raise ValueError("values of scenario {} do not match its {} columns".format(path, len(self.columns)))
+        if self.values.shape[0] == 0:
+            raise ValueError("scenario {} has no time steps".format(path))
+
+        self._column_indices = {column: i for i, column in enumerate(self.columns)}
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def get_column_indices(self, browse_names):
+        """Return column index of each browse name, -1 if the scenario has no column for it
+        """
+        return np.array([self._column_indices.get(browse_name, -1) for browse_name in browse_names], dtype=np.intp)
+
+    def get_values(self, step, column_indices):
+        """Return values of the given columns at time step *step* as float array
+        """
+        return np.asarray(self.values[step], dtype=float)[column_indices]
+
+    @classmethod
+    def save(cls, path, columns, values, period_ms):
+        """Write a scenario, e.g. a scripted one or a recording
+        :param path (str): directory of scenario, created if missing
+        :param columns ([str]): browse name of each column
+        :param values (array_like): 2D array of values, one row per time step
+        :param period_ms (float): time span between two time steps in ms
+        """
+        values = np.ascontiguousarray(values)
+        if values.ndim != 2 or values.shape[1] != len(columns):
+            raise ValueError("values do not match the {} columns".format(len(columns)))
+
+        os.makedirs(path, exist_ok=True)
+        # replace the files atomically, hence a running playback never maps a partly written file
+        values_path = os.path.join(path, cls.VALUES_FILE)
+        with open(values_path + ".tmp", "wb") as f:
+            np.save(f, values)
+        os.replace(values_path + ".tmp", values_path)
+
+        meta_path = os.path.join(path, cls.META_FILE)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"version": cls.VERSION, "period_ms": period_ms, "columns": list(columns)}, f, indent=2)
+        os.replace(meta_path + ".tmp", meta_path)
@@ -5,22 +5,23 @@
 
 This class setups a new instance of OPCClient_SimulatedDevice.
 This class is used as Measurement device equivalent and updates value of vars via VarUpdater within a loop specified by
-AUTO_VAR_UPDATER_xxx variables.
+AUTO_VAR_UPDATER_xxx variables. If SCENARIO_PATH is set, the ScenarioPlayer plays back the time series of a scenario
+file (cf. Scenario) instead.
 """
-import datetime
 import os
-import random
 import sys
 import threading
 from threading import Thread
 import time
 from distutils.util import strtobool
-from math import sin, pi
+from math import pi
+
+import numpy as np
 
 from helper.DateHelper import DateHelper
-from opcua import ua
-from opcua.ua import DataValue
+from helper.DeadlineScheduler import DeadlineScheduler
 from sim_device.OPCClient_SimulatedDevice import OPCClientSimulatedDevice
+from sim_device.Scenario import Scenario
 
 sys.path.insert(0, "..")
 
@@ -29,7 +30,18 @@ __author__ = 'Sebastian Krahmer'
 
 
 class VarUpdater(Thread):
-    def __init__(self, mvars, opc_client, start_threshold, period=500):
+    def __init__(self, mvars, opc_client, start_threshold, period=500, browse_names=None, number_of_vars=None,
+                 start_time_ns=None):
+        """
+        :param mvars: nodes to update
+        :param opc_client (OPCClientSimulatedDevice): client used to write the values
+        :param start_threshold (int): delay of first update in ns
+        :param period (int): time between two updates in ms (default of AUTO_VAR_UPDATER_UPDATE_PERIOD)
+        :param browse_names ([str]): browse name of each node (None: requested from server)
+        :param number_of_vars (int): number of all simulated vars, if *mvars* is a shard of a fleet (None: len(mvars))
+        :param start_time_ns (int): wall clock time (ns since epoch) of first update instead of *start_threshold* (cf.
+            DeadlineScheduler.start)
+        """
         super().__init__()
 
         self.DEBUG_MODE_PRINT = bool(strtobool(os.environ.get("DEBUG_MODE_PRINT", "False")))
@@ -37,74 +49,195 @@ class VarUpdater(Thread):
         self.PERIOD = int(os.environ.get("AUTO_VAR_UPDATER_UPDATE_PERIOD", period))
         self.TIME_STEPS_NO_ERROR = int(os.environ.get("AUTO_VAR_UPDATER_TIME_STEPS_NO_ERROR", "60"))
         self.TIME_STEPS_ERROR = int(os.environ.get("AUTO_VAR_UPDATER_TIME_STEPS_ERROR", "60"))
+        self.MAX_WRITE_ERRORS = int(os.environ.get("AUTO_VAR_UPDATER_MAX_WRITE_ERRORS", "10"))
         self.ANORMAL_NODE_NAME = os.environ.get("NAME_OF_ANORMAL_MEASUREMENT")
         self.SLACK_NODE_NAME = os.environ.get("NAME_OF_SLACK_MEASUREMENT")
 
-        self.ticker = threading.Event()
+        self.ticker = threading.Event()     # set to interrupt waiting for the next tick
+        self.scheduler = DeadlineScheduler(self.PERIOD * 1000 * 1000)
         self._terminated = False
 
         self.vars = mvars
+        # browse name of each var (requested once instead of each period)
+        self.browse_names = browse_names if browse_names is not None else [var.get_browse_name().Name for var in mvars]
         self.opc_client = opc_client
         self.threshold = start_threshold
+        self.start_time_ns = start_time_ns
+        self.number_of_vars = len(mvars) if number_of_vars is None else number_of_vars
+        self.values_written = 0
+        self.write_errors = 0
+        self.consecutive_write_errors = 0
+        self.aborted = False    # True if the updater stopped itself after MAX_WRITE_ERRORS failed writes in a row
+
+        # waveform of each var: amplitude and flag, if the var shows the deviation of the anormal measurement
+        self.is_anormal = np.array([self.ANORMAL_NODE_NAME is not None and self.ANORMAL_NODE_NAME in browse_name
+                                    for browse_name in self.browse_names], dtype=bool)
+        is_slack = np.array([self.SLACK_NODE_NAME is not None and self.SLACK_NODE_NAME in browse_name
+                             for browse_name in self.browse_names], dtype=bool)
+        self.amplitudes = np.where(is_slack & ~self.is_anormal, (self.number_of_vars - 1) * 2.0, 2.0)
         # self.count = self.vars.get_value()
 
     def stop(self):
         self._terminated = True
+        self.ticker.set()
 
     def run(self):
-        start_time = time.time_ns()
-        while not self._terminated or len(self.vars) >= 1:
-            if time.time_ns() > (start_time + self.threshold):
-                print(DateHelper.get_local_datetime(), self.__class__.__name__, " started")
-                self.run2()
-                break
+        # sleep until start threshold passed, the first tick is the deadline of all following ticks
+        self.scheduler.start(self.threshold, self.start_time_ns)
+        if self.scheduler.wait_for_next_tick(self.ticker):
+            print(DateHelper.get_local_datetime(), self.__class__.__name__, " started")
+            self.run2()
 
     def run2(self):
         count = 0
         t1 = 0
         t2 = 0
 
-        while not self.ticker.wait(self.PERIOD / 1000) and not self._terminated:
-            now = DateHelper.create_local_utc_datetime()
-
-            values = []
-            for var in self.vars:
-                # add "noise" to dt in the range [0 TIMESTAMP_PRECISION]
-                delta = random.random() * self.TIMESTAMP_PRECISION * 1000
-                now_noised = now + datetime.timedelta(0, 0, delta)
-
-                dv = DataValue()
-                dv.SourceTimestamp = now
-                # dv.SourceTimestamp = now_noised
-
-                if self.ANORMAL_NODE_NAME in var.get_browse_name().Name:
-                    dv.Value = ua.Variant(2 * sin(100 * pi * (t1 + t2)))
-                else:
-                    if self.SLACK_NODE_NAME in var.get_browse_name().Name:
-                        dv.Value = ua.Variant((len(self.vars)-1) * 2 * sin(100 * pi * t1))
-                    else:
-                        dv.Value = ua.Variant(2 * sin(100 * pi * t1))
-                values.append(dv)
-                if self.DEBUG_MODE_PRINT:
-                    print(self.__class__.__name__, dv.Value)
+        while not self._terminated:
+            # SourceTimestamp is the deadline of the tick, thus all updaters of a fleet send the same timestamps
+            now = DateHelper.from_timestamp_ns(self.scheduler.get_tick_time_ns())
 
-            self.opc_client.set_vars(self.vars, values)
+            # values of all vars at once, all of them with SourceTimestamp now
+            self.write(self.waveforms(t1, t2), now)
 
             t1 = count / 1000
             # make deviation after 60 time steps
             if count > self.TIME_STEPS_NO_ERROR:
                 t2 = count * 0.05 / 1000
-            count += 1
+
+            # sleep until next deadline, missed ticks advance the time steps as well
+            periods = self.scheduler.wait_for_next_tick(self.ticker)
+            if periods == 0:
+                break
+            count += periods
 
             # reset after 120 time steps
             if count > self.TIME_STEPS_NO_ERROR + self.TIME_STEPS_ERROR:
-                print(DateHelper.get_local_datetime(), self.__class__.__name__, " reset Var_Updater loop")
+                print(DateHelper.get_local_datetime(), self.__class__.__name__, " reset Var_Updater loop",
+                      self.format_scheduler_stats())
                 count = 0
                 t1 = 0
                 t2 = 0
 
         print(DateHelper.get_local_datetime(), self.__class__.__name__, " stopped")
 
+    def write(self, values, source_timestamp):
+        """Write values of all vars in one request, failed writes are counted and skipped. After MAX_WRITE_ERRORS
+        failed writes in a row (e.g. lost connection) the updater stops itself, thus its owner can restart it.
+        """
+        if self.DEBUG_MODE_PRINT:
+            print(self.__class__.__name__, values)
+
+        try:
+            self.opc_client.write_values(self.vars, values.tolist(), source_timestamp)
+            self.values_written += len(self.vars)
+            self.consecutive_write_errors = 0
+        except Exception as ex:
+            self.write_errors += 1
+            self.consecutive_write_errors += 1
+            print(DateHelper.get_local_datetime(), self.__class__.__name__, "write failed:", ex)
+            if self.consecutive_write_errors >= self.MAX_WRITE_ERRORS:
+                print(DateHelper.get_local_datetime(), self.__class__.__name__, " abort after",
+                      self.consecutive_write_errors, "failed writes in a row")
+                self.aborted = True
+                self.stop()
+
+    def get_scheduler_stats(self):
+        """Return achieved rate, missed ticks and jitter of the update loop (cf. DeadlineScheduler.get_stats)
+        """
+        return self.scheduler.get_stats()
+
+    def format_scheduler_stats(self):
+        stats = self.get_scheduler_stats()
+        return "(rate {:.1f}/{:.1f} Hz, missed ticks {}, jitter {:.2f} ms, max lateness {:.2f} ms)".format(
+            stats['rate_hz'], stats['target_rate_hz'], stats['missed_ticks'], stats['jitter_ms'],
+            stats['lateness_max_ms'])
+
+    def waveforms(self, t1, t2):
+        """Return value of each var at time *t1*; the anormal measurement is shifted by *t2*, which causes the deviation
+        of the current sum
+        """
+        return self.amplitudes * np.sin(100 * pi * (t1 + t2 * self.is_anormal))
+
+
+class ScenarioPlayer(VarUpdater):
+    def __init__(self, mvars, opc_client, start_threshold, scenario, browse_names=None, speed=1.0, loop=True,
+                 start_time_ns=None):
+        """
+        :param mvars: nodes to update, nodes without column in *scenario* are not written
+        :param opc_client (OPCClientSimulatedDevice): client used to write the values
+        :param start_threshold (int): delay of first update in ns
+        :param scenario (Scenario): time series to play back
+        :param browse_names ([str]): browse name of each node (None: requested from server)
+        :param speed (float): playback speed, e.g. 10 plays back ten steps in the period of one (default of
+            SCENARIO_SPEED)
+        :param loop (bool): flag, if playback restarts after the last step (default of SCENARIO_LOOP)
+        :param start_time_ns (int): wall clock time (ns since epoch) of first update instead of *start_threshold*
+        """
+        super().__init__(mvars, opc_client, start_threshold, browse_names=browse_names, start_time_ns=start_time_ns)
+
+        self.SPEED = float(os.environ.get("SCENARIO_SPEED", speed))
+        self.LOOP = bool(strtobool(os.environ.get("SCENARIO_LOOP", str(loop))))
+        if self.SPEED <= 0:
+            raise ValueError("playback speed must be positive")
+
+        self.scenario = scenario
+        column_indices = scenario.get_column_indices(self.browse_names)
+        played = column_indices >= 0
+        if not played.any():
+            raise ValueError("scenario {} has no column of the simulated nodes".format(scenario.path))
+        if not played.all():
+            print(DateHelper.get_local_datetime(), self.__class__.__name__, " no column in scenario for",
+                  [browse_name for browse_name, p in zip(self.browse_names, played) if not p])
+        self.vars = [var for var, p in zip(self.vars, played) if p]
+        self.browse_names = [browse_name for browse_name, p in zip(self.browse_names, played) if p]
+        self.column_indices = column_indices[played]
+
+        # one tick per step, accelerated by speed
+        self.scheduler = DeadlineScheduler(max(int(round(scenario.period_ns / self.SPEED)), 1))
+
+    def run2(self):
+        # SourceTimestamps follow the scenario time from the first tick on, independent of the speed, thus a time
+        # step has the same value in each run; missed ticks skip their steps instead of shifting all following ones
+        start_time_ns = self.scheduler.get_tick_time_ns()
+        number_of_steps = len(self.scenario)
+        tick = 0
+
+        while not self._terminated:
+            now = DateHelper.from_timestamp_ns(start_time_ns + tick * self.scenario.period_ns)
+            self.write(self.scenario.get_values(tick % number_of_steps, self.column_indices), now)
+            if not self.LOOP and tick == number_of_steps - 1:
+                print(DateHelper.get_local_datetime(), self.__class__.__name__, " finished scenario",
+                      self.format_scheduler_stats())
+                break
+
+            periods = self.scheduler.wait_for_next_tick(self.ticker)
+            if periods == 0:
+                break
+            tick += periods
+
+            if not self.LOOP:
+                # missed ticks never skip the last step, hence the final values are the same in each run
+                tick = min(tick, number_of_steps - 1)
+            elif tick // number_of_steps != (tick - periods) // number_of_steps:
+                print(DateHelper.get_local_datetime(), self.__class__.__name__, " restart scenario",
+                      self.format_scheduler_stats())
+
+        print(DateHelper.get_local_datetime(), self.__class__.__name__, " stopped")
+
+
+def create_var_updater(mvars, opc_client, start_threshold, browse_names=None, number_of_vars=None,
+                       start_time_ns=None):
+    """Return a ScenarioPlayer of the scenario at SCENARIO_PATH (relative to the parent of the working directory like
+    all data paths) or, if it is not set, a VarUpdater with the built-in waveforms (cf. VarUpdater for parameters)
+    """
+    scenario_path = os.environ.get("SCENARIO_PATH")
+    if scenario_path:
+        return ScenarioPlayer(mvars, opc_client, start_threshold, Scenario(os.path.dirname(os.getcwd()) + scenario_path),
+                              browse_names=browse_names, start_time_ns=start_time_ns)
+    return VarUpdater(mvars, opc_client, start_threshold, browse_names=browse_names, number_of_vars=number_of_vars,
+                      start_time_ns=start_time_ns)
+
 
 class DeviceManager(object):
     def __init__(self, meas_device_tag="RES", auth_name=None, auth_password=None, start_threshold=5000,
@@ -142,7 +275,7 @@ class DeviceManager(object):
 
     def _finalize(self):
         self._del_OPCUA()
-        self.vup.stop()
+        self.stop_auto_updater()
 
     def terminate(self):
         self._terminated = True
@@ -153,7 +286,8 @@ class DeviceManager(object):
                 # start opc client
                 self._init_OPCUA()
 
-                # start AutoVarUpdater
+                # start AutoVarUpdater, the updater of the previous run must not keep writing
+                self.stop_auto_updater()
                 self.prepare_auto_updater()
                 self.start_auto_updater()
 
@@ -163,6 +297,9 @@ class DeviceManager(object):
                 while not self._terminated:
                     try:
                         browse_name = self.opc_client.client.get_server_node().get_browse_name()
+                        if self.vup.aborted:
+                            print(DateHelper.get_local_datetime(), self.__class__.__name__, 'Auto-VarUpdater aborted')
+                            break
                         time.sleep(1)
                     except Exception as ex:
                         print(DateHelper.get_local_datetime(), self.__class__.__name__, 'lost connection to server:')
@@ -180,18 +317,28 @@ class DeviceManager(object):
     # region autoUpdater
     def prepare_auto_updater(self):
         var_list = []
+        browse_names = []
 
-        for var in self.opc_client.get_server_vars(self.OPCUA_DIR_NAME):
-            if self.meas_device_tag in var.get_browse_name().Name:
+        for browse_name, var in self.opc_client.get_node_catalog(self.OPCUA_DIR_NAME, refresh=True).items():
+            if self.meas_device_tag in browse_name:
                 var_list.append(var)
+                browse_names.append(browse_name)
         self.opc_client.set_full_node_list(var_list)
-        self.vup = VarUpdater(var_list, self.opc_client, self.START_THRESHOLD)
+        self.vup = create_var_updater(var_list, self.opc_client, self.START_THRESHOLD, browse_names=browse_names)
 
     def start_auto_updater(self):
         print(self.__class__.__name__, type(self.vup))
         self.vup.start()
 
         print(DateHelper.get_local_datetime(), self.__class__.__name__, "started Auto-VarUpdater")
+
+    def stop_auto_updater(self):
+        """Stop the Auto-VarUpdater and wait until its thread finished
+        """
+        if self.vup is not None:
+            self.vup.stop()
+            if self.vup.is_alive():
+                self.vup.join()
     # endregion
 
 
@@ -216,9 +363,20 @@ if __name__ == "__main__":
     # os.environ.setdefault("AUTO_VAR_UPDATER_TIME_STEPS_ERROR", "60")
     # os.environ.setdefault("NAME_OF_ANORMAL_MEASUREMENT", "LAST_I_PH1_RES")
     # os.environ.setdefault("NAME_OF_SLACK_MEASUREMENT", "TRAFO_I_PH1_RES")
+    # os.environ.setdefault("SIM_DEVICE_WORKERS", "1")
+    # os.environ.setdefault("SCENARIO_PATH", "")    # e.g. "/cloud_setup/data/scenario", empty: built-in waveforms
+    # os.environ.setdefault("SCENARIO_SPEED", "1.0")
+    # os.environ.setdefault("SCENARIO_LOOP", "True")
     ##################
 
     meas_device_tags = ["RES"]
-    for tag in meas_device_tags:
-        mDeviceManager = DeviceManager(tag)
-        mDeviceManager.start()
+    if int(os.environ.get("SIM_DEVICE_WORKERS", "1")) > 1:
+        # fleet mode: nodes are updated by a pool of worker processes
+        from sim_device.DeviceFleet import DeviceFleet
+        for tag in meas_device_tags:
+            mDeviceFleet = DeviceFleet(tag)
+            mDeviceFleet.start()
+    else:
+        for tag in meas_device_tags:
+            mDeviceManager = DeviceManager(tag)
+            mDeviceManager.start()
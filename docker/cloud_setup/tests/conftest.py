@@ -0,0 +1,13 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+"""Test configuration: modules are imported like in the containers, i.e. relative to cloud_setup (e.g. helper.DateHelper)
+and relative to its parent (e.g. cloud_setup.protection.DataSource).
+"""
+import os
+import sys
+
+CLOUD_SETUP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.dirname(CLOUD_SETUP_DIR))
+sys.path.insert(0, CLOUD_SETUP_DIR)
@@ -0,0 +1,93 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+import threading
+
+import pytest
+
+from protection.CommandWorker import CommandWorker
+
+
+@pytest.fixture
+def worker():
+    worker = CommandWorker()
+    yield worker
+    worker.stop()
+    if worker.is_alive():
+        worker.join(timeout=5)
+
+
+def wait_for_queue(worker):
+    """Submit a marker command and wait until it ran, i.e. all commands submitted before were executed
+    """
+    done = threading.Event()
+    worker.submit("marker", done.set)
+    assert done.wait(timeout=5)
+
+
+def test_commands_run_in_order_of_submission(worker):
+    calls = []
+    for i in range(5):
+        assert worker.submit("command", calls.append, i)
+    worker.start()
+    wait_for_queue(worker)
+
+    assert calls == [0, 1, 2, 3, 4]
+
+
+def test_queued_command_is_coalesced_by_name(worker):
+    calls = []
+    assert worker.submit("update", calls.append, "first", coalesce=True)
+    assert not worker.submit("update", calls.append, "second", coalesce=True)
+    assert worker.submit("other", calls.append, "other", coalesce=True)
+    assert worker.submit("update", calls.append, "not coalesced")     # without coalesce it is queued anyway
+    worker.start()
+    wait_for_queue(worker)
+
+    assert calls == ["first", "other", "not coalesced"]
+
+
+def test_command_submitted_while_running_is_queued_again(worker):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def update(label):
+        calls.append(label)
+        started.set()
+        release.wait(timeout=5)
+
+    worker.submit("update", update, "first", coalesce=True)
+    worker.start()
+    assert started.wait(timeout=5)
+
+    # the running command is no longer pending, thus a new request must not be lost
+    assert worker.submit("update", update, "second", coalesce=True)
+    assert not worker.submit("update", update, "third", coalesce=True)
+    release.set()
+    wait_for_queue(worker)
+
+    assert calls == ["first", "second"]
+
+
+def test_worker_survives_failing_command(worker):
+    calls = []
+
+    def fail():
+        raise RuntimeError("command failed")
+
+    worker.submit("fail", fail)
+    worker.submit("command", calls.append, "after failure")
+    worker.start()
+    wait_for_queue(worker)
+
+    assert worker.is_alive()
+    assert calls == ["after failure"]
+
+
+def test_stop_ends_waiting_worker(worker):
+    worker.start()
+    worker.stop()
+    worker.join(timeout=5)
+
+    assert not worker.is_alive()
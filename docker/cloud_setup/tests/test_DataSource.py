@@ -0,0 +1,90 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+import json
+
+from opcua import Node, ua
+
+from opc_ua.client.NodeCatalog import NodeCatalog
+from protection.DataSource import TopologyData, TopologyEntry
+from protection.DataSource import ROLE_I_MEAS, ROLE_CTRL, ROLE_STATUS
+
+TOPOLOGY = {"Grid-ID": "demo", "POCs": [
+    {"TRAFO_I_PH1_RES": "Slack, Current Phase1", "LAST_I_PH1_RES": "Load, Current Phase1",
+     "PV_LIMIT_CTRL": "PV-Infeed, Active power upper limit", "NETZ_PH1_FEHLER_COUNTER": "Status PH1"}]}
+
+
+def write_topology(path, topology=TOPOLOGY):
+    topology_path = path / "TopologyFile.json"
+    topology_path.write_text(json.dumps(topology))
+    return str(topology_path)
+
+
+def test_compile_pocs_classifies_nodes():
+    entries = TopologyData.compile_pocs(TOPOLOGY["POCs"])
+
+    assert entries == [
+        TopologyEntry("TRAFO_I_PH1_RES", "Slack, Current Phase1", 0, ROLE_I_MEAS, 1, -1),
+        TopologyEntry("LAST_I_PH1_RES", "Load, Current Phase1", 0, ROLE_I_MEAS, 1, 1),
+        TopologyEntry("PV_LIMIT_CTRL", "PV-Infeed, Active power upper limit", 0, ROLE_CTRL, -1, 1),
+        TopologyEntry("NETZ_PH1_FEHLER_COUNTER", "Status PH1", 0, ROLE_STATUS, 1, 1)]
+
+
+def test_cache_is_written_and_hit(tmp_path):
+    topology_path = write_topology(tmp_path)
+    cache_dir = tmp_path / "cache"
+
+    compiled = TopologyData(topology_path, cache_dir=str(cache_dir))
+    cache_files = list(cache_dir.glob("*.json"))
+    assert len(cache_files) == 1
+
+    # a cache hit takes over the cached entries instead of compiling the file again
+    cache = json.loads(cache_files[0].read_text())
+    cache["grid_id"] = "cached"
+    cache_files[0].write_text(json.dumps(cache))
+    cached = TopologyData(topology_path, cache_dir=str(cache_dir))
+
+    assert cached.grid_id == "cached"
+    assert cached.entries == compiled.entries
+    assert cached.get_entries(ROLE_I_MEAS) == compiled.get_entries(ROLE_I_MEAS)
+    assert cached.get_pocs() == compiled.get_pocs()
+
+
+def test_cache_is_invalidated_by_changed_file(tmp_path):
+    cache_dir = tmp_path / "cache"
+    TopologyData(write_topology(tmp_path), cache_dir=str(cache_dir))
+
+    changed = {"Grid-ID": "demo", "POCs": [{"TRAFO_I_PH1_RES": "Slack, Current Phase1"}]}
+    topo_data = TopologyData(write_topology(tmp_path, changed), cache_dir=str(cache_dir))
+
+    assert [entry.opctag for entry in topo_data.entries] == ["TRAFO_I_PH1_RES"]
+    assert len(list(cache_dir.glob("*.json"))) == 2
+
+
+def test_cache_of_other_version_or_broken_is_compiled_again(tmp_path):
+    topology_path = write_topology(tmp_path)
+    cache_dir = tmp_path / "cache"
+    TopologyData(topology_path, cache_dir=str(cache_dir))
+    cache_file = list(cache_dir.glob("*.json"))[0]
+
+    for content in (json.dumps({"version": TopologyData.CACHE_VERSION - 1, "grid_id": "old", "entries": []}),
+                    "not json", json.dumps({"version": TopologyData.CACHE_VERSION, "grid_id": "x",
+                                            "entries": [["too", "short"]]})):
+        cache_file.write_text(content)
+        topo_data = TopologyData(topology_path, cache_dir=str(cache_dir))
+
+        assert topo_data.grid_id == "demo"
+        assert topo_data.entries == TopologyData.compile_pocs(TOPOLOGY["POCs"])
+        assert json.loads(cache_file.read_text())["version"] == TopologyData.CACHE_VERSION
+
+
+def test_resolve_matches_registered_nodes(tmp_path):
+    topo_data = TopologyData(write_topology(tmp_path))
+    nodes = [Node(None, ua.NodeId(i, 2)) for i in range(2)]
+    catalog = NodeCatalog("demo", nodes, ["TRAFO_I_PH1_RES", "PV_LIMIT_CTRL"], [None, None])
+
+    server_vars = topo_data.resolve(catalog)
+
+    assert sorted(server_vars) == ["PV_LIMIT_CTRL", "TRAFO_I_PH1_RES"]
+    assert server_vars["TRAFO_I_PH1_RES"].nodeid == nodes[0].nodeid
+    assert server_vars["TRAFO_I_PH1_RES"].phase == 1
@@ -0,0 +1,93 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+import math
+
+import pytest
+
+from helper import DeadlineScheduler as deadline_scheduler
+from helper.DeadlineScheduler import DeadlineScheduler
+
+MS = 1000 * 1000    # in ns
+START_NS = 1000 * 1000 * MS
+WALL_CLOCK_OFFSET_NS = 1600000000 * 1000 * MS
+
+
+class FakeClock(object):
+    """Monotonic clock and stop event: waiting advances the clock by the timeout plus *oversleep_ns*
+    """
+    def __init__(self):
+        self.now_ns = START_NS
+        self.oversleep_ns = 0
+        self.stopped = False
+
+    def monotonic_ns(self):
+        return self.now_ns
+
+    def time_ns(self):
+        return self.now_ns + WALL_CLOCK_OFFSET_NS
+
+    def wait(self, timeout):
+        self.now_ns += int(round(timeout * 10 ** 9)) + self.oversleep_ns
+        return self.stopped
+
+    def is_set(self):
+        return self.stopped
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(deadline_scheduler.time, "monotonic_ns", clock.monotonic_ns)
+    monkeypatch.setattr(deadline_scheduler.time, "time_ns", clock.time_ns)
+    return clock
+
+
+def test_on_time_and_late_ticks(clock):
+    scheduler = DeadlineScheduler(10 * MS)
+    scheduler.start()
+
+    # first tick at start, second one after waiting a period (1 ms late)
+    assert scheduler.wait_for_next_tick(clock) == 1
+    clock.oversleep_ns = 1 * MS
+    assert scheduler.wait_for_next_tick(clock) == 1
+    assert clock.now_ns == START_NS + 11 * MS
+    assert scheduler.get_tick_time_ns() == START_NS + 10 * MS + WALL_CLOCK_OFFSET_NS
+
+    # 35 ms of work: the deadlines at 20 and 30 ms are missed, the tick of 40 ms is returned at once
+    clock.now_ns += 35 * MS
+    assert scheduler.wait_for_next_tick(clock) == 1 + 2
+    assert clock.now_ns == START_NS + 46 * MS
+    assert scheduler.get_tick_time_ns() == START_NS + 40 * MS + WALL_CLOCK_OFFSET_NS
+
+    stats = scheduler.get_stats()
+    assert stats['ticks'] == 3
+    assert stats['missed_ticks'] == 2
+    assert stats['target_rate_hz'] == pytest.approx(100.0)
+    assert stats['rate_hz'] == pytest.approx(2 / 0.046)
+    assert stats['lateness_max_ms'] == pytest.approx(6.0)
+    assert stats['lateness_mean_ms'] == pytest.approx((0 + 1 + 6) / 3)
+    # intervals of 11 and 35 ms
+    assert stats['jitter_ms'] == pytest.approx(math.sqrt((11 ** 2 + 35 ** 2) / 2 - 23 ** 2))
+
+
+def test_start_delay_and_wall_clock_start(clock):
+    scheduler = DeadlineScheduler(10 * MS)
+    scheduler.start(delay_ns=5 * MS)
+    assert scheduler.wait_for_next_tick(clock) == 1
+    assert clock.now_ns == START_NS + 5 * MS
+
+    other = DeadlineScheduler(10 * MS)
+    other.start(start_time_ns=START_NS + 20 * MS + WALL_CLOCK_OFFSET_NS)
+    assert other.wait_for_next_tick(clock) == 1
+    assert clock.now_ns == START_NS + 20 * MS
+    assert other.get_tick_time_ns() == START_NS + 20 * MS + WALL_CLOCK_OFFSET_NS
+
+
+def test_set_stop_event_returns_zero(clock):
+    scheduler = DeadlineScheduler(10 * MS)
+    scheduler.start()
+    clock.stopped = True
+
+    assert scheduler.wait_for_next_tick(clock) == 0
+    assert scheduler.get_stats()['ticks'] == 0
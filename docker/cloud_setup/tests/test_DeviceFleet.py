@@ -0,0 +1,105 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+import queue
+import threading
+import time
+
+import pytest
+from opcua import ua
+
+from opc_ua.server.OPCServer import CustomServer
+from sim_device.DeviceFleet import DeviceFleet, run_fleet_worker
+
+ENDPOINT = "opc.tcp://127.0.0.1:48492"
+OPCTAGS = ["N{}_I_PH1_RES".format(i) for i in range(4)]
+
+
+@pytest.fixture(autouse=True)
+def env(monkeypatch):
+    monkeypatch.setenv("SERVER_ENDPOINT", ENDPOINT)
+    monkeypatch.setenv("NAMESPACE", "urn:test")
+    monkeypatch.setenv("SERVER_NAME", "test")
+    monkeypatch.setenv("ENABLE_CERTIFICATE", "False")
+    monkeypatch.setenv("OPCUA_SERVER_DIR_NAME", "demo")
+    monkeypatch.setenv("AUTO_VAR_UPDATER_TIMESTAMP_PRECISION", "10")
+    monkeypatch.setenv("AUTO_VAR_UPDATER_UPDATE_PERIOD", "20")
+    monkeypatch.setenv("AUTO_VAR_UPDATER_START_THRESHOLD", "0")
+    monkeypatch.setenv("AUTO_VAR_UPDATER_MAX_WRITE_ERRORS", "3")
+    monkeypatch.setenv("SIM_DEVICE_REPORT_PERIOD", "0.2")
+    monkeypatch.delenv("SIM_DEVICE_WORKERS", raising=False)
+    monkeypatch.delenv("SCENARIO_PATH", raising=False)
+
+
+def start_server():
+    server = CustomServer()
+    server.start()
+    server.add_objects_subfolder(None, ua.Variant("demo"))
+    server.register_opc_tags(None, ua.Variant(OPCTAGS), ua.Variant(["Float"] * len(OPCTAGS)), ua.Variant("demo"))
+    return server
+
+
+@pytest.fixture
+def server():
+    server = start_server()
+    yield server
+    server.stop()
+
+
+def test_fleet_of_two_spawned_workers_writes_all_nodes(server):
+    fleet = DeviceFleet(number_of_workers=2)
+    stopper = threading.Timer(8, fleet.terminate)
+    stopper.start()
+    try:
+        fleet.start()
+    finally:
+        stopper.cancel()
+
+    stats = fleet.get_stats()
+    assert len(fleet.workers) == 2
+    assert stats['nodes'] == len(OPCTAGS)
+    assert stats['values_written'] > 0
+    assert stats['write_errors'] == 0
+    assert not any(worker.is_alive() for worker in fleet.workers)
+
+
+def wait_for_report(stats_queue, condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            report = stats_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        if condition(report):
+            return report
+    raise AssertionError("no matching report of fleet worker")
+
+
+def test_worker_restarts_after_lost_connection():
+    server = start_server()
+    nodeids = [node.nodeid.to_string() for node in server.get_folder("demo").get_variables()]
+    stats_queue = queue.Queue()
+    stop_event = threading.Event()
+    worker = threading.Thread(target=run_fleet_worker,
+                              args=(0, ENDPOINT, nodeids, OPCTAGS, len(OPCTAGS), time.time_ns(), 0.2, stats_queue,
+                                    stop_event))
+    worker.start()
+    try:
+        worker_id, nodes, written, errors, scheduler_stats = wait_for_report(stats_queue, lambda r: r[2] > 0)
+
+        # server restarts with the same nodes: the updater aborts, the worker connects again and goes on writing
+        server.stop()
+        server = None
+        time.sleep(1)
+        server = start_server()
+        wait_for_report(stats_queue, lambda r: r[3] > errors)
+        report = wait_for_report(stats_queue, lambda r: r[3] > errors and r[2] > written + 10 * len(OPCTAGS))
+
+        assert worker.is_alive()
+        assert report[2] > written
+    finally:
+        stop_event.set()
+        worker.join(timeout=10)
+        if server is not None:
+            server.stop()
+    assert not worker.is_alive()
@@ -0,0 +1,187 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+import threading
+import time
+
+import numpy as np
+
+from protection.DataHandler import DataResultWrapper
+from protection.DataSource import CustomVar, MeasTopology
+from protection.DiffCore import DiffCore, evaluate_balances, advance_fault_state_counters
+from protection.LatencyStats import LatencyStats
+from protection.MeasRingBuffer import MeasSnapshot
+
+
+def random_topology(rng, number_of_subgrids, number_of_nodes):
+    """Return MeasTopology, in which each subgrid has one slack and some further nodes, and its dense incidence matrix
+    """
+    meas_nodes_list = [CustomVar("N{}_I_PH1_RES".format(i), i, 1) for i in range(number_of_nodes)]
+    matrix = np.zeros((number_of_subgrids, number_of_nodes))
+    entries = []
+    for row in range(number_of_subgrids):
+        columns = rng.choice(number_of_nodes, size=rng.integers(1, number_of_nodes + 1), replace=False)
+        for i, column in enumerate(columns):
+            sign = -1 if i == 0 else 1
+            matrix[row, column] = sign
+            entries.append((row, int(column), sign))
+    topology = MeasTopology(meas_nodes_list, ["SUBGRID{}".format(row) for row in range(number_of_subgrids)],
+                            [1] * number_of_subgrids, entries, [[] for _ in range(number_of_subgrids)])
+    return topology, matrix
+
+
+def test_evaluate_balances_equals_loop_over_subgrids():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        topology, matrix = random_topology(rng, rng.integers(1, 8), rng.integers(1, 12))
+        values = rng.uniform(-5, 5, size=(rng.integers(1, 10), matrix.shape[1]))
+        eps_abs = 2.0
+
+        balances, faulty = evaluate_balances(topology, values, eps_abs)
+
+        assert balances.shape == (len(topology), len(values))
+        for row in range(len(topology)):
+            for slot in range(len(values)):
+                expected = sum(matrix[row, column] * values[slot, column] for column in range(matrix.shape[1]))
+                assert np.isclose(balances[row, slot], expected)
+                assert faulty[row, slot] == (abs(expected) >= eps_abs)
+
+
+def test_evaluate_balances_without_subgrids():
+    topology = MeasTopology([], [], [], [], [])
+    balances, faulty = evaluate_balances(topology, np.zeros((3, 0)), 1.0)
+    assert balances.shape == (0, 3) and faulty.shape == (0, 3)
+
+
+def advance_slot_by_slot(counters, faulty, max_faulty_states):
+    """Counter logic of the former DiffCore: one slot and subgrid at a time, a subgrid trips in each faulty slot whose
+    counter reached max_faulty_states
+    """
+    counters = list(counters)
+    trip_slots = [-1] * len(counters)
+    for slot in range(faulty.shape[1]):
+        for subgrid in range(len(counters)):
+            if faulty[subgrid, slot]:
+                if counters[subgrid] < max_faulty_states:
+                    counters[subgrid] += 1
+                if counters[subgrid] >= max_faulty_states and trip_slots[subgrid] < 0:
+                    trip_slots[subgrid] = slot
+            elif counters[subgrid] > 0:
+                counters[subgrid] -= 1
+    return counters, trip_slots
+
+
+def test_advance_fault_state_counters_equals_slot_by_slot():
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        number_of_subgrids = rng.integers(1, 6)
+        max_faulty_states = int(rng.integers(1, 6))
+        counters = rng.integers(0, max_faulty_states + 1, size=number_of_subgrids)
+        faulty = rng.random((number_of_subgrids, rng.integers(1, 15))) < rng.uniform(0.2, 0.9)
+
+        new_counters, trip_slots = advance_fault_state_counters(counters, faulty, max_faulty_states)
+        expected_counters, expected_trip_slots = advance_slot_by_slot(counters, faulty, max_faulty_states)
+
+        assert list(new_counters) == expected_counters
+        assert list(trip_slots) == expected_trip_slots
+        assert ((new_counters >= 0) & (new_counters <= max_faulty_states)).all()
+
+
+def test_advance_fault_state_counters_clips():
+    counters, trip_slots = advance_fault_state_counters(np.array([0, 3]), np.array([[False] * 4, [True] * 4]), 3)
+    assert list(counters) == [0, 3]
+    assert list(trip_slots) == [-1, 0]
+
+
+class CapturingClient(object):
+    def __init__(self):
+        self.calls = []
+
+    def set_vars(self, nodes, values):
+        self.calls.append((nodes, values))
+
+
+def test_evaluate_data_without_batch_evaluation_takes_newest_timestamp(monkeypatch):
+    monkeypatch.setenv("TIMESTAMP_PRECISION", "10")
+    monkeypatch.setenv("BATCH_EVALUATION", "False")
+    class Handler(object):
+        latency_stats = LatencyStats()
+
+    topology = MeasTopology([CustomVar("N0", 0, 1), CustomVar("N1", 1, 1)], ["SUBGRID0"], [1],
+                            [(0, 0, -1), (0, 1, 1)], [[]])
+    core = DiffCore(CapturingClient(), Handler())
+    # slots in ring buffer order after wrap-around: the newest timestamp is not the last slot
+    values = np.array([[1.0, 2.0], [7.0, 3.0], [3.0, 9.0]])
+    snapshot = MeasSnapshot(["N0", "N1"], [5, 9, 2], values, 1, np.zeros(3, dtype=np.int64))
+
+    assert core.evaluate_data(DataResultWrapper([], [], topology, snapshot)) == 1
+    np.testing.assert_allclose(core.balances, [[-4.0]])
+
+
+class FailingHandler(object):
+    """DataHandler, whose first *failures* calls of wait_for_newest_data raise *error*
+    """
+    latency_stats = LatencyStats()
+
+    def __init__(self, error, failures):
+        self.error = error
+        self.failures = failures
+        self.calls = 0
+        self.interrupted = threading.Event()
+
+    def wait_for_newest_data(self, timeout=None):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        self.interrupted.wait(0.01)
+        return None
+
+    def interrupt_waiting(self):
+        self.interrupted.set()
+
+
+def run_core(core, seconds):
+    core.start()
+    time.sleep(seconds)
+    running = core.is_running()
+    core.stop()
+    core.join(timeout=5)
+    assert not core.is_alive()
+    return running
+
+
+def test_connection_errors_back_off_and_keep_core_running(monkeypatch):
+    monkeypatch.setenv("DIFF_CORE_MAX_ERROR_BACKOFF", "0.2")
+    handler = FailingHandler(ConnectionResetError("lost connection"), 10 ** 6)
+    core = DiffCore(CapturingClient(), handler)
+
+    # waiting 0.1, 0.2, 0.2, ... s after each failure instead of retrying at once
+    assert run_core(core, 0.65)
+    assert 3 <= handler.calls <= 5
+    assert core.consecutive_errors == handler.calls
+    assert core.consecutive_evaluation_errors == 0
+
+
+def test_successful_evaluation_resets_error_counters(monkeypatch):
+    monkeypatch.setenv("DIFF_CORE_MAX_EVALUATION_ERRORS", "3")
+    handler = FailingHandler(ValueError("bug"), 2)
+    core = DiffCore(CapturingClient(), handler)
+
+    assert run_core(core, 0.5)
+    assert handler.calls > 2
+    assert core.consecutive_errors == 0
+    assert core.consecutive_evaluation_errors == 0
+
+
+def test_unexpected_errors_pause_core(monkeypatch):
+    monkeypatch.setenv("DIFF_CORE_MAX_ERROR_BACKOFF", "0.01")
+    monkeypatch.setenv("DIFF_CORE_MAX_EVALUATION_ERRORS", "3")
+    handler = FailingHandler(ValueError("bug"), 10 ** 6)
+    core = DiffCore(CapturingClient(), handler)
+
+    assert not run_core(core, 0.3)
+    assert handler.calls == 3
+    assert core.consecutive_evaluation_errors == 3
+
+    core.resume()
+    assert core.consecutive_evaluation_errors == 0
@@ -0,0 +1,84 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+import threading
+
+import pytest
+
+from protection.LatencyStats import LatencyHistogram, LatencyStats
+
+US = 1000   # in ns
+# upper edges of the buckets the latencies below fall into (20 buckets per decade: 10^(k/20) µs)
+EDGE_1050_US = 10 ** (61 / 20)
+EDGE_50_MS = 10 ** (94 / 20)
+
+
+def test_summary_of_known_latencies():
+    histogram = LatencyHistogram()
+    histogram.record_many([1050 * US] * 98)
+    histogram.record(50000 * US)
+    histogram.record(50000 * US)
+
+    summary = histogram.summary()
+
+    assert summary['count'] == 100
+    assert summary['mean_ms'] == pytest.approx((98 * 1.05 + 2 * 50) / 100)
+    assert summary['p50_ms'] == pytest.approx(EDGE_1050_US / 1000)
+    # the upper bucket edge is limited by the maximum
+    assert EDGE_50_MS > 50000
+    assert summary['p99_ms'] == pytest.approx(50.0)
+    assert summary['max_ms'] == pytest.approx(50.0)
+
+
+def test_overflow_and_negative_latencies():
+    histogram = LatencyHistogram(max_latency_us=10 ** 3)
+    histogram.record(-5 * US)           # clock skew: counted as 0
+    histogram.record(10 ** 6 * US)      # above the highest bucket
+
+    summary = histogram.summary()
+
+    assert summary['count'] == 2
+    assert summary['p50_ms'] == pytest.approx(0.001)     # upper edge of the first bucket (1 µs)
+    assert summary['p99_ms'] == pytest.approx(1000.0)    # overflow bucket returns the maximum
+    assert summary['max_ms'] == pytest.approx(1000.0)
+
+
+def test_empty_histogram():
+    assert LatencyHistogram().summary() == {'count': 0, 'mean_ms': 0.0, 'p50_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+
+
+def test_reset_drops_previous_records():
+    stats = LatencyStats()
+    stats.record('ingest', 80000 * US)
+    stats.record_many('evaluation', [1050 * US] * 3)
+
+    stats.reset()
+    assert all(summary['count'] == 0 and summary['max_ms'] == 0.0 for summary in stats.get_stats().values())
+
+    stats.record('ingest', 1050 * US)
+    summary = stats.get_stats()['ingest']
+    assert summary['count'] == 1
+    assert summary['max_ms'] == pytest.approx(1.05)
+    assert summary['p99_ms'] == pytest.approx(1.05)
+
+
+def test_summary_is_consistent_while_recording():
+    histogram = LatencyHistogram()
+    stop = threading.Event()
+
+    def write():
+        while not stop.is_set():
+            histogram.record_many([1050 * US] * 10)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        for _ in range(2000):
+            summary = histogram.summary()
+            if summary['count'] > 0:
+                # count and sum of the same records: the mean equals the one recorded latency
+                assert summary['mean_ms'] == pytest.approx(1.05)
+                assert summary['count'] % 10 == 0
+    finally:
+        stop.set()
+        writer.join()
@@ -0,0 +1,129 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+import random
+
+import numpy as np
+
+from protection.MeasRingBuffer import MeasRingBuffer
+
+COLUMNS = ["A_I_PH1_RES", "B_I_PH1_RES", "C_I_PH1_RES"]
+
+
+def random_samples(seed, number_of_samples, number_of_timestamps, nan_share=0.05):
+    """Return samples (timestamp, column, value) in random order; timestamps arrive roughly in ascending order
+    """
+    rng = random.Random(seed)
+    samples = []
+    for i in range(number_of_samples):
+        timestamp = min(int(i * number_of_timestamps / number_of_samples) + rng.randint(-2, 2), number_of_timestamps)
+        value = float("nan") if rng.random() < nan_share else rng.uniform(-10, 10)
+        samples.append((max(timestamp, 0), rng.randrange(len(COLUMNS)), value))
+    return samples
+
+
+def assert_same_state(buffer, other):
+    slots = buffer.occupied_slots()
+    other_slots = other.occupied_slots()
+    assert [buffer._timestamps[slot] for slot in slots] == [other._timestamps[slot] for slot in other_slots]
+    np.testing.assert_array_equal(buffer._values[slots], other._values[other_slots])
+    np.testing.assert_array_equal(buffer._fill[slots], other._fill[other_slots])
+    assert buffer.has_complete_slot() == other.has_complete_slot()
+
+    snapshot = buffer.pop_complete_snapshot()
+    other_snapshot = other.pop_complete_snapshot()
+    assert snapshot.timestamps == other_snapshot.timestamps
+    np.testing.assert_array_equal(snapshot.values, other_snapshot.values)
+
+
+def replay(samples, capacity, batch_size):
+    """Store *samples* by insert (batch_size 1) or insert_many and return buffer and timestamps of completed slots
+    """
+    buffer = MeasRingBuffer(COLUMNS, capacity)
+    completed = []
+    for i in range(0, len(samples), batch_size):
+        batch = samples[i:i + batch_size]
+        if batch_size == 1:
+            timestamp, column, value = batch[0]
+            if buffer.insert(timestamp, column, value):
+                completed.append(timestamp)
+        else:
+            completed.extend(buffer.insert_many(*zip(*batch)))
+    return buffer, completed
+
+
+def test_insert_many_equals_insert():
+    for seed in range(20):
+        samples = random_samples(seed, 300, 60)
+        for capacity in (100, 10, 3):   # without and with wrap-around
+            for batch_size in (2, 7, 50, 300):
+                buffer, completed = replay(samples, capacity, 1)
+                other, other_completed = replay(samples, capacity, batch_size)
+                assert sorted(completed) == sorted(other_completed)
+                assert_same_state(buffer, other)
+
+
+def test_burst_larger_than_capacity_keeps_complete_slots():
+    number_of_timestamps = 600
+    timestamps = [timestamp for timestamp in range(number_of_timestamps) for _ in COLUMNS]
+    columns = list(range(len(COLUMNS))) * number_of_timestamps
+    values = [float(timestamp) for timestamp in timestamps]
+    for batch_size in (1, 7, len(values)):
+        buffer = MeasRingBuffer(COLUMNS, 100)
+        for i in range(0, len(values), batch_size):
+            buffer.insert_many(timestamps[i:i + batch_size], columns[i:i + batch_size], values[i:i + batch_size])
+
+        assert buffer.has_complete_slot()
+        snapshot = buffer.pop_complete_snapshot()
+        assert snapshot.timestamps == list(range(number_of_timestamps))
+        np.testing.assert_array_equal(snapshot.values, np.repeat(np.arange(number_of_timestamps, dtype=float), 3).reshape(-1, 3))
+        assert len(snapshot.completed_ns) == number_of_timestamps
+        assert len(buffer) == 0 and not buffer.has_complete_slot()
+        assert buffer.dropped_slots == 0
+
+
+def test_pending_slots_are_dropped_beyond_pending_capacity():
+    buffer = MeasRingBuffer(COLUMNS, 2, pending_capacity=3)
+    for timestamp in range(10):
+        buffer.insert_many([timestamp] * 3, [0, 1, 2], [1.0, 2.0, 3.0])
+
+    assert buffer.pop_complete_snapshot().timestamps == [5, 6, 7, 8, 9]
+    assert buffer.dropped_slots == 5
+
+
+def test_insert_completes_slot_once():
+    buffer = MeasRingBuffer(COLUMNS, 10)
+    assert not buffer.insert(0, 0, 1.0)
+    assert not buffer.insert(0, 1, 2.0)
+    assert not buffer.insert(0, 1, 3.0)     # overwrite does not count as new entry
+    assert not buffer.insert(0, 2, float("nan"))
+    assert buffer.insert(0, 2, 4.0)
+    assert not buffer.insert(0, 2, 5.0)
+
+    snapshot = buffer.pop_complete_snapshot()
+    assert snapshot.timestamps == [0]
+    np.testing.assert_array_equal(snapshot.values, [[1.0, 3.0, 5.0]])
+    assert len(buffer) == 0 and not buffer.has_complete_slot()
+
+
+def test_missing_value_does_not_count_as_entry():
+    buffer = MeasRingBuffer(COLUMNS, 10)
+    assert not buffer.insert(0, 0, None)
+    assert not buffer.insert(0, 1, 2)
+    assert not buffer.insert(0, 2, 3.0)
+    assert not buffer.has_complete_slot()
+    assert buffer.insert(0, 0, np.float32(1.0))
+
+    assert buffer.insert_many([1, 1, 1, 1], [0, 1, 2, 2], [1.0, None, 3.0, 4.0]) == []
+    assert not buffer.insert(1, 1, None)
+
+    np.testing.assert_array_equal(buffer.pop_complete_snapshot().values, [[1.0, 2.0, 3.0]])
+
+
+def test_pop_complete_snapshot_evicts_older_slots():
+    buffer = MeasRingBuffer(COLUMNS, 10)
+    buffer.insert_many([0, 1, 1, 1, 2], [0, 0, 1, 2, 0], [1.0, 2.0, 3.0, 4.0, 5.0])
+
+    snapshot = buffer.pop_complete_snapshot()
+    assert snapshot.timestamps == [1]
+    assert [buffer._timestamps[slot] for slot in buffer.occupied_slots()] == [2]
@@ -0,0 +1,143 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+import pytest
+from opcua import ua
+
+from opc_ua.client.OPCClient import CustomClient
+from opc_ua.client.subscription import SubscriptionSettings
+from opc_ua.server.OPCServer import CustomServer
+from protection.DataSource import CustomVar
+from protection.OPCClient_DataHandler import OPCClientDataHandler
+
+ENDPOINT = "opc.tcp://127.0.0.1:48491"
+OPCTAGS = ["A_I_PH1_RES", "B_I_PH1_RES", "C_I_PH1_RES"]
+
+
+def call(method, *args):
+    """Call *method* of server like an OPC-client, i.e. with Variant arguments
+    """
+    return method(None, *[ua.Variant(arg) for arg in args])
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("SERVER_ENDPOINT", ENDPOINT)
+    monkeypatch.setenv("NAMESPACE", "urn:test")
+    monkeypatch.setenv("SERVER_NAME", "test")
+    monkeypatch.setenv("ENABLE_CERTIFICATE", "False")
+    monkeypatch.setenv("DEBUG_MODE_PRINT", "False")
+    server = CustomServer()
+    server.start()
+    try:
+        call(server.add_objects_subfolder, "demo")
+        call(server.register_opc_tags, OPCTAGS, ["Float"] * len(OPCTAGS), "demo")
+        yield server
+    finally:
+        server.stop()
+
+
+def monitored_items_at_server(server):
+    """Return ids of the monitored items of each subscription at *server*
+    """
+    subscriptions = server.server.iserver.subscription_service.subscriptions
+    return {subscription_id: set(subscription.monitored_item_srv._monitored_items)
+            for subscription_id, subscription in subscriptions.items()}
+
+
+class Target(object):
+    def update_data_batch(self, notifications):
+        pass
+
+
+@pytest.fixture
+def client(server):
+    client = OPCClientDataHandler(server_endpoint=ENDPOINT)
+    client.start()
+    try:
+        catalog = client.get_node_catalog("demo")
+        variables = [CustomVar(opctag, node.nodeid) for opctag, node in catalog.items()]
+        client.make_subscription(Target(), "demo", variables, "I_MEAS", SubscriptionSettings(10))
+        yield client
+    finally:
+        client.stop()
+
+
+def test_reconnect_subscribes_again(client):
+    old_subscription = client.subscriptions["I_MEAS"][0]
+
+    client.reconnect()
+
+    subscription, subscription_handle, subscribed_nodes = client.subscriptions["I_MEAS"]
+    assert subscription is not old_subscription
+    assert len(subscribed_nodes) == len(OPCTAGS)
+    assert all(not isinstance(handle, ua.StatusCode) for handle in subscription_handle)
+
+
+def test_reconnect_fails_if_server_recreated_nodes(server, client):
+    folder = server.get_folder("demo")
+    server.server.delete_nodes(folder.get_variables())
+    call(server.register_opc_tags, OPCTAGS, ["Float"] * len(OPCTAGS), "demo")
+
+    with pytest.raises(ua.UaError):
+        client.reconnect()
+    # catalog was browsed again, thus the full restart subscribes the new nodes
+    assert sorted(client.get_node_catalog("demo").browse_names) == sorted(OPCTAGS)
+    assert all(var.nodeid in client.get_node_catalog("demo") for var in folder.get_variables())
+
+
+def test_check_monitored_items_raises_on_status_code(client):
+    nodes = client.subscriptions["I_MEAS"][2]
+    CustomClient._check_monitored_items(nodes, [1, 2, 3])
+    with pytest.raises(ua.UaError):
+        CustomClient._check_monitored_items(nodes, [1, ua.StatusCode(ua.StatusCodes.BadNodeIdUnknown), 3])
+
+
+def test_removal_of_monitored_items_is_deferred(server, client):
+    target, dir_name, variables, settings = client.subscription_requests["I_MEAS"]
+    subscription = client.subscriptions["I_MEAS"][0]
+
+    client.make_subscription(target, dir_name, variables[:2], "I_MEAS", settings, defer_removal=True)
+
+    # the removed node is still monitored until the receiver switched to the new nodes
+    assert len(client.subscriptions["I_MEAS"][2]) == 2
+    assert len(monitored_items_at_server(server)[subscription.subscription_id]) == 3
+
+    client.remove_deferred()
+
+    assert len(monitored_items_at_server(server)[subscription.subscription_id]) == 2
+    assert client.deferred_removals == []
+
+
+def test_changed_nodes_update_monitored_items_of_subscription(server, client):
+    call(server.register_opc_tags, ["D_I_PH1_RES"], ["Float"], "demo")
+    catalog = client.get_node_catalog("demo", refresh=True)
+    target, dir_name, variables, settings = client.subscription_requests["I_MEAS"]
+    subscription, handle, subscribed_nodes = client.subscriptions["I_MEAS"]
+    handle_of_nodeid = {node.nodeid: h for node, h in zip(subscribed_nodes, handle)}
+    removed, kept = variables[0], variables[1:]
+    added = CustomVar("D_I_PH1_RES", catalog.get_node("D_I_PH1_RES").nodeid)
+
+    client.make_subscription(target, dir_name, kept + [added], "I_MEAS", settings)
+
+    new_subscription, new_handle, new_subscribed_nodes = client.subscriptions["I_MEAS"]
+    assert new_subscription is subscription
+    assert [node.nodeid for node in new_subscribed_nodes] == [var.nodeid for var in kept + [added]]
+    # kept nodes keep their monitored items, only the delta is created and deleted
+    assert new_handle[:len(kept)] == [handle_of_nodeid[var.nodeid] for var in kept]
+    items = monitored_items_at_server(server)[subscription.subscription_id]
+    assert items == set(new_handle)
+    assert handle_of_nodeid[removed.nodeid] not in items
+
+
+def test_changed_settings_replace_subscription(server, client):
+    target, dir_name, variables, settings = client.subscription_requests["I_MEAS"]
+    subscription = client.subscriptions["I_MEAS"][0]
+
+    client.make_subscription(target, dir_name, variables, "I_MEAS", SubscriptionSettings(20))
+
+    new_subscription, new_handle, new_subscribed_nodes = client.subscriptions["I_MEAS"]
+    assert new_subscription is not subscription
+    assert len(new_subscribed_nodes) == len(OPCTAGS)
+    assert list(monitored_items_at_server(server)) == [new_subscription.subscription_id]
+    assert monitored_items_at_server(server)[new_subscription.subscription_id] == set(new_handle)
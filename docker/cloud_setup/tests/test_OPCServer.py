@@ -0,0 +1,68 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+import pytest
+from opcua import ua
+
+from opc_ua.server.OPCServer import CustomServer
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("SERVER_ENDPOINT", "opc.tcp://127.0.0.1:48490")
+    monkeypatch.setenv("NAMESPACE", "urn:test")
+    monkeypatch.setenv("SERVER_NAME", "test")
+    monkeypatch.setenv("ENABLE_CERTIFICATE", "False")
+    server = CustomServer()
+    server.start()
+    try:
+        call(server.add_objects_subfolder, "demo")
+        yield server
+    finally:
+        server.stop()
+
+
+def call(method, *args):
+    """Call *method* of server like an OPC-client, i.e. with Variant arguments
+    """
+    return method(None, *[ua.Variant(arg) for arg in args])
+
+
+def test_register_opc_tags_links_writable_variables_to_folder(server):
+    opctags = ["TAG{}_I_PH1_RES".format(i) for i in range(50)]
+    call(server.register_opc_tags, opctags, ["Float"] * len(opctags), "demo")
+
+    variables = server.get_folder("demo").get_variables()
+    assert sorted(var.get_browse_name().Name for var in variables) == sorted(opctags)
+    for var in variables[:3]:
+        assert var.get_parent().nodeid == server.get_folder("demo").nodeid
+        assert var.get_data_value().SourceTimestamp is not None
+        assert var.get_access_level() == {ua.AccessLevel.CurrentRead, ua.AccessLevel.CurrentWrite}
+
+
+def test_register_opc_tags_rolls_back_on_partial_failure(server, monkeypatch):
+    isession = server.server.iserver.isession
+    add_nodes = isession.add_nodes
+    added = []
+
+    def add_nodes_failing_last(items):
+        results = add_nodes(items[:-1])
+        added.extend(result.AddedNodeId for result in results)
+        failed = ua.AddNodesResult()
+        failed.StatusCode = ua.StatusCode(ua.StatusCodes.BadNodeIdExists)
+        return results + [failed]
+
+    monkeypatch.setattr(isession, "add_nodes", add_nodes_failing_last)
+    with pytest.raises(ua.UaError):
+        call(server.register_opc_tags, ["A_I_PH1_RES", "B_I_PH1_RES", "C_I_PH1_RES"], ["Float"] * 3, "demo")
+
+    # neither variables within folder nor orphan nodes are left
+    assert server.get_folder("demo").get_variables() == []
+    assert len(added) == 2
+    assert all(nodeid not in server.server.iserver.aspace for nodeid in added)
+
+
+def test_register_opc_tags_checks_parent(server):
+    server.folders["missing"] = server.server.get_node(ua.NodeId(999999, server.idx))
+    with pytest.raises(ua.UaError):
+        call(server.register_opc_tags, ["A_I_PH1_RES"], ["Float"], "missing")
@@ -0,0 +1,81 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from protection.ReplayHarness import ReplayHarness
+
+TOPOLOGY_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "topology",
+                             "TopologyFile_demonstrator.json")
+OPCTAGS = ["TRAFO_I_PH1_RES", "LAST_I_PH1_RES", "PV_I_PH1_RES", "PV_LIMIT_CTRL", "NETZ_PH1_FEHLER_COUNTER",
+           "UPDATE_REQUEST_TOPOLOGY", "RUN_ONLINE_GRID_PROTECTION"]
+NUMBER_OF_SLOTS = 150       # more time slots than the ring buffer of DataHandler holds
+FAULT_SLOTS = range(120, 130)
+
+
+@pytest.fixture(autouse=True)
+def env(monkeypatch):
+    monkeypatch.setenv("TIMESTAMP_PRECISION", "10")
+    monkeypatch.setenv("NOMINAL_CURRENT", "2")
+    monkeypatch.setenv("CURRENT_EPS", "0.05")
+    monkeypatch.setenv("MAX_FAULTY_STATES", "5")
+    monkeypatch.setenv("BATCH_EVALUATION", "True")
+    monkeypatch.delenv("REPLAY_BATCH_SIZE", raising=False)
+
+
+def write_files(path, integer_timestamps):
+    """Write catalog and records of the demonstrator: one sample per I-measurement node and 10 ms slot, the load
+    current deviates within FAULT_SLOTS
+    """
+    catalog_path = str(path / "catalog.csv")
+    with open(catalog_path, "w") as f:
+        f.write("nodeid,browse_name\n")
+        for i, opctag in enumerate(OPCTAGS):
+            f.write("ns=2;i={},{}\n".format(i + 1, opctag))
+
+    records_path = str(path / "records.csv")
+    start = datetime(2020, 1, 1)
+    with open(records_path, "w") as f:
+        f.write("nodeid,source_timestamp,value\n")
+        for slot in range(NUMBER_OF_SLOTS):
+            timestamp = start + timedelta(milliseconds=10 * slot)
+            if integer_timestamps:
+                source_timestamp = str((timestamp - datetime(1970, 1, 1)) // timedelta(microseconds=1) * 1000)
+            else:
+                source_timestamp = timestamp.isoformat()    # without fraction of a second at full seconds
+            load = 1.5 if slot in FAULT_SLOTS else 1.0
+            for nodeid, value in (("ns=2;i=1", 2.0), ("ns=2;i=2", load), ("ns=2;i=3", 1.0)):
+                f.write("{},{},{}\n".format(nodeid, source_timestamp, value))
+    return catalog_path, records_path
+
+
+@pytest.mark.parametrize("integer_timestamps", [False, True])
+def test_replay_trips_demonstrator(tmp_path, integer_timestamps):
+    catalog_path, records_path = write_files(tmp_path, integer_timestamps)
+    harness = ReplayHarness(TOPOLOGY_PATH, catalog_path)
+
+    stats = harness.run(records_path)
+
+    assert stats['records'] == 3 * NUMBER_OF_SLOTS
+    assert stats['ignored_records'] == 0
+    assert stats['evaluations'] == stats['evaluated_slots'] == NUMBER_OF_SLOTS
+    # the subgrid trips when the 5th faulty state is counted and is switched off in each further faulty slot
+    assert stats['actuations'] == len(FAULT_SLOTS) - 4
+    assert all(opctags == ["PV_LIMIT_CTRL"] for replay_time, opctags, values in harness.opc_client.actuations)
+    assert harness.opc_client.actuations[0][0] == datetime(2020, 1, 1) + timedelta(milliseconds=10 * 124)
+
+
+@pytest.mark.parametrize("batch_size", [7, 600])    # 600: all records at once, more slots than ring buffer capacity
+def test_replay_with_large_batches_evaluates_every_slot(tmp_path, batch_size):
+    catalog_path, records_path = write_files(tmp_path, False)
+    harness = ReplayHarness(TOPOLOGY_PATH, catalog_path, batch_size=batch_size)
+
+    stats = harness.run(records_path)
+
+    assert stats['evaluated_slots'] == NUMBER_OF_SLOTS
+    # one evaluation covers several slots, hence a trip within a batch is one actuation
+    assert stats['actuations'] >= 1
+    assert harness.opc_client.values["PV_LIMIT_CTRL"] == 0
@@ -0,0 +1,102 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from sim_device import SimulatedDeviceManager
+from sim_device.Scenario import Scenario
+
+COLUMNS = ["A_I_PH1_RES", "B_I_PH1_RES", "C_I_PH1_RES"]
+
+
+@pytest.fixture
+def values():
+    return np.arange(12, dtype=np.float32).reshape(4, len(COLUMNS))
+
+
+def test_saved_scenario_is_read_memory_mapped(tmp_path, values):
+    Scenario.save(str(tmp_path), COLUMNS, values, 2.5)
+
+    scenario = Scenario(str(tmp_path))
+
+    assert scenario.period_ns == 2500 * 1000
+    assert scenario.columns == COLUMNS
+    assert len(scenario) == 4
+    assert isinstance(scenario.values, np.memmap)
+    assert not scenario.values.flags.writeable
+    np.testing.assert_array_equal(scenario.values, values)
+    assert sorted(os.listdir(str(tmp_path))) == [Scenario.META_FILE, Scenario.VALUES_FILE]
+
+
+def test_values_of_selected_columns(tmp_path, values):
+    Scenario.save(str(tmp_path), COLUMNS, values, 10)
+    scenario = Scenario(str(tmp_path))
+
+    column_indices = scenario.get_column_indices(["C_I_PH1_RES", "A_I_PH1_RES"])
+    np.testing.assert_array_equal(column_indices, [2, 0])
+    step_values = scenario.get_values(3, column_indices)
+    assert step_values.dtype == float
+    np.testing.assert_array_equal(step_values, [11.0, 9.0])
+    # nodes without a column are marked by -1
+    np.testing.assert_array_equal(scenario.get_column_indices(["X_I_PH1_RES", "B_I_PH1_RES"]), [-1, 1])
+
+
+def test_save_replaces_existing_scenario(tmp_path, values):
+    Scenario.save(str(tmp_path), COLUMNS, values, 10)
+    Scenario.save(str(tmp_path), COLUMNS[:1], values[:2, :1] + 100, 20)
+
+    scenario = Scenario(str(tmp_path))
+
+    assert scenario.columns == COLUMNS[:1]
+    assert scenario.period_ns == 20 * 1000 * 1000
+    np.testing.assert_array_equal(scenario.values, [[100.0], [103.0]])
+
+
+def test_save_rejects_values_not_matching_columns(tmp_path, values):
+    with pytest.raises(ValueError):
+        Scenario.save(str(tmp_path), COLUMNS[:2], values, 10)
+    with pytest.raises(ValueError):
+        Scenario.save(str(tmp_path), COLUMNS, values[0], 10)
+
+
+def rewrite_meta(path, **changes):
+    meta_path = os.path.join(path, Scenario.META_FILE)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta.update(changes)
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+
+@pytest.mark.parametrize("changes", [{"version": Scenario.VERSION + 1}, {"columns": COLUMNS[:2]}, {"period_ms": 0}])
+def test_invalid_scenario_is_rejected(tmp_path, values, changes):
+    Scenario.save(str(tmp_path), COLUMNS, values, 10)
+    rewrite_meta(str(tmp_path), **changes)
+
+    with pytest.raises(ValueError):
+        Scenario(str(tmp_path))
+
+
+def test_empty_scenario_is_rejected(tmp_path):
+    Scenario.save(str(tmp_path), COLUMNS, np.zeros((0, len(COLUMNS))), 10)
+
+    with pytest.raises(ValueError):
+        Scenario(str(tmp_path))
+
+
+def test_scenario_path_is_relative_to_parent_of_working_directory(tmp_path, values, monkeypatch):
+    Scenario.save(str(tmp_path / "data" / "scenario"), COLUMNS, values, 10)
+    working_dir = tmp_path / "sim_device"
+    working_dir.mkdir()
+    monkeypatch.chdir(str(working_dir))
+    monkeypatch.setenv("SCENARIO_PATH", "/data/scenario")
+    monkeypatch.setenv("AUTO_VAR_UPDATER_TIMESTAMP_PRECISION", "10")
+
+    updater = SimulatedDeviceManager.create_var_updater(list(COLUMNS), None, 0, browse_names=COLUMNS)
+
+    assert isinstance(updater, SimulatedDeviceManager.ScenarioPlayer)
+    assert updater.scenario.path == str(tmp_path / "data" / "scenario")
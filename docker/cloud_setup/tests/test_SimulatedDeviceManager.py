@@ -0,0 +1,48 @@
+#  Copyright (c) 2019.
+#  Author: Sebastian Krahmer
+
+import pytest
+
+from sim_device.SimulatedDeviceManager import DeviceManager, VarUpdater
+
+
+class FailingClient(object):
+    def __init__(self):
+        self.writes = 0
+
+    def write_values(self, nodes, values, source_timestamp):
+        self.writes += 1
+        raise ConnectionError("connection lost")
+
+
+@pytest.fixture(autouse=True)
+def env(monkeypatch):
+    monkeypatch.setenv("AUTO_VAR_UPDATER_TIMESTAMP_PRECISION", "10")
+    monkeypatch.setenv("AUTO_VAR_UPDATER_UPDATE_PERIOD", "1")
+    monkeypatch.setenv("AUTO_VAR_UPDATER_MAX_WRITE_ERRORS", "3")
+    monkeypatch.setenv("ENABLE_CERTIFICATE", "False")
+    monkeypatch.setenv("CERTIFICATE_PATH_CLIENT_CERT", "")
+    monkeypatch.setenv("CERTIFICATE_PATH_CLIENT_PRIVATE_KEY", "")
+
+
+def test_var_updater_aborts_after_failed_writes_in_a_row():
+    client = FailingClient()
+    vup = VarUpdater([object(), object()], client, 0, browse_names=["A_RES", "B_RES"])
+    vup.start()
+    vup.join(timeout=5)
+
+    assert not vup.is_alive()
+    assert vup.aborted
+    assert vup.write_errors == client.writes == 3
+
+
+def test_stop_auto_updater_joins_thread():
+    manager = DeviceManager()
+    manager.stop_auto_updater()     # no updater yet
+
+    manager.vup = VarUpdater([object()], FailingClient(), 60 * 1000 * 1000 * 1000, browse_names=["A_RES"])
+    manager.vup.start()
+    manager.stop_auto_updater()
+
+    assert not manager.vup.is_alive()
+    assert not manager.vup.aborted